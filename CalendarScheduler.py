@@ -2,17 +2,43 @@ from __future__ import print_function
 import os.path
 from datetime import datetime, timedelta, time
 from dateutil import parser, tz
+from dateutil.rrule import rrulestr
 import pytz
 import calendar
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
 import time as time_module
+import logging
+import numpy as np
 import functools
+import bisect
+import hashlib
+from collections import OrderedDict
+from array import array
+import threading
+import queue
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
 
 # --- Google Calendar API scope ---
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 
+# --- Partial response: only the event fields the busy-block conversion reads ---
+LEAN_EVENT_FIELDS = ('nextPageToken,nextSyncToken,'
+                     'items(id,status,start,end,transparency,attendees(self,responseStatus))')
+# ...plus what local recurrence expansion needs from masters and their exceptions
+RECURRING_EVENT_FIELDS = ('nextPageToken,nextSyncToken,'
+                          'items(id,status,start,end,transparency,attendees(self,responseStatus),'
+                          'recurrence,recurringEventId,originalStartTime)')
+# Fetch recurring series as masters and expand them locally in the event store and streaming paths
+EXPAND_RECURRING = os.environ.get('CALENDAR_SCHEDULER_EXPAND_RECURRING', '') == '1'
+
 # --- Timezone alias mapping ---
 TIMEZONE_ALIASES = {
     "est": "US/Eastern",
@@ -77,307 +103,1501 @@ def get_user_preferences():
 
     return local_tz, start_time, end_time, event_length, buffer_minutes
 
-# Cache the busy times results
-@functools.lru_cache(maxsize=2)  # Increased cache size to handle both this week and next week
-def get_busy_times(service, calendar_id, local_tz, buffer_minutes, start_date=None, end_date=None):
-    start_time = time_module.time()
+# --- Attach a zone to a naive local time ---
+def localize(local_tz, naive):
+    # pytz zones need localize() for the right offset; tzinfo= would attach LMT
+    if hasattr(local_tz, 'localize'):
+        return local_tz.localize(naive)
+    return naive.replace(tzinfo=local_tz)
+
+# --- Workday boundaries as epoch seconds ---
+@functools.lru_cache(maxsize=256)
+def workday_table(local_tz, work_start, work_end, start_date, end_date):
+    """Start and end instants of every weekday's working hours in [start_date, end_date].
+
+    Returns parallel tuples ``(days, starts, ends)`` with the bounds in epoch
+    seconds, each localized on its own date so DST changes land on the
+    right day. Built once per zone, hours and range, so callers compare
+    integers instead of constructing datetimes per day or per block.
+    """
+    days, starts, ends = [], [], []
+    day = start_date
+    while day <= end_date:
+        if day.weekday() < 5:
+            days.append(day)
+            starts.append(int(localize(local_tz, datetime.combine(day, work_start)).timestamp()))
+            ends.append(int(localize(local_tz, datetime.combine(day, work_end)).timestamp()))
+        day += timedelta(days=1)
+    return tuple(days), tuple(starts), tuple(ends)
+
+# --- Resolve the UTC range to query ---
+def get_query_range(local_tz, start_date=None, end_date=None):
     now = datetime.now(local_tz)
-    
+
     # Use provided date range or default to this week and next week
     if start_date is None:
         # Calculate start and end of this week
         this_week_start = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
         this_week_end = this_week_start + timedelta(days=7)
-        
+
         # Calculate start and end of next week
         days_until_next_monday = (7 - now.weekday()) % 7
         if days_until_next_monday == 0:  # If today is Monday, add 7 days
             days_until_next_monday = 7
         next_week_start = (now + timedelta(days=days_until_next_monday)).replace(hour=0, minute=0, second=0, microsecond=0)
         next_week_end = next_week_start + timedelta(days=7)
-        
+
         # Convert to UTC for API call
         start_utc = this_week_start.astimezone(tz.UTC)
         end_utc = next_week_end.astimezone(tz.UTC)
     else:
         # Use provided date range
-        start_dt = datetime.combine(start_date, time(0, 0), tzinfo=local_tz)
-        end_dt = datetime.combine(end_date, time(23, 59, 59), tzinfo=local_tz)
-        
+        start_dt = localize(local_tz, datetime.combine(start_date, time(0, 0)))
+        end_dt = localize(local_tz, datetime.combine(end_date, time(23, 59, 59)))
+
         # Convert to UTC for API call
         start_utc = start_dt.astimezone(tz.UTC)
         end_utc = end_dt.astimezone(tz.UTC)
 
-    print(f"Local timezone: {local_tz}")
-    print(f"Current time in local timezone: {now}")
-    print(f"API call time range:")
-    print(f"Start in UTC: {start_utc}")
-    print(f"End in UTC: {end_utc}")
+    return now, start_utc, end_utc
+
+# --- Stage timing shared by the fetch and window functions ---
+def _record_stage(stage, started):
+    elapsed = time_module.perf_counter() - started
+    metrics.record(stage, elapsed)
+    logger.info("%s took %.2f seconds", stage, elapsed)
+
+# --- Look up our access level on a calendar ---
+def get_access_level(service, calendar_id):
+    try:
+        metrics.count('api_calls')
+        with metrics.span('calendar_metadata', calendar_id=calendar_id):
+            calendar = service.calendars().get(calendarId=calendar_id).execute()
+        access_level = calendar.get('accessRole', 'unknown')
+        logger.debug("Calendar access level: %s", access_level)
+    except Exception as e:
+        logger.warning("Could not get calendar details: %s", e)
+        access_level = 'unknown'
+    return access_level
+
+# --- Free/busy query, shaped like events so the same conversion applies ---
+# The API accepts at most this many calendars per freebusy().query
+FREEBUSY_MAX_ITEMS = 50
+
+def _freebusy_request(service, calendar_ids, start_utc, end_utc):
+    """One freebusy().query for up to FREEBUSY_MAX_ITEMS calendars.
+
+    Returns {calendar_id: events}, with None for calendars the API reported
+    an error for (e.g. no free/busy access).
+    """
+    freebusy_request = {
+        "timeMin": start_utc.isoformat(),
+        "timeMax": end_utc.isoformat(),
+        "items": [{"id": calendar_id} for calendar_id in calendar_ids]
+    }
+    metrics.count('api_calls')
+    metrics.count('freebusy_queries')
+    with metrics.span('freebusy', calendars=len(calendar_ids)):
+        freebusy_result = service.freebusy().query(body=freebusy_request).execute()
+
+    results = {}
+    for calendar_id in calendar_ids:
+        entry = freebusy_result.get('calendars', {}).get(calendar_id, {})
+        if entry.get('errors'):
+            logger.warning("No free/busy for %s: %s", calendar_id, entry['errors'][0].get('reason'))
+            results[calendar_id] = None
+            continue
+        busy = entry.get('busy', [])
+        logger.info("Found %d busy blocks from free/busy for %s", len(busy), calendar_id)
+        # Convert free/busy blocks to events format
+        results[calendar_id] = [{
+            'start': {'dateTime': block['start']},
+            'end': {'dateTime': block['end']},
+            'transparency': 'opaque'  # Mark as busy time
+        } for block in busy]
+    return results
+
+def query_freebusy(service, calendar_id, start_utc, end_utc):
+    return _freebusy_request(service, [calendar_id], start_utc, end_utc)[calendar_id] or []
+
+def query_freebusy_batched(service_factory, calendar_ids, start_utc, end_utc, max_workers=4):
+    """Free/busy for any number of calendars, FREEBUSY_MAX_ITEMS per query, chunks run concurrently."""
+    calendar_ids = list(dict.fromkeys(calendar_ids))
+    chunks = [calendar_ids[i:i + FREEBUSY_MAX_ITEMS] for i in range(0, len(calendar_ids), FREEBUSY_MAX_ITEMS)]
+    if not chunks:
+        return {}
+
+    def fetch(chunk):
+        with service_factory() as service:
+            return _freebusy_request(service, chunk, start_utc, end_utc)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as pool:
+        for chunk_results in pool.map(fetch, chunks):
+            results.update(chunk_results)
+    return results
+
+# --- Compact busy block ---
+class BusyBlock:
+    """A busy interval stored as epoch seconds plus a shared time zone.
+
+    Unpacks like the old ``(start, end)`` tuple of datetimes; the datetimes
+    are only built when something asks for them.
+    """
+    __slots__ = ('start_ts', 'end_ts', 'tz')
+
+    def __init__(self, start_ts, end_ts, tz):
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.tz = tz
+
+    @classmethod
+    def from_datetimes(cls, start, end, tz):
+        return cls(int(start.timestamp()), int(end.timestamp()), tz)
+
+    @property
+    def start(self):
+        return datetime.fromtimestamp(self.start_ts, self.tz)
+
+    @property
+    def end(self):
+        return datetime.fromtimestamp(self.end_ts, self.tz)
+
+    def __iter__(self):
+        yield self.start
+        yield self.end
+
+    def __lt__(self, other):
+        if self.start_ts != other.start_ts:
+            return self.start_ts < other.start_ts
+        return self.end_ts < other.end_ts
+
+    def __eq__(self, other):
+        if not isinstance(other, BusyBlock):
+            return NotImplemented
+        return self.start_ts == other.start_ts and self.end_ts == other.end_ts
+
+    def __hash__(self):
+        return hash((self.start_ts, self.end_ts))
+
+    def __repr__(self):
+        return f"BusyBlock({self.start.isoformat()}, {self.end.isoformat()})"
+
+# --- Convert API events into buffered busy blocks ---
+def events_to_busy_blocks(events, local_tz, buffer_minutes, access_level):
+    started = time_module.perf_counter()
+    busy_blocks = []
+    buffer_seconds = buffer_minutes * 60
+    log_events = logger.isEnabledFor(logging.DEBUG)
+
+    for event in events:
+        # Skip cancelled events left behind by incremental sync
+        if event.get('status') == 'cancelled':
+            continue
+
+        # Skip events marked as 'transparent' (free/busy)
+        if event.get('transparency') == 'transparent':
+            continue
+            
+        # Skip declined events if we have full access
+        if access_level in ['owner', 'writer'] and event.get('attendees'):
+            my_response = next((a.get('responseStatus') for a in event['attendees'] 
+                             if a.get('self', False)), None)
+            if my_response == 'declined':
+                continue
+
+        # Handle both dateTime and date events
+        start = event['start'].get('dateTime', event['start'].get('date'))
+        end = event['end'].get('dateTime', event['end'].get('date'))
+        
+        if start and end:
+            # Convert to datetime if it's a date
+            if 'T' not in start:
+                start = f"{start}T00:00:00"
+            if 'T' not in end:
+                end = f"{end}T23:59:59"
+            
+            try:
+                # Parse the datetime string
+                start_dt = parser.isoparse(start)
+                end_dt = parser.isoparse(end)
+                
+                # If the datetime doesn't have timezone info, assume it's in UTC
+                if start_dt.tzinfo is None:
+                    start_dt = start_dt.replace(tzinfo=tz.UTC)
+                if end_dt.tzinfo is None:
+                    end_dt = end_dt.replace(tzinfo=tz.UTC)
+                
+                # Only log event details if we have full access
+                if log_events and access_level in ['owner', 'writer'] and event.get('summary'):
+                    logger.debug("Event: %s", event.get('summary', 'No title'))
+                    logger.debug("Original start: %s -> Local start: %s", start, start_dt.astimezone(local_tz))
+                    logger.debug("Original end: %s -> Local end: %s", end, end_dt.astimezone(local_tz))
+                
+                # Add buffer time
+                busy_blocks.append(BusyBlock(int(start_dt.timestamp()) - buffer_seconds,
+                                             int(end_dt.timestamp()) + buffer_seconds, local_tz))
+            except Exception as e:
+                logger.warning("Error processing event: %s", e)
+                continue
+
+    busy_blocks.sort()
+    metrics.record('parse', time_module.perf_counter() - started, events=len(events))
+    return busy_blocks
+
+# --- Widen raw blocks by the buffer locally ---
+def buffer_blocks(blocks, buffer_minutes, local_tz=None):
+    """Yield start-ordered ``blocks`` widened by ``buffer_minutes`` on both sides.
+
+    The multi-calendar fetch and the prefetcher keep raw (zero-buffer)
+    blocks, so a different buffer or display zone is applied here instead
+    of being part of any fetch or cache key. Order is preserved.
+    """
+    buffer_seconds = buffer_minutes * 60
+    for block in blocks:
+        yield BusyBlock(block.start_ts - buffer_seconds, block.end_ts + buffer_seconds, local_tz or block.tz)
+
+# --- Fetch busy times straight from the API (see get_busy_times_cached for caching) ---
+def get_busy_times(service, calendar_id, local_tz, buffer_minutes, start_date=None, end_date=None, lean=True,
+                   expand_recurring=False):
+    start_time = time_module.perf_counter()
+    now, start_utc, end_utc = get_query_range(local_tz, start_date, end_date)
+
+    logger.debug("Local timezone: %s", local_tz)
+    logger.debug("Current time in local timezone: %s", now)
+    logger.debug("API call time range: %s to %s (UTC)", start_utc, end_utc)
 
     # Get events for the time period
     try:
         # First, try to get calendar details to check access level
-        try:
-            calendar = service.calendars().get(calendarId=calendar_id).execute()
-            access_level = calendar.get('accessRole', 'unknown')
-            print(f"Calendar access level: {access_level}")
-        except Exception as e:
-            print(f"Could not get calendar details: {e}")
-            access_level = 'unknown'
+        access_level = get_access_level(service, calendar_id)
 
-        # Try to get events with full details first
+        # Convert each page as it arrives so raw events never pile up
+        busy_blocks = []
+        event_count = 0
         try:
-            events_result = service.events().list(
-                calendarId=calendar_id,
-                timeMin=start_utc.isoformat(),
-                timeMax=end_utc.isoformat(),
-                singleEvents=True,
-                orderBy='startTime',
-                maxResults=2500  # Increased from 1000 to 2500
-            ).execute()
-            events = events_result.get('items', [])
-            print(f"Found {len(events)} events with full details")
-            
-            # Handle pagination if there are more events
-            while 'nextPageToken' in events_result:
-                events_result = service.events().list(
-                    calendarId=calendar_id,
-                    timeMin=start_utc.isoformat(),
-                    timeMax=end_utc.isoformat(),
-                    singleEvents=True,
-                    orderBy='startTime',
-                    maxResults=2500,
-                    pageToken=events_result['nextPageToken']
-                ).execute()
-                events.extend(events_result.get('items', []))
-                print(f"Found additional {len(events_result.get('items', []))} events")
+            if expand_recurring:
+                # Fetch series masters once and expand them here instead of one event per instance
+                pages = expand_recurring_pages(
+                    iter_event_pages(service, calendar_id, start_utc, end_utc,
+                                     fields=RECURRING_EVENT_FIELDS if lean else None, single_events=False),
+                    start_utc, end_utc)
+            else:
+                pages = iter_event_pages(service, calendar_id, start_utc, end_utc,
+                                         fields=LEAN_EVENT_FIELDS if lean else None)
+            for page in pages:
+                event_count += len(page)
+                busy_blocks.extend(events_to_busy_blocks(page, local_tz, buffer_minutes, access_level))
+                logger.debug("Processed page of %d events", len(page))
         except Exception as e:
-            print(f"Could not get full event details: {e}")
-            events = []
+            logger.warning("Could not get full event details: %s", e)
+            busy_blocks = []
+            event_count = 0
 
         # If no events found with full details, try free/busy
-        if not events:
+        if not event_count:
             try:
-                freebusy_request = {
-                    "timeMin": start_utc.isoformat(),
-                    "timeMax": end_utc.isoformat(),
-                    "items": [{"id": calendar_id}]
-                }
-                freebusy_result = service.freebusy().query(body=freebusy_request).execute()
-                busy_blocks = freebusy_result.get('calendars', {}).get(calendar_id, {}).get('busy', [])
-                print(f"Found {len(busy_blocks)} busy blocks from free/busy")
-                
-                # Convert free/busy blocks to events format
-                events = []
-                for block in busy_blocks:
-                    events.append({
-                        'start': {'dateTime': block['start']},
-                        'end': {'dateTime': block['end']},
-                        'transparency': 'opaque'  # Mark as busy time
-                    })
+                events = query_freebusy(service, calendar_id, start_utc, end_utc)
+                busy_blocks = events_to_busy_blocks(events, local_tz, buffer_minutes, access_level)
             except Exception as e:
-                print(f"Could not get free/busy information: {e}")
+                logger.warning("Could not get free/busy information: %s", e)
                 return tuple()
         
-        busy_blocks = []
-        buffer = timedelta(minutes=buffer_minutes)
-
-        for event in events:
-            # Skip events marked as 'transparent' (free/busy)
-            if event.get('transparency') == 'transparent':
-                continue
-                
-            # Skip declined events if we have full access
-            if access_level in ['owner', 'writer'] and event.get('attendees'):
-                my_response = next((a.get('responseStatus') for a in event['attendees'] 
-                                 if a.get('self', False)), None)
-                if my_response == 'declined':
-                    continue
-
-            # Handle both dateTime and date events
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            end = event['end'].get('dateTime', event['end'].get('date'))
-            
-            if start and end:
-                # Convert to datetime if it's a date
-                if 'T' not in start:
-                    start = f"{start}T00:00:00"
-                if 'T' not in end:
-                    end = f"{end}T23:59:59"
-                
-                try:
-                    # Parse the datetime string
-                    start_dt = parser.isoparse(start)
-                    end_dt = parser.isoparse(end)
-                    
-                    # If the datetime doesn't have timezone info, assume it's in UTC
-                    if start_dt.tzinfo is None:
-                        start_dt = start_dt.replace(tzinfo=tz.UTC)
-                    if end_dt.tzinfo is None:
-                        end_dt = end_dt.replace(tzinfo=tz.UTC)
-                    
-                    # Convert to local timezone
-                    start_dt = start_dt.astimezone(local_tz)
-                    end_dt = end_dt.astimezone(local_tz)
-                    
-                    # Only print event details if we have full access
-                    if access_level in ['owner', 'writer'] and event.get('summary'):
-                        print(f"Event: {event.get('summary', 'No title')}")
-                        print(f"Original start: {start} -> Local start: {start_dt}")
-                        print(f"Original end: {end} -> Local end: {end_dt}")
-                    
-                    # Add buffer time
-                    busy_blocks.append((start_dt - buffer, end_dt + buffer))
-                except Exception as e:
-                    print(f"Error processing event: {e}")
-                    continue
-
         busy_blocks.sort()
-        print(f"Total busy blocks: {len(busy_blocks)}")
-        print(f"⏱️ get_busy_times took: {time_module.time() - start_time:.2f} seconds")
+        logger.info("Total busy blocks: %d", len(busy_blocks))
+        _record_stage('get_busy_times', start_time)
         return tuple(busy_blocks)
     except Exception as e:
-        print(f"Error fetching events: {e}")
+        logger.error("Error fetching events: %s", e)
         return tuple()
 
+# --- Incremental sync: local per-calendar event store ---
+class EventStore:
+    """Local copy of one calendar's events, kept current with sync tokens.
+
+    With ``expand_recurring`` it holds series masters and their exceptions
+    (singleEvents=False) rather than every instance.
+    """
+
+    def __init__(self, calendar_id, expand_recurring=False):
+        self.calendar_id = calendar_id
+        self.expand_recurring = expand_recurring
+        self.events = {}
+        self.sync_token = None
+        self.time_min = None
+        self.time_max = None
+        self.access_level = None
+        self.version = 0
+        self.last_used = time_module.monotonic()
+        self.lock = threading.Lock()
+
+    def covers(self, start_utc, end_utc):
+        """Whether the seeded window contains the requested range."""
+        return (self.sync_token is not None
+                and self.time_min <= start_utc and end_utc <= self.time_max)
+
+    def reset(self):
+        self.events = {}
+        self.sync_token = None
+        self.time_min = None
+        self.time_max = None
+        self.version += 1
+
+    def apply(self, items):
+        """Apply a page of changed events; cancelled events are removed."""
+        changed = 0
+        for item in items:
+            event_id = item.get('id')
+            if event_id is None:
+                continue
+            # A cancelled occurrence of a series is kept so expansion knows to skip it
+            if item.get('status') == 'cancelled' and not (self.expand_recurring and item.get('recurringEventId')):
+                if self.events.pop(event_id, None) is not None:
+                    changed += 1
+            else:
+                self.events[event_id] = item
+                changed += 1
+        if changed:
+            self.version += 1
+        return changed
+
+# Event stores outlive Streamlit reruns, but idle or least recently used ones are dropped
+MAX_EVENT_STORES = int(os.environ.get('CALENDAR_SCHEDULER_MAX_EVENT_STORES', 256))
+EVENT_STORE_IDLE_SECONDS = int(os.environ.get('CALENDAR_SCHEDULER_EVENT_STORE_IDLE_SECONDS', 6 * 3600))
+_event_stores = OrderedDict()
+_event_stores_lock = threading.Lock()
+
+def get_event_store(user_key, calendar_id):
+    """The process-wide event store for one user's calendar, created on first use."""
+    if user_key is None:
+        raise ValueError("Event stores are per user; user_key is required")
+    key = (user_key, calendar_id)
+    now = time_module.monotonic()
+    with _event_stores_lock:
+        store = _event_stores.get(key)
+        if store is None:
+            store = _event_stores[key] = EventStore(calendar_id, EXPAND_RECURRING)
+        else:
+            _event_stores.move_to_end(key)
+        store.last_used = now
+        # Least recently used first: evict past the cap, then anything idle too long
+        while len(_event_stores) > MAX_EVENT_STORES:
+            _event_stores.popitem(last=False)
+        while True:
+            oldest = next(iter(_event_stores.values()))
+            if oldest is store or now - oldest.last_used <= EVENT_STORE_IDLE_SECONDS:
+                break
+            _event_stores.popitem(last=False)
+        return store
+
+def forget_event_stores(user_key):
+    """Drop every event store for a user (e.g. on logout)."""
+    with _event_stores_lock:
+        for key in [key for key in _event_stores if key[0] == user_key]:
+            del _event_stores[key]
+
+def _list_all_pages(service, on_page, **params):
+    """Run events().list over every page, handing each to on_page; returns nextSyncToken."""
+    page_token = None
+    while True:
+        if page_token:
+            params['pageToken'] = page_token
+        metrics.count('api_calls')
+        with metrics.span('events_list_page', calendar_id=params.get('calendarId')):
+            result = service.events().list(**params).execute()
+        items = result.get('items', [])
+        metrics.count('pages')
+        metrics.count('events', len(items))
+        on_page(items)
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return result.get('nextSyncToken')
+
+def sync_event_store(service, store, start_utc, end_utc):
+    """Seed the store once, then pull only changed and deleted events."""
+    if store.covers(start_utc, end_utc):
+        try:
+            changed = []
+            sync_token = _list_all_pages(
+                service,
+                lambda items: changed.append(store.apply(items)),
+                calendarId=store.calendar_id,
+                syncToken=store.sync_token,
+                singleEvents=not store.expand_recurring,
+                maxResults=2500,
+                fields=RECURRING_EVENT_FIELDS if store.expand_recurring else LEAN_EVENT_FIELDS
+            )
+            store.sync_token = sync_token or store.sync_token
+            logger.info("Incremental sync: %d changed events", sum(changed))
+            return
+        except HttpError as e:
+            # 410 Gone means the sync token expired and a full sync is required
+            if e.resp.status != 410:
+                raise
+            logger.info("Sync token expired, running full sync")
+
+    # Seed exactly the requested range so the store never grows past what is being viewed
+    store.reset()
+    sync_token = _list_all_pages(
+        service,
+        store.apply,
+        calendarId=store.calendar_id,
+        timeMin=start_utc.isoformat(),
+        timeMax=end_utc.isoformat(),
+        singleEvents=not store.expand_recurring,
+        maxResults=2500,
+        fields=RECURRING_EVENT_FIELDS if store.expand_recurring else LEAN_EVENT_FIELDS
+    )
+    store.sync_token = sync_token
+    store.time_min = start_utc
+    store.time_max = end_utc
+    logger.info("Full sync: %d events", len(store.events))
+
+def get_busy_times_incremental(service, user_key, calendar_id, local_tz, buffer_minutes, start_date=None, end_date=None):
+    start_time = time_module.perf_counter()
+    store = get_event_store(user_key, calendar_id)
+    _, start_utc, end_utc = get_query_range(local_tz, start_date, end_date)
+
+    with store.lock:
+        try:
+            if store.access_level is None:
+                store.access_level = get_access_level(service, calendar_id)
+            sync_event_store(service, store, start_utc, end_utc)
+        except Exception as e:
+            # Calendars we can only see free/busy for can't be synced
+            logger.warning("Could not sync events: %s", e)
+            return get_busy_times(service, calendar_id, local_tz, buffer_minutes,
+                                  start_date=start_date, end_date=end_date)
+        events = list(store.events.values())
+        access_level = store.access_level
+    if store.expand_recurring:
+        events = list(itertools.chain.from_iterable(expand_recurring_pages([events], start_utc, end_utc)))
+
+    range_start = start_utc.timestamp()
+    range_end = end_utc.timestamp()
+    busy_blocks = [b for b in events_to_busy_blocks(events, local_tz, buffer_minutes, access_level)
+                   if b.end_ts > range_start and b.start_ts < range_end]
+    logger.info("Total busy blocks: %d", len(busy_blocks))
+    _record_stage('get_busy_times_incremental', start_time)
+    return tuple(busy_blocks)
+
+# --- Busy times through the persistent cache ---
+def get_busy_times_cached(service, user_key, calendar_id, local_tz, buffer_minutes, start_date=None, end_date=None, cache=None):
+    """Serve busy blocks from the on-disk cache, syncing the calendar on a miss.
+
+    Until the calendar has been synced in this process any fresh entry is
+    trusted, so a restart or a second tab doesn't cause a cold fetch.
+    """
+    store = get_event_store(user_key, calendar_id)
+    if cache is not None:
+        cached = cache.get(user_key, calendar_id, local_tz, buffer_minutes, start_date, end_date,
+                           version=store.sync_token)
+        if cached is not None:
+            metrics.count('busy_cache_hits')
+            logger.info("Served %d busy blocks from cache", len(cached))
+            return cached
+        metrics.count('busy_cache_misses')
+
+    busy_blocks = get_busy_times_incremental(service, user_key, calendar_id, local_tz, buffer_minutes,
+                                             start_date=start_date, end_date=end_date)
+    if cache is not None:
+        cache.put(user_key, calendar_id, local_tz, buffer_minutes, start_date, end_date,
+                  store.sync_token, busy_blocks)
+    return busy_blocks
+
+def is_busy_times_warm(user_key, calendar_id, local_tz, buffer_minutes, start_date=None, end_date=None, cache=None):
+    """Whether get_busy_times_cached can answer without a full fetch."""
+    store = get_event_store(user_key, calendar_id)
+    _, start_utc, end_utc = get_query_range(local_tz, start_date, end_date)
+    if store.covers(start_utc, end_utc):
+        return True
+    return cache is not None and cache.get(user_key, calendar_id, local_tz, buffer_minutes, start_date, end_date,
+                                           version=store.sync_token) is not None
+
+# --- Fetch several calendars concurrently ---
+# 'events' lists every calendar's events; 'freebusy_first' does that only for the
+# owner's calendars (where declined invites must be dropped) and batches the rest
+# into free/busy queries
+FETCH_STRATEGIES = ('events', 'freebusy_first')
+DEFAULT_FETCH_STRATEGY = os.environ.get('CALENDAR_SCHEDULER_FETCH_STRATEGY', 'events')
+
+# --- Owner calendars ---
+# Which calendars 'freebusy_first' lists as events. calendarList returns the
+# primary calendar under the user's email rather than 'primary', so every caller
+# reads it from there to agree on the split (and so on declined invites).
+OWNER_CALENDARS_TTL_SECONDS = 3600
+_owner_calendars = {}
+_owner_calendars_lock = threading.Lock()
+
+def owner_calendar_ids_from_list(calendar_list):
+    """'primary' plus every calendarList entry flagged primary or with accessRole 'owner'."""
+    return tuple(dict.fromkeys(['primary'] + [c['id'] for c in calendar_list
+                                              if c.get('primary') or c.get('accessRole') == 'owner']))
+
+def get_owner_calendar_ids(service_factory, user_key, calendar_list=None, strategy=None):
+    """The user's own calendar ids, from calendarList at most once per OWNER_CALENDARS_TTL_SECONDS.
+
+    Pass ``calendar_list`` when it is already at hand to skip the API call.
+    Under the 'events' strategy every calendar is listed anyway, so nothing
+    is fetched. If calendarList fails only 'primary' is returned, uncached.
+    """
+    if calendar_list is not None:
+        owner_ids = owner_calendar_ids_from_list(calendar_list)
+        with _owner_calendars_lock:
+            _owner_calendars[user_key] = (time_module.monotonic(), owner_ids)
+        return owner_ids
+    if (strategy or DEFAULT_FETCH_STRATEGY) == 'events':
+        return ('primary',)
+    with _owner_calendars_lock:
+        cached = _owner_calendars.get(user_key)
+    if cached is not None and time_module.monotonic() - cached[0] < OWNER_CALENDARS_TTL_SECONDS:
+        return cached[1]
+
+    calendar_list = []
+    try:
+        with service_factory() as service:
+            page_token = None
+            while True:
+                metrics.count('api_calls')
+                page = service.calendarList().list(minAccessRole='owner', pageToken=page_token).execute()
+                calendar_list.extend(page.get('items', []))
+                page_token = page.get('nextPageToken')
+                if not page_token:
+                    break
+    except HttpError as e:
+        logger.warning("Could not list calendars for %s, treating only 'primary' as owned: %s", user_key, e)
+        return ('primary',)
+    return get_owner_calendar_ids(service_factory, user_key, calendar_list)
+
+def forget_owner_calendar_ids(user_key):
+    """Drop a user's cached owner calendars (e.g. on logout)."""
+    with _owner_calendars_lock:
+        _owner_calendars.pop(user_key, None)
+
+def get_busy_times_freebusy(service_factory, user_key, calendar_ids, local_tz, buffer_minutes, start_date=None, end_date=None, cache=None, max_workers=4):
+    """Busy blocks per calendar from batched free/busy queries, as {calendar_id: blocks}.
+
+    Calendars free/busy can't answer fall back to a full event fetch.
+    """
+    _, start_utc, end_utc = get_query_range(local_tz, start_date, end_date)
+    results = {}
+    missing = []
+    for calendar_id in calendar_ids:
+        cached = None
+        if cache is not None:
+            cached = cache.get(user_key, calendar_id, local_tz, buffer_minutes, start_date, end_date,
+                               version='freebusy')
+        if cached is not None:
+            metrics.count('busy_cache_hits')
+            results[calendar_id] = cached
+        else:
+            missing.append(calendar_id)
+
+    if missing:
+        if cache is not None:
+            metrics.count('busy_cache_misses', len(missing))
+        freebusy = query_freebusy_batched(service_factory, missing, start_utc, end_utc, max_workers)
+        for calendar_id in missing:
+            events = freebusy.get(calendar_id)
+            if events is None:
+                with service_factory() as service:
+                    results[calendar_id] = get_busy_times_cached(service, user_key, calendar_id, local_tz,
+                                                                 buffer_minutes, start_date, end_date, cache)
+                continue
+            busy_blocks = tuple(events_to_busy_blocks(events, local_tz, buffer_minutes, 'freeBusyReader'))
+            if cache is not None:
+                cache.put(user_key, calendar_id, local_tz, buffer_minutes, start_date, end_date,
+                          'freebusy', busy_blocks)
+            results[calendar_id] = busy_blocks
+    return results
+
+def get_busy_times_multi(service_factory, user_key, calendar_ids, local_tz, buffer_minutes, start_date=None, end_date=None, cache=None, max_workers=4,
+                         strategy=None, owner_calendar_ids=('primary',)):
+    """Fetch every calendar in a bounded thread pool and merge into one sorted stream.
+
+    Each calendar's blocks are already sorted, so a heap merge is enough
+    before handing the result to merge_blocks. Calendars are fetched and
+    cached without a buffer, which is applied to the merged stream, so
+    changing ``buffer_minutes`` never refetches. ``service_factory()`` must
+    return a context manager lending out a service for exclusive use (see
+    service_pool.ServicePool.checkout).
+    ``strategy`` is one of FETCH_STRATEGIES (default DEFAULT_FETCH_STRATEGY);
+    ``owner_calendar_ids`` normally comes from get_owner_calendar_ids.
+    """
+    start_time = time_module.perf_counter()
+    strategy = strategy or DEFAULT_FETCH_STRATEGY
+    if strategy not in FETCH_STRATEGIES:
+        raise ValueError(f"strategy must be one of {FETCH_STRATEGIES}, got {strategy!r}")
+    calendar_ids = list(dict.fromkeys(calendar_ids))
+    if not calendar_ids:
+        return tuple()
+    if strategy == 'freebusy_first':
+        event_ids = [c for c in calendar_ids if c in owner_calendar_ids]
+        freebusy_ids = [c for c in calendar_ids if c not in owner_calendar_ids]
+    else:
+        event_ids, freebusy_ids = calendar_ids, []
+
+    def fetch(calendar_id):
+        with service_factory() as service:
+            return get_busy_times_cached(service, user_key, calendar_id, local_tz, 0,
+                                         start_date=start_date, end_date=end_date, cache=cache)
+
+    per_calendar = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(event_ids) or 1))) as pool:
+        futures = [pool.submit(fetch, calendar_id) for calendar_id in event_ids]
+        if freebusy_ids:
+            per_calendar.extend(get_busy_times_freebusy(service_factory, user_key, freebusy_ids, local_tz,
+                                                        0, start_date, end_date, cache, max_workers).values())
+        per_calendar.extend(future.result() for future in futures)
+
+    busy_blocks = tuple(buffer_blocks(heapq.merge(*per_calendar), buffer_minutes))
+    logger.info("Merged %d busy blocks from %d calendars (%s)", len(busy_blocks), len(calendar_ids), strategy)
+    _record_stage('get_busy_times_multi', start_time)
+    return busy_blocks
+
 # --- Merge overlapping busy blocks ---
 def merge_blocks(blocks):
     if not blocks:
         return []
     merged = [blocks[0]]
-    for start, end in blocks[1:]:
-        last_start, last_end = merged[-1]
-        if start <= last_end:
-            merged[-1] = (last_start, max(last_end, end))
+    for block in blocks[1:]:
+        last = merged[-1]
+        if block.start_ts <= last.end_ts:
+            # Build a new block rather than mutating one that may be cached
+            if block.end_ts > last.end_ts:
+                merged[-1] = BusyBlock(last.start_ts, block.end_ts, last.tz)
         else:
-            merged.append((start, end))
+            merged.append(block)
     return merged
 
+# --- Free windows for a single day ---
+def compute_day_windows(day_start_ts, day_end_ts, block_starts, block_ends, min_seconds):
+    """Free (start_ts, end_ts) gaps of at least ``min_seconds`` within one workday.
+
+    ``block_starts``/``block_ends`` are the merged (disjoint, sorted) busy
+    blocks that may touch the day; clipping is plain integer comparison.
+    """
+    day_windows = []
+    current = day_start_ts
+    for b_start, b_end in zip(block_starts, block_ends):
+        if b_end <= current:
+            continue
+        if b_start >= day_end_ts:
+            break
+        # If there's a long enough gap before this block
+        if b_start > current and b_start - current >= min_seconds:
+            day_windows.append((current, b_start))
+        current = b_end
+        if current >= day_end_ts:
+            return day_windows
+
+    # Check for free time after the last busy block
+    if current < day_end_ts and day_end_ts - current >= min_seconds:
+        day_windows.append((current, day_end_ts))
+    return day_windows
+
+def windows_to_datetimes(day_windows, local_tz):
+    """Turn epoch-second windows into local datetimes, rounded down to whole 5-minute instants."""
+    # Every zone's UTC offset is a whole multiple of 5 minutes, so rounding the epoch rounds the wall clock
+    return tuple((datetime.fromtimestamp(start - start % 300, local_tz),
+                  datetime.fromtimestamp(end - end % 300, local_tz))
+                 for start, end in day_windows)
+
+def _resolve_now(local_tz, now=None):
+    # Callers pass a fixed ``now`` for reproducible results (e.g. the benchmark); otherwise the wall clock
+    return datetime.now(local_tz) if now is None else now.astimezone(local_tz)
+
+def _now_ts(now):
+    # Whole seconds, rounded up so a window never starts in the past
+    return int(-(-now.timestamp() // 1))
+
+def _window_range(block_starts, block_ends, local_tz, now, start_date, end_date):
+    # Get the date range from the busy blocks unless one was given; blocks are
+    # merged (lists or numpy arrays), so the first start and last end bound them
+    if start_date is not None:
+        return start_date, end_date or start_date + timedelta(days=90)
+    if len(block_starts):
+        return (datetime.fromtimestamp(int(block_starts[0]), local_tz).date(),
+                datetime.fromtimestamp(int(block_ends[-1]), local_tz).date())
+    # If no busy blocks, use today as start date and go 90 days forward
+    return now.date(), now.date() + timedelta(days=90)
+
+# --- Time-aware memoization for free-window results ---
+class FreeWindowCache:
+    """LRU of free-window results keyed by block content, parameters and a "now" bucket.
+
+    Buckets are aligned with the 5-minute rounding of window starts, so a
+    hit returns what a fresh call would; windows that have since shrunk
+    below the minimum length are dropped on the way out.
+    """
+
+    def __init__(self, maxsize=128, bucket_minutes=5):
+        self.maxsize = maxsize
+        self.bucket_seconds = bucket_minutes * 60
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def blocks_digest(busy_blocks):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(array('q', (ts for b in busy_blocks for ts in (b.start_ts, b.end_ts))).tobytes())
+        return digest.hexdigest()
+
+    def memoize(self, func):
+        @functools.wraps(func)
+        def wrapper(busy_blocks, local_tz, work_start, work_end, min_minutes, start_date=None, end_date=None, now=None):
+            now = _resolve_now(local_tz, now)
+            key = (func.__name__, self.blocks_digest(busy_blocks), str(local_tz), work_start, work_end,
+                   min_minutes, start_date, end_date, _now_ts(now) // self.bucket_seconds)
+            with self._lock:
+                result = self._entries.get(key)
+                if result is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+            if result is None:
+                result = func(busy_blocks, local_tz, work_start, work_end, min_minutes, start_date, end_date, now)
+                with self._lock:
+                    self.misses += 1
+                    self._entries[key] = result
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+                return result
+            return self._drop_expired(result, now, timedelta(minutes=min_minutes))
+        wrapper.cache = self
+        return wrapper
+
+    @staticmethod
+    def _drop_expired(free_windows, now, min_duration):
+        fresh = []
+        for day, windows in free_windows:
+            windows = tuple((s, e) for s, e in windows if e - max(s, now) >= min_duration)
+            if windows:
+                fresh.append((day, windows))
+        return tuple(fresh)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def cache_info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries), 'maxsize': self.maxsize}
+
+free_window_cache = FreeWindowCache()
+
 # Cache the free windows results
-@functools.lru_cache(maxsize=2)
-def find_free_windows(busy_blocks, local_tz, work_start, work_end, min_minutes):
-    start_time = time_module.time()
+@free_window_cache.memoize
+def find_free_windows(busy_blocks, local_tz, work_start, work_end, min_minutes, start_date=None, end_date=None, now=None):
+    start_time = time_module.perf_counter()
     free_windows = []
-    now = datetime.now(local_tz)
-    busy_blocks = list(busy_blocks)  # Convert tuple back to list
-    busy_blocks = merge_blocks(busy_blocks)
-    min_duration = timedelta(minutes=min_minutes)
-
-    # Get the date range from the busy blocks
-    if busy_blocks:
-        start_date = min(b.date() for b, _ in busy_blocks)
-        end_date = max(_.date() for _, _ in busy_blocks)
-    else:
-        # If no busy blocks, use today as start date and go 90 days forward
-        start_date = now.date()
-        end_date = start_date + timedelta(days=90)
-
-    print(f"Processing dates from {start_date} to {end_date}")
-
-    # Process each day in the range
-    current_date = start_date
-    while current_date <= end_date:
-        # Skip weekends
-        if current_date.weekday() >= 5:  # 5 is Saturday, 6 is Sunday
-            current_date += timedelta(days=1)
-            continue
+    now = _resolve_now(local_tz, now)
+    now_ts = _now_ts(now)
+    with metrics.span('merge', engine='python'):
+        busy_blocks = merge_blocks(sorted(busy_blocks))
+    min_seconds = min_minutes * 60
 
-        day = current_date
-        start = datetime.combine(day, work_start, tzinfo=local_tz)
-        end = datetime.combine(day, work_end, tzinfo=local_tz)
-        
-        print(f"Processing day: {day.strftime('%A, %Y-%m-%d')}")
-        
-        # Skip past days
-        if day < now.date():
-            current_date += timedelta(days=1)
+    # Merged blocks are disjoint, so starts and ends are both sorted and can be bisected
+    block_starts = [b.start_ts for b in busy_blocks]
+    block_ends = [b.end_ts for b in busy_blocks]
+
+    start_date, end_date = _window_range(block_starts, block_ends, local_tz, now, start_date, end_date)
+    logger.debug("Processing dates from %s to %s", start_date, end_date)
+
+    # Weekdays from today on; today's hours start no earlier than now
+    days, day_starts, day_ends = workday_table(local_tz, work_start, work_end, max(start_date, now.date()), end_date)
+    for day, day_start, day_end in zip(days, day_starts, day_ends):
+        day_start = max(day_start, now_ts)
+        if day_start >= day_end:
             continue
-            
-        # For today, adjust start time to current time if it's later than work start
-        if day == now.date():
-            start = max(start, now)
-            # If we're past work hours for today, skip to next day
-            if start >= end:
-                current_date += timedelta(days=1)
+
+        # Blocks overlapping this workday (including ones spanning the whole day)
+        lo = bisect.bisect_right(block_ends, day_start)
+        hi = bisect.bisect_left(block_starts, day_end)
+        day_windows = compute_day_windows(day_start, day_end, block_starts[lo:hi], block_ends[lo:hi], min_seconds)
+        if day_windows:
+            free_windows.append((day, windows_to_datetimes(day_windows, local_tz)))
+
+    _record_stage('find_free_windows', start_time)
+    return tuple(free_windows)
+
+# --- Gap-length index for minimum-length sweeps ---
+class GapIndex:
+    """Every free gap of one busy-block set, sorted by length for threshold queries.
+
+    Built once per merged blocks, zone, work hours, range and "now" bucket
+    (the same 5-minute buckets as FreeWindowCache), with every gap's
+    datetimes precomputed. ``windows(min_minutes)`` bisects the sorted
+    lengths and returns only the k qualifying gaps, regrouped by day, with
+    no rescan of days or blocks.
+    """
+
+    __slots__ = ('_days', '_windows', '_lengths', '_by_length')
+
+    def __init__(self, days, gaps, local_tz):
+        # gaps: (day_index, start_ts, end_ts) in time order
+        self._days = days
+        self._windows = [(day_index, window) for (day_index, _, _), window
+                         in zip(gaps, windows_to_datetimes([(start, end) for _, start, end in gaps], local_tz))]
+        self._by_length = sorted(range(len(gaps)), key=lambda i: gaps[i][2] - gaps[i][1])
+        self._lengths = [gaps[i][2] - gaps[i][1] for i in self._by_length]
+
+    @classmethod
+    def from_blocks(cls, busy_blocks, local_tz, work_start, work_end, start_date=None, end_date=None, now=None):
+        start_time = time_module.perf_counter()
+        now = _resolve_now(local_tz, now)
+        now_ts = _now_ts(now)
+        busy_blocks = merge_blocks(sorted(busy_blocks))
+        block_starts = [b.start_ts for b in busy_blocks]
+        block_ends = [b.end_ts for b in busy_blocks]
+        start_date, end_date = _window_range(block_starts, block_ends, local_tz, now, start_date, end_date)
+
+        gaps = []
+        days, day_starts, day_ends = workday_table(local_tz, work_start, work_end, max(start_date, now.date()), end_date)
+        for day_index, (day_start, day_end) in enumerate(zip(day_starts, day_ends)):
+            day_start = max(day_start, now_ts)
+            if day_start >= day_end:
                 continue
-                
-        current = start
-        day_windows = []
+            lo = bisect.bisect_right(block_ends, day_start)
+            hi = bisect.bisect_left(block_starts, day_end)
+            # A one-second minimum keeps every non-empty gap; queries filter by length
+            gaps.extend((day_index, start, end) for start, end
+                        in compute_day_windows(day_start, day_end, block_starts[lo:hi], block_ends[lo:hi], 1))
+        index = cls(days, gaps, local_tz)
+        _record_stage('build_gap_index', start_time)
+        return index
 
-        # Filter busy blocks for this day
-        day_busy_blocks = [(s, e) for s, e in busy_blocks if s.date() == day or e.date() == day]
-        
-        # Sort busy blocks by start time
-        day_busy_blocks.sort(key=lambda x: x[0])
-        
-        # If no busy blocks for the day, add the entire workday as a free window
-        if not day_busy_blocks:
-            if (end - start) >= min_duration:
-                day_windows.append((start, end))
+    def __len__(self):
+        return len(self._lengths)
+
+    def windows(self, min_minutes):
+        """((day, windows), ...) exactly as find_free_windows returns for ``min_minutes``."""
+        hits = self._by_length[bisect.bisect_left(self._lengths, min_minutes * 60):]
+        # Positions are small ints, so putting the k hits back in time order is cheap
+        hits.sort()
+        free_windows = []
+        for i in hits:
+            day_index, window = self._windows[i]
+            if free_windows and free_windows[-1][0] == self._days[day_index]:
+                free_windows[-1][1].append(window)
+            else:
+                free_windows.append((self._days[day_index], [window]))
+        return tuple((day, tuple(windows)) for day, windows in free_windows)
+
+_gap_indexes = OrderedDict()
+_gap_indexes_lock = threading.Lock()
+
+def get_gap_index(busy_blocks, local_tz, work_start, work_end, start_date=None, end_date=None, maxsize=32, now=None):
+    """Shared GapIndex over ``busy_blocks``, rebuilt when the blocks, settings or now bucket change."""
+    now = _resolve_now(local_tz, now)
+    key = (FreeWindowCache.blocks_digest(busy_blocks), str(local_tz), work_start, work_end, start_date, end_date,
+           int(now.timestamp() // free_window_cache.bucket_seconds))
+    with _gap_indexes_lock:
+        index = _gap_indexes.get(key)
+        if index is not None:
+            _gap_indexes.move_to_end(key)
+            metrics.count('gap_index_hits')
+            return index
+
+    metrics.count('gap_index_misses')
+    index = GapIndex.from_blocks(busy_blocks, local_tz, work_start, work_end, start_date, end_date, now)
+    with _gap_indexes_lock:
+        _gap_indexes[key] = index
+        while len(_gap_indexes) > maxsize:
+            _gap_indexes.popitem(last=False)
+    return index
+
+def find_free_windows_indexed(busy_blocks, local_tz, work_start, work_end, min_minutes, start_date=None, end_date=None, now=None):
+    """find_free_windows answered from a shared GapIndex, for sweeping ``min_minutes``."""
+    return get_gap_index(busy_blocks, local_tz, work_start, work_end, start_date, end_date,
+                         now=now).windows(min_minutes)
+
+# --- NumPy interval engine ---
+def _merge_intervals_np(starts, ends):
+    """Merge sorted-by-start int64 intervals; touching intervals are joined like merge_blocks."""
+    if len(starts) == 0:
+        return starts, ends
+    running_end = np.maximum.accumulate(ends)
+    new_group = np.empty(len(starts), dtype=bool)
+    new_group[0] = True
+    new_group[1:] = starts[1:] > running_end[:-1]
+    group_first = np.flatnonzero(new_group)
+    group_last = np.append(group_first[1:] - 1, len(starts) - 1)
+    return starts[group_first], running_end[group_last]
+
+@free_window_cache.memoize
+def find_free_windows_numpy(busy_blocks, local_tz, work_start, work_end, min_minutes, start_date=None, end_date=None, now=None):
+    """Vectorized find_free_windows over int64 epoch-second arrays.
+
+    Returns the same ``((day, windows), ...)`` structure as the datetime loop.
+    """
+    start_time = time_module.perf_counter()
+    now = _resolve_now(local_tz, now)
+    now_ts = _now_ts(now)
+    min_seconds = min_minutes * 60
+
+    order = sorted(busy_blocks)
+    starts = np.fromiter((b.start_ts for b in order), dtype=np.int64, count=len(order))
+    ends = np.fromiter((b.end_ts for b in order), dtype=np.int64, count=len(order))
+    with metrics.span('merge', engine='numpy'):
+        starts, ends = _merge_intervals_np(starts, ends)
+
+    start_date, end_date = _window_range(starts, ends, local_tz, now, start_date, end_date)
+
+    # Workday bounds for every remaining weekday; today starts no earlier than now
+    days, day_starts, day_ends = workday_table(local_tz, work_start, work_end, max(start_date, now.date()), end_date)
+    day_starts = np.maximum(np.array(day_starts, dtype=np.int64), now_ts)
+    day_ends = np.array(day_ends, dtype=np.int64)
+    open_days = np.flatnonzero(day_starts < day_ends)
+    days = [days[i] for i in open_days]
+    day_starts = day_starts[open_days]
+    day_ends = day_ends[open_days]
+
+    if not days:
+        _record_stage('find_free_windows_numpy', start_time)
+        return tuple()
+
+    # Merged blocks overlapping each workday: ends after its start and starts before its end
+    lo = np.searchsorted(ends, day_starts, side='right')
+    hi = np.searchsorted(starts, day_ends, side='left')
+    counts = np.maximum(hi - lo, 0)
+    block_day = np.repeat(np.arange(len(days)), counts)
+    block_offsets = np.cumsum(counts) - counts
+    block_idx = np.arange(counts.sum()) - np.repeat(block_offsets - lo, counts)
+    clipped_starts = np.maximum(starts[block_idx], day_starts[block_day])
+    clipped_ends = np.minimum(ends[block_idx], day_ends[block_day])
+
+    # Each day has one more gap than blocks: [day start, first block] ... [last block, day end]
+    gap_counts = counts + 1
+    gap_day = np.repeat(np.arange(len(days)), gap_counts)
+    first_gap = np.cumsum(gap_counts) - gap_counts
+    last_gap = first_gap + counts
+    gap_starts = np.empty(len(gap_day), dtype=np.int64)
+    gap_ends = np.empty(len(gap_day), dtype=np.int64)
+    is_first = np.zeros(len(gap_day), dtype=bool)
+    is_first[first_gap] = True
+    is_last = np.zeros(len(gap_day), dtype=bool)
+    is_last[last_gap] = True
+    gap_starts[is_first] = day_starts
+    gap_starts[~is_first] = clipped_ends
+    gap_ends[is_last] = day_ends
+    gap_ends[~is_last] = clipped_starts
+
+    valid = (gap_ends - gap_starts >= min_seconds) & (gap_ends > gap_starts) & (gap_starts >= now_ts)
+    valid_idx = np.flatnonzero(valid)
+
+    # Only the surviving windows are turned back into datetimes
+    free_windows = []
+    for i in valid_idx:
+        day = days[gap_day[i]]
+        window = (int(gap_starts[i]), int(gap_ends[i]))
+        if free_windows and free_windows[-1][0] == day:
+            free_windows[-1][1].append(window)
         else:
-            # Process each busy block
-            for b_start, b_end in day_busy_blocks:
-                # Skip blocks that don't overlap with work hours
-                if b_end <= start or b_start >= end:
-                    continue
-                    
-                # Adjust block times to work hours
-                b_start = max(b_start, start)
-                b_end = min(b_end, end)
-                
-                # If there's a gap before this block
-                if b_start > current:
-                    free_start = current
-                    free_end = b_start
-                    # Only add if it's long enough and within work hours
-                    if (free_end - free_start) >= min_duration:
-                        day_windows.append((free_start, free_end))
-                
-                current = max(current, b_end)
-
-            # Check for free time after the last busy block
-            if current < end:
-                free_start = current
-                free_end = end
-                if (free_end - free_start) >= min_duration:
-                    day_windows.append((free_start, free_end))
-
-        # Filter out any invalid windows
-        valid_windows = []
-        for window_start, window_end in day_windows:
-            # Skip zero-duration windows
-            if window_start >= window_end:
+            free_windows.append((day, [window]))
+
+    _record_stage('find_free_windows_numpy', start_time)
+    return tuple((day, windows_to_datetimes(windows, local_tz)) for day, windows in free_windows)
+
+# --- Local expansion of recurring events ---
+def _instance_key(start):
+    # Identifies one occurrence, matching an exception's originalStartTime
+    if 'date' in start:
+        return start['date']
+    return int(parser.isoparse(start['dateTime']).timestamp())
+
+def iter_recurrence(master, start_utc, end_utc, skip=frozenset()):
+    """Lazily yield the instances of a recurring master that overlap [start_utc, end_utc).
+
+    The RRULE/RDATE/EXDATE lines are expanded with dateutil in the event's
+    own time zone, so a 9am meeting stays at 9am across DST changes.
+    Occurrences whose key is in ``skip`` (moved or cancelled via an
+    exception) are left out.
+    """
+    start, end = master['start'], master['end']
+    all_day = 'date' in start
+    if all_day:
+        dtstart = datetime.fromisoformat(start['date'])
+        duration = datetime.fromisoformat(end['date']) - dtstart
+        # Floating dates: pad the UTC range by a day either side instead of resolving zones
+        range_start = start_utc.replace(tzinfo=None) - timedelta(days=1) - duration
+        range_end = end_utc.replace(tzinfo=None) + timedelta(days=1)
+    else:
+        dtstart = parser.isoparse(start['dateTime'])
+        event_tz = tz.gettz(start['timeZone']) if start.get('timeZone') else None
+        if event_tz is not None:
+            dtstart = dtstart.astimezone(event_tz)
+        duration = parser.isoparse(end['dateTime']) - dtstart
+        range_start, range_end = start_utc - duration, end_utc
+
+    rule = rrulestr("\n".join(master['recurrence']), dtstart=dtstart, forceset=True, ignoretz=all_day)
+    instance_fields = {k: v for k, v in master.items() if k not in ('recurrence', 'start', 'end')}
+    master_id = master['id']
+    if all_day:
+        for occurrence in rule.xafter(range_start, inc=False):
+            if occurrence >= range_end:
+                return
+            instance_start = {'date': occurrence.date().isoformat()}
+            if (master_id, instance_start['date']) in skip:
                 continue
-                
-            # Skip windows that are too short
-            if (window_end - window_start) < min_duration:
+            instance_end = {'date': (occurrence + duration).date().isoformat()}
+            yield dict(instance_fields, start=instance_start, end=instance_end)
+    else:
+        # Compare and format via epoch seconds; zone-aware datetime arithmetic is the slow part
+        range_end_ts = range_end.timestamp()
+        duration_seconds = duration.total_seconds()
+        for occurrence in rule.xafter(range_start, inc=False):
+            start_ts = occurrence.timestamp()
+            if start_ts >= range_end_ts:
+                return
+            if (master_id, int(start_ts)) in skip:
                 continue
-                
-            # Ensure windows are within work hours
-            window_start = max(window_start, start)
-            window_end = min(window_end, end)
-            
-            # Skip if window is now too short after adjustment
-            if (window_end - window_start) < min_duration:
+            yield dict(instance_fields,
+                       start={'dateTime': datetime.fromtimestamp(start_ts, tz.UTC).isoformat()},
+                       end={'dateTime': datetime.fromtimestamp(start_ts + duration_seconds, tz.UTC).isoformat()})
+
+def expand_recurring_pages(pages, start_utc, end_utc, chunk_size=2500):
+    """Turn pages fetched with singleEvents=False into pages of concrete events.
+
+    Single events and exceptions pass straight through page by page. Masters
+    are held back until every exception has been seen, then expanded lazily
+    and emitted in chunks of ``chunk_size``.
+    """
+    masters = []
+    skip = set()
+    for page in pages:
+        concrete = []
+        for event in page:
+            if event.get('recurrence'):
+                if event.get('status') != 'cancelled':
+                    masters.append(event)
                 continue
-                
-            # Skip past time slots
-            if window_start < now:
+            if event.get('recurringEventId') and event.get('originalStartTime'):
+                skip.add((event['recurringEventId'], _instance_key(event['originalStartTime'])))
+            concrete.append(event)
+        yield concrete
+
+    metrics.count('recurring_masters', len(masters))
+    instances = itertools.chain.from_iterable(
+        iter_recurrence(master, start_utc, end_utc, skip) for master in masters)
+    while True:
+        started = time_module.perf_counter()
+        chunk = list(itertools.islice(instances, chunk_size))
+        metrics.record('expand_recurring', time_module.perf_counter() - started, instances=len(chunk))
+        if not chunk:
+            return
+        metrics.count('expanded_instances', len(chunk))
+        yield chunk
+
+# --- Streaming pipeline: pages -> busy blocks -> free windows, day by day ---
+def iter_event_pages(service, calendar_id, start_utc, end_utc, fields=LEAN_EVENT_FIELDS, single_events=True):
+    """Yield each page of events as it arrives, ordered by start time.
+
+    ``fields`` limits the response to what the busy-block conversion
+    reads; pass None for full event resources. With ``single_events``
+    False, recurring series arrive as masters plus exceptions, unordered
+    (see expand_recurring_pages).
+    """
+    page_token = None
+    while True:
+        params = dict(
+            calendarId=calendar_id,
+            timeMin=start_utc.isoformat(),
+            timeMax=end_utc.isoformat(),
+            singleEvents=single_events,
+            maxResults=2500
+        )
+        if single_events:
+            params['orderBy'] = 'startTime'
+        if fields:
+            params['fields'] = fields
+        if page_token:
+            params['pageToken'] = page_token
+        metrics.count('api_calls')
+        with metrics.span('events_list_page', calendar_id=calendar_id):
+            events_result = service.events().list(**params).execute()
+        items = events_result.get('items', [])
+        metrics.count('pages')
+        metrics.count('events', len(items))
+        yield items
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return
+
+def iter_busy_blocks(service, calendar_id, local_tz, buffer_minutes, start_date=None, end_date=None):
+    """Yield busy blocks page by page instead of waiting for the whole range."""
+    if EXPAND_RECURRING:
+        # Without singleEvents pages aren't ordered by start, so this calendar is gathered and sorted first
+        yield from get_busy_times(service, calendar_id, local_tz, buffer_minutes, start_date, end_date,
+                                  expand_recurring=True)
+        return
+    _, start_utc, end_utc = get_query_range(local_tz, start_date, end_date)
+    access_level = get_access_level(service, calendar_id)
+    found_events = False
+    try:
+        for page in iter_event_pages(service, calendar_id, start_utc, end_utc):
+            found_events = found_events or bool(page)
+            logger.debug("Streaming page of %d events", len(page))
+            yield from events_to_busy_blocks(page, local_tz, buffer_minutes, access_level)
+    except Exception as e:
+        logger.warning("Could not get full event details: %s", e)
+        if found_events:
+            return
+
+    # Same free/busy fallback as get_busy_times when no events are visible
+    if not found_events:
+        try:
+            events = query_freebusy(service, calendar_id, start_utc, end_utc)
+            yield from events_to_busy_blocks(events, local_tz, buffer_minutes, access_level)
+        except Exception as e:
+            logger.warning("Could not get free/busy information: %s", e)
+
+_STREAM_DONE = object()
+
+def _produce_blocks(blocks, out, stop):
+    """Run ``blocks`` to the end on this thread, handing each to the bounded queue ``out``, then _STREAM_DONE (or the error).
+
+    The iterable is always read to the end (it caches what it fetched), even
+    once the consumer has stopped pulling, e.g. iter_free_windows finishing
+    before a trailing weekend, so the next request for the range is warm.
+    """
+    def put(item):
+        # Stop handing over once the consumer has gone away instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
                 continue
-                
-            # Round times to nearest 5 minutes
-            window_start = window_start.replace(minute=(window_start.minute // 5) * 5)
-            window_end = window_end.replace(minute=(window_end.minute // 5) * 5)
-            
-            valid_windows.append((window_start, window_end))
+        return False
 
-        if valid_windows:
-            free_windows.append((day, tuple(valid_windows)))
-        
-        current_date += timedelta(days=1)
+    handing_over = True
+    try:
+        for block in blocks:
+            handing_over = handing_over and put(block)
+    except Exception as e:
+        put(e)
+        return
+    put(_STREAM_DONE)
 
-    print(f"⏱️ find_free_windows took: {time_module.time() - start_time:.2f} seconds")
-    return tuple(free_windows)
+def _iter_calendar_blocks(service_factory, user_key, calendar_id, local_tz, start_date, end_date, cache):
+    # One calendar's raw blocks page by page, cached once the last page is in
+    blocks = []
+    with service_factory() as service:
+        for block in iter_busy_blocks(service, calendar_id, local_tz, 0, start_date, end_date):
+            blocks.append(block)
+            yield block
+    if cache is not None:
+        cache.put(user_key, calendar_id, local_tz, 0, start_date, end_date, None, blocks)
+
+def _iter_freebusy_blocks(service_factory, user_key, calendar_ids, local_tz, start_date, end_date, cache, max_workers):
+    # Batched free/busy queries (cached per calendar) for calendars whose events aren't needed
+    yield from heapq.merge(*get_busy_times_freebusy(service_factory, user_key, calendar_ids, local_tz, 0,
+                                                    start_date, end_date, cache, max_workers).values())
+
+def stream_busy_blocks(service_factory, user_key, calendar_ids, local_tz, buffer_minutes, start_date=None, end_date=None, cache=None,
+                       queue_size=2500, strategy=None, owner_calendar_ids=('primary',), max_workers=4):
+    """Merge the page streams of several calendars into one start-ordered stream.
+
+    Every event-listed calendar is read by its own producer thread into a
+    bounded queue, starting on the first ``next()``, so a cold stream takes
+    about as long as the slowest calendar rather than the sum of them.
+    Under the 'freebusy_first' ``strategy`` (see get_busy_times_multi) the
+    other calendars are answered by one more producer with batched free/busy
+    queries. Producers write each calendar's raw blocks to the cache when it
+    finishes, whether or not the stream was consumed to the end, so the next
+    request for the same range is served warm whatever its buffer.
+    """
+    strategy = strategy or DEFAULT_FETCH_STRATEGY
+    if strategy not in FETCH_STRATEGIES:
+        raise ValueError(f"strategy must be one of {FETCH_STRATEGIES}, got {strategy!r}")
+    calendar_ids = list(dict.fromkeys(calendar_ids))
+    if strategy == 'freebusy_first':
+        event_ids = [c for c in calendar_ids if c in owner_calendar_ids]
+        freebusy_ids = [c for c in calendar_ids if c not in owner_calendar_ids]
+    else:
+        event_ids, freebusy_ids = calendar_ids, []
+
+    def collect(blocks_queue):
+        while True:
+            item = blocks_queue.get()
+            if item is _STREAM_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def start_producer(name, blocks):
+        blocks_queue = queue.Queue(maxsize=queue_size)
+        threading.Thread(target=_produce_blocks, name=name, args=(blocks, blocks_queue, stop), daemon=True).start()
+        streams.append(collect(blocks_queue))
+
+    stop = threading.Event()
+    streams = []
+    try:
+        for calendar_id in event_ids:
+            start_producer(f"stream-{calendar_id}", _iter_calendar_blocks(
+                service_factory, user_key, calendar_id, local_tz, start_date, end_date, cache))
+        if freebusy_ids:
+            start_producer('stream-freebusy', _iter_freebusy_blocks(
+                service_factory, user_key, freebusy_ids, local_tz, start_date, end_date, cache, max_workers))
+        yield from buffer_blocks(heapq.merge(*streams), buffer_minutes)
+    finally:
+        # Closing the stream early releases producers still waiting to hand over blocks
+        stop.set()
+
+def iter_free_windows(busy_blocks, local_tz, work_start, work_end, min_minutes, start_date, end_date, lookahead=timedelta(days=1),
+                      now=None):
+    """Yield (day, windows) as soon as every block that can touch the day has arrived.
+
+    ``busy_blocks`` may be any iterable ordered by start time. All-day
+    events sort by their date in the calendar's own zone, so a day is only
+    finished once the stream has moved ``lookahead`` past its end.
+    """
+    now = _resolve_now(local_tz, now)
+    now_ts = _now_ts(now)
+    min_seconds = min_minutes * 60
+    lookahead_seconds = lookahead.total_seconds()
+    blocks = iter(busy_blocks)
+    pending = []
+    watermark = None
+    exhausted = False
+
+    days, day_starts, day_ends = workday_table(local_tz, work_start, work_end, max(start_date, now.date()), end_date)
+    for day, day_start, day_end in zip(days, day_starts, day_ends):
+        # Pull blocks until the stream is safely past this day
+        while not exhausted and (watermark is None or watermark < day_end + lookahead_seconds):
+            try:
+                block = next(blocks)
+            except StopIteration:
+                exhausted = True
+                break
+            pending.append(block)
+            watermark = block.start_ts if watermark is None else max(watermark, block.start_ts)
+
+        day_start = max(day_start, now_ts)
+        if day_start < day_end:
+            day_busy_blocks = merge_blocks(sorted(b for b in pending if b.start_ts < day_end and b.end_ts > day_start))
+            day_windows = compute_day_windows(day_start, day_end, [b.start_ts for b in day_busy_blocks],
+                                              [b.end_ts for b in day_busy_blocks], min_seconds)
+            if day_windows:
+                yield day, windows_to_datetimes(day_windows, local_tz)
+
+        # Blocks that end today can't affect later days
+        pending = [b for b in pending if b.end_ts > day_end]
+
+# --- Common availability across several participants ---
+class Participant:
+    """One person in a group search: their sorted busy blocks and own working day."""
+
+    __slots__ = ('busy_blocks', 'local_tz', 'work_start', 'work_end')
+
+    def __init__(self, busy_blocks, local_tz, work_start, work_end):
+        self.busy_blocks = busy_blocks
+        self.local_tz = local_tz
+        self.work_start = work_start
+        self.work_end = work_end
+
+def _off_hours(participant, range_start_ts, range_end_ts):
+    """Yield (start_ts, end_ts) for the time outside a participant's working hours, in order.
+
+    Evenings, nights and weekends are measured in the participant's own zone,
+    so the workday moves with their DST changes rather than the organiser's.
+    """
+    local_tz = participant.local_tz
+    first_day = datetime.fromtimestamp(range_start_ts, local_tz).date() - timedelta(days=1)
+    last_day = datetime.fromtimestamp(range_end_ts, local_tz).date() + timedelta(days=1)
+    _, work_starts, work_ends = workday_table(local_tz, participant.work_start, participant.work_end,
+                                              first_day, last_day)
+    off_start = range_start_ts
+    for work_start_ts, work_end_ts in zip(work_starts, work_ends):
+        if work_start_ts > off_start:
+            yield off_start, work_start_ts
+        off_start = max(off_start, work_end_ts)
+    yield off_start, max(off_start, range_end_ts)
+
+def find_common_free_windows(participants, local_tz, min_minutes, start_date, end_date, now=None):
+    """Free windows shared by every participant, as (day, windows) in ``local_tz``.
+
+    Each participant's busy blocks (already sorted, as get_busy_times returns
+    them) and off-hours are lazy sorted streams; a single heap-based k-way
+    merge sweeps all of them at once, so N blocks over K people cost
+    O(N log K) and nobody's individual free windows are ever built.
+    """
+    start_time = time_module.perf_counter()
+    now = _resolve_now(local_tz, now)
+    min_seconds = min_minutes * 60
+    range_start_ts = max(localize(local_tz, datetime.combine(start_date, time(0, 0))).timestamp(), now.timestamp())
+    range_end_ts = localize(local_tz, datetime.combine(end_date + timedelta(days=1), time(0, 0))).timestamp()
+
+    streams = []
+    for participant in participants:
+        streams.append((block.start_ts, block.end_ts) for block in participant.busy_blocks)
+        streams.append(_off_hours(participant, range_start_ts, range_end_ts))
+
+    free_windows = []
+    cursor = range_start_ts
+    def emit(start_ts, end_ts):
+        # Starts round up and ends down to 5 minutes (whole wall-clock steps in every zone), inside the gap
+        start_ts = int(-(-start_ts // 300) * 300)
+        end_ts = int(end_ts // 300 * 300)
+        if end_ts - start_ts < min_seconds:
+            return
+        start = datetime.fromtimestamp(start_ts, local_tz)
+        window = (start, datetime.fromtimestamp(end_ts, local_tz))
+        if free_windows and free_windows[-1][0] == start.date():
+            free_windows[-1][1].append(window)
+        else:
+            free_windows.append((start.date(), [window]))
+
+    # Someone is unavailable from start to end; any gap in the union is common free time
+    for start_ts, end_ts in heapq.merge(*streams):
+        if start_ts >= range_end_ts:
+            break
+        if start_ts - cursor >= min_seconds:
+            emit(cursor, start_ts)
+        cursor = max(cursor, end_ts)
+    if range_end_ts - cursor >= min_seconds:
+        emit(cursor, range_end_ts)
+
+    _record_stage('find_common_free_windows', start_time)
+    return tuple((day, tuple(windows)) for day, windows in free_windows)
+
+# --- Meeting slot recommendations ---
+SLOT_PREFERENCES = ('earliest', 'spread', 'avoid_lunch')
+
+def iter_slots(windows, duration_minutes, step_minutes=15):
+    """Yield (start, end) meeting slots of exactly ``duration_minutes`` from one day's windows, in order.
+
+    Starts fall on ``step_minutes`` boundaries of the local clock (e.g. :00,
+    :15, :30, :45), so a window opening at 10:10 offers 10:15 first.
+    """
+    duration = duration_minutes * 60
+    step = step_minutes * 60
+    for window_start, window_end in windows:
+        local_tz = window_start.tzinfo
+        # Round-trip through the timestamp so pytz picks the real offset for the wall clock
+        wall_start = datetime.fromtimestamp(window_start.timestamp(), local_tz)
+        midnight = wall_start.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        start_ts = midnight + -(-(wall_start.timestamp() - midnight) // step) * step
+        end_ts = window_end.timestamp()
+        while start_ts + duration <= end_ts:
+            yield (datetime.fromtimestamp(start_ts, local_tz),
+                   datetime.fromtimestamp(start_ts + duration, local_tz))
+            start_ts += step
+
+def _lunch_overlap(slot, lunch_start, lunch_end):
+    start, end = slot
+    lunch_start = start.replace(hour=lunch_start.hour, minute=lunch_start.minute, second=0, microsecond=0)
+    lunch_end = start.replace(hour=lunch_end.hour, minute=lunch_end.minute, second=0, microsecond=0)
+    return max(0.0, (min(end, lunch_end) - max(start, lunch_start)).total_seconds())
+
+def _non_overlapping(slots):
+    """Drop slots that start before the previous kept slot ends, from a chronological stream."""
+    last_end = None
+    for slot in slots:
+        if last_end is None or slot[0] >= last_end:
+            last_end = slot[1]
+            yield slot
+
+def _overlaps_any(slot, chosen):
+    return any(slot[0] < end and start < slot[1] for start, end in chosen)
+
+def _top_k_lunch_free(slots, k, lunch_start, lunch_end, duration_minutes, step_minutes):
+    """Best k non-overlapping slots of a chronological stream, clear of lunch first.
+
+    Lunch-free slots are taken in time order, so once k are found the rest
+    of the stream is abandoned. Otherwise the remainder comes from the slots
+    touching lunch, least overlap (then earliest) first. A slot overlaps at
+    most ceil(2 * duration / step) grid starts counting itself, so k picks
+    rule out at most k times that many and only the best so many touching
+    slots are kept, in a bounded heap.
+    """
+    limit = k * -(-2 * duration_minutes // step_minutes)
+    chosen = []
+    touching = []
+    for order, slot in enumerate(slots):
+        overlap = _lunch_overlap(slot, lunch_start, lunch_end)
+        if overlap:
+            # Max-heap on (overlap, order), so the worst kept candidate is at the top
+            entry = (-overlap, -order, slot)
+            if len(touching) < limit:
+                heapq.heappush(touching, entry)
+            elif entry > touching[0]:
+                heapq.heapreplace(touching, entry)
+        elif not chosen or slot[0] >= chosen[-1][1]:
+            chosen.append(slot)
+            if len(chosen) == k:
+                return chosen
+    for _, _, slot in sorted(touching, reverse=True):
+        if len(chosen) == k:
+            break
+        if not _overlaps_any(slot, chosen):
+            chosen.append(slot)
+    return chosen
+
+def recommend_slots(free_windows, duration_minutes, k=5, step_minutes=15, prefer='earliest',
+                    lunch_start=time(12, 0), lunch_end=time(13, 0)):
+    """Lazily yield the k best concrete meeting slots from ``free_windows``.
+
+    ``prefer`` is one of SLOT_PREFERENCES:
+      earliest     the first k slots in time
+      avoid_lunch  slots clear of the lunch hour first, earliest among equals
+      spread       one slot on each of k days spaced evenly across the range,
+                   choosing a lunch-free slot on each day where there is one;
+                   a day without a slot passes to the next one that has one,
+                   and with fewer usable days than k the earliest remaining
+                   slots make up the rest
+    Slots never overlap one another, so fewer than k come back only when
+    the windows can't hold k. Slots are enumerated in time order and only
+    until the answer is settled, so asking for a handful over a long range
+    stays cheap. An unknown ``prefer`` raises ValueError right away, not on
+    the first ``next()``.
+    """
+    if prefer not in SLOT_PREFERENCES:
+        raise ValueError(f"prefer must be one of {SLOT_PREFERENCES}, got {prefer!r}")
+    return _iter_recommended_slots(free_windows, duration_minutes, k, step_minutes, prefer, lunch_start, lunch_end)
+
+def _iter_recommended_slots(free_windows, duration_minutes, k, step_minutes, prefer, lunch_start, lunch_end):
+    if k <= 0:
+        return
+
+    def all_slots():
+        for _, windows in free_windows:
+            yield from iter_slots(windows, duration_minutes, step_minutes)
+
+    if prefer == 'earliest':
+        yield from itertools.islice(_non_overlapping(all_slots()), k)
+    elif prefer == 'avoid_lunch':
+        yield from _top_k_lunch_free(all_slots(), k, lunch_start, lunch_end, duration_minutes, step_minutes)
+    else:
+        days = [windows for _, windows in free_windows]
+        if len(days) > k:
+            step = (len(days) - 1) / max(k - 1, 1)
+            targets = [round(i * step) for i in range(k)]
+        else:
+            targets = range(len(days))
+        chosen = []
+        day_index = 0
+        for target in targets:
+            day_index = max(day_index, target)
+            while day_index < len(days):
+                best = _top_k_lunch_free(iter_slots(days[day_index], duration_minutes, step_minutes), 1,
+                                         lunch_start, lunch_end, duration_minutes, step_minutes)
+                day_index += 1
+                if best:
+                    chosen.append(best[0])
+                    break
+        if len(chosen) < k:
+            for slot in all_slots():
+                if not _overlaps_any(slot, chosen):
+                    chosen.append(slot)
+                    if len(chosen) == k:
+                        break
+        yield from sorted(chosen)
 
 # --- Format date and time strings ---
 def format_date(date_obj):
@@ -403,7 +1623,8 @@ def main():
     local_tz, work_start, work_end, min_minutes, buffer_minutes = get_user_preferences()
     # Remove the creds reference since we're using service account
     print("This script is meant to be imported, not run directly.")
-    print("Please use the Streamlit web app instead.")
+    print("Please use the Streamlit web app instead, or batch_availability.py")
+    print("to compute availability for many signed-in users at once.")
 
 if __name__ == '__main__':
     main()
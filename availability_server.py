@@ -0,0 +1,352 @@
+import argparse
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time as time_module
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as dtime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytz
+
+from CalendarScheduler import get_busy_times_multi, get_owner_calendar_ids, find_free_windows, find_common_free_windows, Participant
+from busy_cache import BusyCache
+from instrumentation import metrics
+from service_pool import service_pool
+from user_store import (USER_DATA_DIR, get_user_id, get_credentials, load_user_preferences, get_default_preferences,
+                        migrate_legacy_files)
+
+logger = logging.getLogger(__name__)
+
+MAX_RANGE_DAYS = 90
+
+# Static availability snapshots written by publish.AvailabilityPublisher
+PUBLISHED_DIR = os.path.join(USER_DATA_DIR, 'published')
+PUBLISHED_FORMATS = {'json': 'application/json', 'ics': 'text/calendar; charset=utf-8',
+                     'html': 'text/html; charset=utf-8'}
+
+
+class AvailabilityError(Exception):
+    """A request the API can't answer, carrying the HTTP status to return."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def resolve_user_id(user):
+    # Accept either the stored user id or the account's email address
+    if re.fullmatch(r'[0-9a-f]{32}', user):
+        return user
+    return get_user_id(user)
+
+
+def resolve_params(user=None, timezone=None, work_start=None, work_end=None, min_minutes=None,
+                   buffer_minutes=None, start=None, end=None, calendars=None):
+    """Availability parameters for a user, filling gaps from their saved preferences.
+
+    Overrides are strings as they arrive from a query string or command line.
+    """
+    if not user:
+        raise AvailabilityError(400, "Missing 'user' parameter")
+    user_id = resolve_user_id(user)
+    preferences = dict(get_default_preferences())
+    preferences.update(load_user_preferences(user_id) or {})
+
+    try:
+        local_tz = pytz.timezone(timezone or preferences['timezone'])
+        work_start = dtime.fromisoformat(work_start or preferences['work_start'])
+        work_end = dtime.fromisoformat(work_end or preferences['work_end'])
+        min_minutes = int(min_minutes or preferences['min_minutes'])
+        buffer_minutes = int(buffer_minutes or preferences['buffer_minutes'])
+        start_date = date.fromisoformat(start) if start else datetime.now(local_tz).date()
+        end_date = date.fromisoformat(end) if end else start_date + timedelta(days=14)
+    except (ValueError, pytz.UnknownTimeZoneError) as e:
+        raise AvailabilityError(400, f"Invalid parameter: {e}")
+    if min_minutes <= 0:
+        raise AvailabilityError(400, "min_minutes must be a positive number of minutes")
+    if buffer_minutes < 0:
+        raise AvailabilityError(400, "buffer_minutes must not be negative")
+    if end_date < start_date or (end_date - start_date).days > MAX_RANGE_DAYS:
+        raise AvailabilityError(400, f"Date range must be between 0 and {MAX_RANGE_DAYS} days")
+
+    return {
+        'user_id': user_id,
+        'calendar_ids': tuple(c for c in (calendars or 'primary').split(',') if c),
+        'local_tz': local_tz,
+        'work_start': work_start,
+        'work_end': work_end,
+        'min_minutes': min_minutes,
+        'buffer_minutes': buffer_minutes,
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+
+
+def fetch_busy_blocks(params, busy_cache, start_date=None, end_date=None):
+    creds = get_credentials(params['user_id'])
+    if creds is None:
+        raise AvailabilityError(404, f"No stored credentials for user {params['user_id']}")
+    service_factory = service_pool.factory(params['user_id'], creds)
+    return get_busy_times_multi(service_factory, params['user_id'],
+                                params['calendar_ids'], params['local_tz'], params['buffer_minutes'],
+                                start_date=start_date or params['start_date'],
+                                end_date=end_date or params['end_date'], cache=busy_cache,
+                                owner_calendar_ids=get_owner_calendar_ids(service_factory, params['user_id']))
+
+
+def windows_payload(free_windows):
+    return [
+        {'date': day.isoformat(),
+         'windows': [{'start': s.isoformat(), 'end': e.isoformat()} for s, e in windows]}
+        for day, windows in free_windows
+    ]
+
+
+def compute_availability(params, busy_cache):
+    """Fetch a user's busy blocks and return their free windows as a JSON-ready dict."""
+    busy_blocks = fetch_busy_blocks(params, busy_cache)
+    free_windows = find_free_windows(busy_blocks, params['local_tz'], params['work_start'], params['work_end'],
+                                     params['min_minutes'], start_date=params['start_date'],
+                                     end_date=params['end_date'])
+    return {
+        'user': params['user_id'],
+        'timezone': str(params['local_tz']),
+        'start': params['start_date'].isoformat(),
+        'end': params['end_date'].isoformat(),
+        'min_minutes': params['min_minutes'],
+        'days': windows_payload(free_windows),
+    }
+
+
+def compute_common_availability(users, busy_cache, timezone=None, min_minutes=None, start=None, end=None):
+    """Windows when every user is free, each within their own work hours and time zone.
+
+    The first user's preferences supply the display zone, minimum length and
+    default range unless overridden.
+    """
+    if not users:
+        raise AvailabilityError(400, "Missing 'users' parameter")
+    organiser = resolve_params(users[0], timezone=timezone, min_minutes=min_minutes, start=start, end=end)
+    start_date, end_date = organiser['start_date'], organiser['end_date']
+    participants = []
+    for user in users:
+        params = resolve_params(user, start=start_date.isoformat(), end=end_date.isoformat())
+        # Pad by a day: the organiser's dates straddle other zones' midnights
+        busy_blocks = fetch_busy_blocks(params, busy_cache, start_date - timedelta(days=1), end_date + timedelta(days=1))
+        participants.append(Participant(busy_blocks, params['local_tz'], params['work_start'], params['work_end']))
+    free_windows = find_common_free_windows(participants, organiser['local_tz'], organiser['min_minutes'],
+                                            start_date, end_date)
+    return {
+        'users': [resolve_user_id(user) for user in users],
+        'timezone': str(organiser['local_tz']),
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'min_minutes': organiser['min_minutes'],
+        'days': windows_payload(free_windows),
+    }
+
+
+class AvailabilityService:
+    """Computes a user's free windows from their stored token and preferences.
+
+    Responses are cached per user and parameter set for ``response_ttl``
+    seconds on top of the shared busy-block cache, so bursts of identical
+    widget requests never reach the Calendar API.
+    """
+
+    QUERY_PARAMS = ('user', 'timezone', 'work_start', 'work_end', 'min_minutes',
+                    'buffer_minutes', 'start', 'end', 'calendars')
+
+    def __init__(self, busy_cache=None, response_ttl=30, max_responses=2048):
+        self.busy_cache = busy_cache or BusyCache(os.path.join(USER_DATA_DIR, 'busy_cache.sqlite3'))
+        self.response_ttl = response_ttl
+        self.max_responses = max_responses
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def parse_params(self, query):
+        return resolve_params(**{name: query[name][0] for name in self.QUERY_PARAMS if query.get(name)})
+
+    def availability(self, params):
+        key = (params['user_id'],) + tuple(str(params[name]) for name in sorted(params))
+        now = time_module.time()
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is not None and cached[0] > now:
+                self._responses.move_to_end(key)
+                metrics.count('api_response_cache_hits')
+                return cached[1]
+
+        metrics.count('api_response_cache_misses')
+        body = json.dumps(compute_availability(params, self.busy_cache)).encode('utf-8')
+
+        with self._lock:
+            self._responses[key] = (now + self.response_ttl, body)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_responses:
+                self._responses.popitem(last=False)
+        return body
+
+    def common_availability(self, query):
+        def value(name):
+            return query[name][0] if query.get(name) else None
+
+        users = [user for user in (value('users') or '').split(',') if user]
+        return json.dumps(compute_common_availability(users, self.busy_cache, value('timezone'),
+                                                      value('min_minutes'), value('start'),
+                                                      value('end'))).encode('utf-8')
+
+    def invalidate(self, user_id):
+        """Forget every cached response for a user (e.g. after their calendar changed)."""
+        with self._lock:
+            for key in [k for k in self._responses if k[0] == user_id]:
+                del self._responses[key]
+
+
+class AvailabilityHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Idle keep-alive connections give their worker back after this many seconds
+    timeout = 5
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/healthz':
+            return self._send(200, b'ok', 'text/plain')
+        if url.path == '/metrics':
+            return self._send(200, metrics.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+        if url.path.startswith('/s/'):
+            return self._send_published(url.path[len('/s/'):])
+        if url.path not in ('/availability', '/common-availability'):
+            return self._send_error(404, "Not found")
+        if not self._authorized():
+            metrics.count('api_unauthorized')
+            return self._send(401, json.dumps({'error': "Missing or invalid API key"}).encode('utf-8'),
+                              'application/json', {'WWW-Authenticate': 'Bearer'})
+
+        started = time_module.perf_counter()
+        service = self.server.availability
+        query = parse_qs(url.query)
+        try:
+            if url.path == '/common-availability':
+                body = service.common_availability(query)
+            else:
+                body = service.availability(service.parse_params(query))
+        except AvailabilityError as e:
+            return self._send_error(e.status, str(e))
+        except Exception as e:
+            logger.exception("Availability request failed")
+            return self._send_error(500, f"Internal error: {e}")
+        finally:
+            metrics.record('http_availability', time_module.perf_counter() - started)
+        self._send(200, body, 'application/json')
+
+    def _authorized(self):
+        # Computed availability needs "Authorization: Bearer <key>"; published snapshots are public
+        scheme, _, key = (self.headers.get('Authorization') or '').partition(' ')
+        if scheme.lower() != 'bearer' or not key:
+            return False
+        return any(secrets.compare_digest(key.encode('utf-8'), allowed.encode('utf-8'))
+                   for allowed in self.server.api_keys)
+
+    def _send_published(self, name):
+        # Shared links: serve the pre-rendered file, nothing is computed per view
+        token, _, fmt = name.rpartition('.')
+        if not re.fullmatch(r'[A-Za-z0-9_-]{16,}', token) or fmt not in PUBLISHED_FORMATS:
+            return self._send_error(404, "Not found")
+        try:
+            with open(os.path.join(PUBLISHED_DIR, name), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return self._send_error(404, "Not found")
+        metrics.count('published_views')
+        self._send(200, body, PUBLISHED_FORMATS[fmt], {'Cache-Control': 'public, max-age=60'})
+
+    def _send_error(self, status, message):
+        self._send(status, json.dumps({'error': message}).encode('utf-8'), 'application/json')
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that hands each connection to a fixed-size worker pool."""
+
+    request_queue_size = 256
+
+    def __init__(self, server_address, handler_class, availability, workers=16, api_keys=()):
+        super().__init__(server_address, handler_class)
+        self.availability = availability
+        self.api_keys = tuple(api_keys)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='availability')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+def api_keys_from_env():
+    return [key for key in os.environ.get('CALENDAR_SCHEDULER_API_KEYS', '').split(',') if key]
+
+
+def make_server(host='127.0.0.1', port=8080, workers=16, availability=None, api_keys=()):
+    """An availability server; /availability and /common-availability need one of ``api_keys``."""
+    return PooledHTTPServer((host, port), AvailabilityHandler, availability or AvailabilityService(), workers,
+                            api_keys)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Serve free windows as JSON over HTTP.")
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8080)
+    arg_parser.add_argument('--workers', type=int, default=16)
+    arg_parser.add_argument('--response-ttl', type=int, default=30, help="seconds to reuse an identical response")
+    arg_parser.add_argument('--api-key', action='append', default=[],
+                            help="key clients send as 'Authorization: Bearer <key>' (repeatable; "
+                                 "also read from CALENDAR_SCHEDULER_API_KEYS, comma-separated)")
+    args = arg_parser.parse_args()
+    api_keys = args.api_key + api_keys_from_env()
+    if not api_keys:
+        arg_parser.error("at least one API key is required (--api-key or CALENDAR_SCHEDULER_API_KEYS)")
+
+    logging.basicConfig(level=os.environ.get('CALENDAR_SCHEDULER_LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    migrate_legacy_files()
+    server = make_server(args.host, args.port, args.workers, AvailabilityService(response_ttl=args.response_ttl),
+                         api_keys)
+    logger.info("Serving availability on http://%s:%d with %d workers", args.host, args.port, args.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time as time_module
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from availability_server import AvailabilityError, resolve_params, resolve_user_id, compute_availability
+from busy_cache import BusyCache
+from user_store import USER_DATA_DIR, get_user_store, migrate_legacy_files
+
+logger = logging.getLogger(__name__)
+
+_busy_cache = None
+
+
+def _get_busy_cache():
+    # One cache object per worker process; SQLite handles sharing the file between them
+    global _busy_cache
+    if _busy_cache is None:
+        _busy_cache = BusyCache(os.path.join(USER_DATA_DIR, 'busy_cache.sqlite3'))
+    return _busy_cache
+
+
+def read_users(lines):
+    """Parse a user list: one email or user id per line, or a JSON object of overrides.
+
+    Blank lines and lines starting with '#' are skipped. JSON lines take the
+    same keys as the HTTP API, e.g. {"user": "a@example.com", "min_minutes": "45"}.
+    """
+    users = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        users.append(json.loads(line) if line.startswith('{') else {'user': line})
+    return users
+
+
+def user_availability(entry, defaults):
+    """Availability record for one user; failures are reported in the record, never raised."""
+    started = time_module.perf_counter()
+    overrides = dict(defaults, **{k: str(v) for k, v in entry.items() if v is not None})
+    record = {'input': entry.get('user')}
+    try:
+        record.update(compute_availability(resolve_params(**overrides), _get_busy_cache()))
+    except AvailabilityError as e:
+        record['error'] = str(e)
+    except Exception as e:
+        logger.exception("Availability failed for %s", entry.get('user'))
+        record['error'] = f"{type(e).__name__}: {e}"
+    record['seconds'] = round(time_module.perf_counter() - started, 3)
+    return record
+
+
+def run_batch(users, output, defaults=None, workers=8, use_processes=False, progress=None, progress_every=10):
+    """Compute availability for every user and stream one JSON line per user to ``output``.
+
+    Lines are written in completion order as each user finishes. Returns
+    (succeeded, failed, elapsed_seconds).
+    """
+    defaults = defaults or {}
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    if not use_processes:
+        # One query for everyone's token and preferences instead of one per user
+        get_user_store().preload(resolve_user_id(entry['user']) for entry in users if entry.get('user'))
+    succeeded = failed = 0
+    started = time_module.perf_counter()
+
+    with executor_class(max_workers=workers) as executor:
+        futures = {executor.submit(user_availability, entry, defaults): entry for entry in users}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                record = future.result()
+            except Exception as e:
+                # Only reachable if a worker process died outright
+                record = {'input': futures[future].get('user'), 'error': f"{type(e).__name__}: {e}"}
+            if 'error' in record:
+                failed += 1
+            else:
+                succeeded += 1
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+
+            if progress is not None and (done % progress_every == 0 or done == len(futures)):
+                elapsed = time_module.perf_counter() - started
+                progress.write(f"[{done}/{len(futures)}] {succeeded} ok, {failed} failed, "
+                               f"{done / elapsed if elapsed else 0:.1f} users/s\n")
+                progress.flush()
+
+    return succeeded, failed, time_module.perf_counter() - started
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Compute free windows for many users at once and write them as JSON lines.")
+    arg_parser.add_argument('users', help="file with one user (email, id or JSON object) per line, or - for stdin")
+    arg_parser.add_argument('-o', '--output', help="JSONL output file (default: stdout)")
+    arg_parser.add_argument('--workers', type=int, default=8)
+    arg_parser.add_argument('--processes', action='store_true', help="use worker processes instead of threads")
+    arg_parser.add_argument('--start', help="first date, YYYY-MM-DD (default: today)")
+    arg_parser.add_argument('--end', help="last date, YYYY-MM-DD (default: two weeks from start)")
+    arg_parser.add_argument('--calendars', help="comma-separated calendar ids (default: primary)")
+    arg_parser.add_argument('--min-minutes', help="minimum window length, overriding saved preferences")
+    arg_parser.add_argument('--progress-every', type=int, default=10)
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get('CALENDAR_SCHEDULER_LOG_LEVEL', 'WARNING'),
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    migrate_legacy_files()
+
+    if args.users == '-':
+        users = read_users(sys.stdin)
+    else:
+        with open(args.users, 'r') as f:
+            users = read_users(f)
+    defaults = {name: value for name, value in (('start', args.start), ('end', args.end),
+                                                ('calendars', args.calendars),
+                                                ('min_minutes', args.min_minutes)) if value}
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        succeeded, failed, elapsed = run_batch(users, output, defaults, args.workers, args.processes,
+                                               progress=sys.stderr, progress_every=args.progress_every)
+    finally:
+        if args.output:
+            output.close()
+    sys.stderr.write(f"Done: {succeeded} ok, {failed} failed in {elapsed:.1f}s "
+                     f"({len(users) / elapsed if elapsed else 0:.1f} users/s)\n")
+    sys.exit(1 if failed and not succeeded else 0)
+
+
+if __name__ == '__main__':
+    main()
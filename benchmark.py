@@ -0,0 +1,525 @@
+import argparse
+import json
+import random
+import statistics
+import time as time_module
+import tracemalloc
+from datetime import datetime, timedelta, time, date
+
+import httplib2
+import pytz
+from googleapiclient.errors import HttpError
+
+from CalendarScheduler import (get_busy_times, merge_blocks, find_free_windows,
+                               find_free_windows_numpy, GapIndex, iter_recurrence, _instance_key)
+from instrumentation import metrics
+from watch_channels import send_notification
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+# A fixed Monday, with the US spring DST change inside the default 90 days, so runs are comparable
+DEFAULT_START_DATE = date(2025, 1, 6)
+
+
+# --- Offline stand-in for the googleapiclient Calendar service ---
+class _FakeRequest:
+    def __init__(self, service, handler):
+        self.service = service
+        self.handler = handler
+
+    def execute(self):
+        self.service.api_calls += 1
+        if self.service.latency:
+            time_module.sleep(self.service.latency)
+        result = self.handler()
+        if self.service.count_bytes:
+            self.service.response_bytes += len(json.dumps(result))
+        return result
+
+
+class FakeCalendarService:
+    """Serves a synthetic calendar through the subset of the API the scheduler uses.
+
+    ``latency`` is added to every execute() call and ``page_size`` caps the
+    number of events per events().list page. Recurring masters are expanded
+    into instances for singleEvents=True listings and returned as-is, with
+    their exceptions, otherwise. With ``count_bytes`` the JSON size of every
+    response is added up in ``response_bytes``.
+
+    ``add_event`` changes a calendar after it has been synced (returned by
+    the next syncToken listing), ``expire_sync_tokens`` makes earlier tokens
+    fail with 410 Gone, and ``notify`` posts a push notification to every
+    channel opened with events().watch, standing in for Google. With
+    ``send_sync`` events().watch posts the channel's 'sync' message before
+    it returns, as Google may.
+    """
+
+    def __init__(self, events, calendar_id='primary', access_role='owner', latency=0.0, page_size=2500,
+                 count_bytes=False):
+        self.events_by_calendar = {}
+        self.masters_by_calendar = {}
+        self.access_role = access_role
+        self.latency = latency
+        self.page_size = page_size
+        self.count_bytes = count_bytes
+        self.api_calls = 0
+        self.response_bytes = 0
+        self._range_cache = {}
+        self.changes_by_calendar = {}
+        self.sync_epochs = {}
+        self.watch_channels = {}
+        self.send_sync = False
+        self.add_calendar(calendar_id, events)
+
+    def add_calendar(self, calendar_id, events):
+        self.masters_by_calendar[calendar_id] = [e for e in events if e.get('recurrence')]
+        self.events_by_calendar[calendar_id] = sorted(
+            ((_event_instant(e.get('start', e.get('originalStartTime'))),
+              _event_instant(e.get('end', e.get('originalStartTime'))), e)
+             for e in events if not e.get('recurrence')),
+            key=lambda item: item[0]
+        )
+
+    def add_event(self, calendar_id, event):
+        """Add (or, with status 'cancelled', remove) a single event as a later change."""
+        events = [item for item in self.events_by_calendar.get(calendar_id, []) if item[2].get('id') != event['id']]
+        if event.get('status') != 'cancelled' or event.get('recurringEventId'):
+            # Cancelled occurrences of a series stay, so expansion keeps skipping them
+            start = event.get('start', event.get('originalStartTime'))
+            events.append((_event_instant(start), _event_instant(event.get('end', start)), event))
+            events.sort(key=lambda item: item[0])
+        self.events_by_calendar[calendar_id] = events
+        self.changes_by_calendar.setdefault(calendar_id, []).append(event)
+        self._range_cache.clear()
+
+    def sync_token(self, calendar_id):
+        return f"sync-{self.sync_epochs.get(calendar_id, 0)}-{len(self.changes_by_calendar.get(calendar_id, []))}"
+
+    def expire_sync_tokens(self, calendar_id):
+        """Invalidate every sync token issued so far, as Google does after a while."""
+        self.sync_epochs[calendar_id] = self.sync_epochs.get(calendar_id, 0) + 1
+
+    def notify(self, calendar_id, state='exists'):
+        """POST a notification to every channel watching ``calendar_id``; returns the statuses."""
+        statuses = []
+        for channel in list(self.watch_channels.values()):
+            if channel['calendarId'] == calendar_id:
+                channel['messageNumber'] += 1
+                statuses.append(send_notification(channel['address'], channel['id'], channel['token'],
+                                                  channel['resourceId'], state, channel['messageNumber']))
+        return statuses
+
+    def _stored_in_range(self, calendar_id, time_min, time_max):
+        return [
+            (start, end, event) for start, end, event in self.events_by_calendar.get(calendar_id, [])
+            if (time_max is None or start < time_max) and (time_min is None or end > time_min)
+        ]
+
+    def events_in_range(self, calendar_id, time_min, time_max):
+        """Concrete events overlapping the range, recurring series expanded, by start time."""
+        key = (calendar_id, time_min, time_max, True)
+        if key not in self._range_cache:
+            time_min = datetime.fromisoformat(time_min) if time_min else None
+            time_max = datetime.fromisoformat(time_max) if time_max else None
+            stored = self._stored_in_range(calendar_id, time_min, time_max)
+            events = [item for item in stored if item[2].get('status') != 'cancelled']
+            masters = self.masters_by_calendar.get(calendar_id, [])
+            if masters and time_min is not None and time_max is not None:
+                skip = {(e['recurringEventId'], _instance_key(e['originalStartTime']))
+                        for _, _, e in self.events_by_calendar[calendar_id] if e.get('recurringEventId')}
+                for master in masters:
+                    for instance in iter_recurrence(master, time_min, time_max, skip):
+                        # Instances get their own ids, as from the API, and point back at their series
+                        instance.update(id=f"{master['id']}_{_instance_key(instance['start'])}",
+                                        recurringEventId=master['id'], originalStartTime=instance['start'])
+                        events.append((_event_instant(instance['start']), _event_instant(instance['end']), instance))
+                events.sort(key=lambda item: item[0])
+            self._range_cache[key] = events
+        return self._range_cache[key]
+
+    def recurring_events_in_range(self, calendar_id, time_min, time_max):
+        """Masters plus the single events and exceptions overlapping the range (singleEvents=False)."""
+        key = (calendar_id, time_min, time_max, False)
+        if key not in self._range_cache:
+            time_min = datetime.fromisoformat(time_min) if time_min else None
+            time_max = datetime.fromisoformat(time_max) if time_max else None
+            masters = [(None, None, master) for master in self.masters_by_calendar.get(calendar_id, [])]
+            self._range_cache[key] = self._stored_in_range(calendar_id, time_min, time_max) + masters
+        return self._range_cache[key]
+
+    # service.calendars().get(calendarId=...)
+    def calendars(self):
+        return self
+
+    def get(self, calendarId):
+        return _FakeRequest(self, lambda: {'id': calendarId, 'summary': calendarId,
+                                           'accessRole': self.access_role,
+                                           'timeZone': 'UTC'})
+
+    # service.calendarList().list()
+    def calendarList(self):
+        return _FakeCalendarList(self)
+
+    # service.events().list(...)
+    def events(self):
+        return _FakeEvents(self)
+
+    # service.freebusy().query(body=...)
+    def freebusy(self):
+        return _FakeFreeBusy(self)
+
+    # service.channels().stop(body=...)
+    def channels(self):
+        return _FakeChannels(self)
+
+
+class _FakeCalendarList:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, **kwargs):
+        return _FakeRequest(self.service, lambda: {'items': [
+            {'id': calendar_id, 'summary': calendar_id, 'primary': i == 0,
+             'accessRole': self.service.access_role if i == 0 else 'reader'}
+            for i, calendar_id in enumerate(self.service.events_by_calendar)
+        ]})
+
+
+class _FakeEvents:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, calendarId, pageToken=None, maxResults=2500, timeMin=None, timeMax=None, syncToken=None,
+             singleEvents=False, **kwargs):
+        service = self.service
+
+        def handler():
+            if syncToken is not None:
+                _, epoch, position = syncToken.split('-')
+                if int(epoch) != service.sync_epochs.get(calendarId, 0):
+                    raise HttpError(httplib2.Response({'status': 410}), b'{"error": {"code": 410}}')
+                # Everything added with add_event since the token was issued
+                changes = service.changes_by_calendar.get(calendarId, [])
+                return {'items': changes[int(position):],
+                        'nextSyncToken': service.sync_token(calendarId)}
+            if singleEvents:
+                events = service.events_in_range(calendarId, timeMin, timeMax)
+            else:
+                events = service.recurring_events_in_range(calendarId, timeMin, timeMax)
+            offset = int(pageToken or 0)
+            size = min(maxResults, service.page_size)
+            result = {'items': [event for _, _, event in events[offset:offset + size]]}
+            if offset + size < len(events):
+                result['nextPageToken'] = str(offset + size)
+            else:
+                result['nextSyncToken'] = service.sync_token(calendarId)
+            return result
+        return _FakeRequest(service, handler)
+
+    def watch(self, calendarId, body):
+        service = self.service
+
+        def handler():
+            if calendarId not in service.events_by_calendar:
+                raise HttpError(httplib2.Response({'status': 404}), b'{"error": {"code": 404}}')
+            channel = dict(body, calendarId=calendarId, resourceId=f"resource-{calendarId}", messageNumber=0,
+                           expiration=str(int((time_module.time() + int(body['params']['ttl'])) * 1000)))
+            service.watch_channels[body['id']] = channel
+            if service.send_sync:
+                channel['syncStatus'] = send_notification(channel['address'], channel['id'], channel['token'],
+                                                          channel['resourceId'], 'sync', 0)
+            return {'kind': 'api#channel', 'id': body['id'], 'resourceId': channel['resourceId'],
+                    'expiration': channel['expiration']}
+        return _FakeRequest(service, handler)
+
+
+class _FakeChannels:
+    def __init__(self, service):
+        self.service = service
+
+    def stop(self, body):
+        service = self.service
+
+        def handler():
+            service.watch_channels.pop(body['id'], None)
+            return {}
+        return _FakeRequest(service, handler)
+
+
+class _FakeFreeBusy:
+    def __init__(self, service):
+        self.service = service
+
+    def query(self, body):
+        service = self.service
+
+        def handler():
+            calendars = {}
+            for item in body.get('items', []):
+                if item['id'] not in service.events_by_calendar:
+                    calendars[item['id']] = {'busy': [], 'errors': [{'domain': 'global', 'reason': 'notFound'}]}
+                    continue
+                events = service.events_in_range(item['id'], body.get('timeMin'), body.get('timeMax'))
+                busy = [{'start': start.isoformat(), 'end': end.isoformat()}
+                        for start, end, event in events if event.get('transparency') != 'transparent']
+                calendars[item['id']] = {'busy': busy}
+            return {'calendars': calendars}
+        return _FakeRequest(service, handler)
+
+
+def _event_instant(value):
+    if 'dateTime' in value:
+        return datetime.fromisoformat(value['dateTime'])
+    return datetime.fromisoformat(value['date']).replace(tzinfo=pytz.UTC)
+
+
+# --- Synthetic calendars ---
+def next_dst_transition(local_tz, start_date, max_days=366):
+    """First date on or after start_date whose UTC offset differs from the day before."""
+    previous = local_tz.localize(datetime.combine(start_date, time(12))).utcoffset()
+    for offset in range(1, max_days):
+        day = start_date + timedelta(days=offset)
+        current = local_tz.localize(datetime.combine(day, time(12))).utcoffset()
+        if current != previous:
+            return day
+        previous = current
+    return None
+
+
+def generate_calendar(n_events, tz_name='US/Eastern', days=90, start_date=None, seed=0):
+    """Build ``n_events`` API-shaped events for a seeded, repeatable calendar.
+
+    The mix covers ordinary meetings, dense back-to-back days, all-day and
+    multi-day events, declined invites, transparent holds and a cluster of
+    early-morning events on the next DST transition day.
+    """
+    rng = random.Random(seed)
+    local_tz = pytz.timezone(tz_name)
+    start_date = start_date or date.today()
+    dense_days = {start_date + timedelta(days=rng.randrange(days)) for _ in range(max(1, days // 15))}
+    dst_day = next_dst_transition(local_tz, start_date)
+
+    def at(day, hour, minute):
+        return local_tz.normalize(local_tz.localize(datetime.combine(day, time(hour, minute))))
+
+    events = []
+    for i in range(n_events):
+        kind = rng.random()
+        day = start_date + timedelta(days=rng.randrange(days))
+        event = {'id': f"evt{i}", 'status': 'confirmed'}
+
+        if kind < 0.05:
+            # All-day event
+            event['start'] = {'date': day.isoformat()}
+            event['end'] = {'date': (day + timedelta(days=1)).isoformat()}
+        elif kind < 0.08:
+            # Multi-day event
+            start = at(day, rng.randrange(8, 18), rng.choice([0, 30]))
+            end = start + timedelta(days=rng.randint(1, 3), hours=rng.randint(0, 4))
+            event['start'] = {'dateTime': start.isoformat()}
+            event['end'] = {'dateTime': local_tz.normalize(end).isoformat()}
+        elif kind < 0.10 and dst_day is not None:
+            # Around the DST switch, where wall-clock hours repeat or vanish
+            start = local_tz.normalize(at(dst_day, 0, 0) + timedelta(minutes=rng.randrange(0, 6 * 60, 15)))
+            event['start'] = {'dateTime': start.isoformat()}
+            event['end'] = {'dateTime': local_tz.normalize(start + timedelta(minutes=45)).isoformat()}
+        else:
+            if kind < 0.30:
+                # Dense day: short back-to-back meetings
+                day = rng.choice(sorted(dense_days))
+                start = at(day, rng.randrange(8, 18), rng.choice([0, 15, 30, 45]))
+                length = 15
+            else:
+                start = at(day, rng.randrange(7, 19), rng.choice([0, 15, 30, 45]))
+                length = rng.choice([15, 30, 45, 60, 90])
+            event['start'] = {'dateTime': start.isoformat()}
+            event['end'] = {'dateTime': local_tz.normalize(start + timedelta(minutes=length)).isoformat()}
+
+        if rng.random() < 0.10:
+            event['attendees'] = [{'email': 'me@example.com', 'self': True, 'responseStatus': 'declined'},
+                                  {'email': 'them@example.com', 'responseStatus': 'accepted'}]
+        elif rng.random() < 0.05:
+            event['transparency'] = 'transparent'
+        events.append(event)
+    return events
+
+
+def generate_recurring_series(n_series, tz_name='US/Eastern', days=90, start_date=None, seed=0):
+    """Build ``n_series`` recurring meetings (masters plus a few exceptions each).
+
+    Series are daily standups or weekly 1:1s that began before start_date
+    and run past the benchmark range, with one cancelled and one moved
+    occurrence apiece.
+    """
+    rng = random.Random(seed + 1)
+    local_tz = pytz.timezone(tz_name)
+    start_date = start_date or date.today()
+    first_day = start_date - timedelta(days=28)
+    events = []
+    for i in range(n_series):
+        daily = rng.random() < 0.4
+        day = first_day + timedelta(days=rng.randrange(7))
+        while day.weekday() >= 5:
+            day += timedelta(days=1)
+        start = local_tz.localize(datetime.combine(day, time(rng.randrange(8, 17), rng.choice([0, 30]))))
+        length = 15 if daily else rng.choice([30, 45, 60])
+        rule = 'RRULE:FREQ=DAILY;BYDAY=MO,TU,WE,TH,FR' if daily else 'RRULE:FREQ=WEEKLY'
+        master_id = f"series{i}"
+        events.append({
+            'id': master_id, 'status': 'confirmed',
+            'start': {'dateTime': start.isoformat(), 'timeZone': tz_name},
+            'end': {'dateTime': (start + timedelta(minutes=length)).isoformat(), 'timeZone': tz_name},
+            'recurrence': [rule],
+        })
+
+        # Cancel one occurrence and move another, both within the range
+        step = 1 if daily else 7
+        for n, status in ((rng.randrange(28, 28 + days // 2) // step, 'cancelled'),
+                          (rng.randrange(28 + days // 2, 28 + days) // step, 'confirmed')):
+            original = local_tz.normalize(start + timedelta(days=n * step))
+            if original.weekday() >= 5:
+                continue
+            exception = {'id': f"{master_id}_{n}", 'status': status, 'recurringEventId': master_id,
+                         'originalStartTime': {'dateTime': original.isoformat(), 'timeZone': tz_name}}
+            if status == 'confirmed':
+                moved = original + timedelta(hours=1)
+                exception['start'] = {'dateTime': moved.isoformat()}
+                exception['end'] = {'dateTime': (moved + timedelta(minutes=length)).isoformat()}
+            events.append(exception)
+    return events
+
+
+# --- Benchmark runner ---
+def _time_stage(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time_module.perf_counter()
+        func()
+        timings.append(time_module.perf_counter() - start)
+    return timings
+
+
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+SWEEP_MINUTES = range(15, 125, 5)
+
+
+def _indexed_sweep(busy_blocks, local_tz, work_start, work_end, start_date, end_date, now):
+    index = GapIndex.from_blocks(busy_blocks, local_tz, work_start, work_end, start_date, end_date, now)
+    return [index.windows(minutes) for minutes in SWEEP_MINUTES]
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=3, tz_name='US/Eastern', days=90, latency=0.0,
+                   page_size=2500, work_start=time(9, 0), work_end=time(17, 0), min_minutes=30,
+                   buffer_minutes=15, seed=0, measure_memory=True, recurring=0, start_date=DEFAULT_START_DATE):
+    """Time get_busy_times, merge_blocks and both free-window engines per calendar size.
+
+    With ``recurring`` series added, get_busy_times is also timed with local
+    recurrence expansion for comparison. Calendars start on ``start_date``
+    and the free-window engines run as if it were midnight that day, so
+    results don't depend on when the benchmark runs.
+    """
+    local_tz = pytz.timezone(tz_name)
+    now = local_tz.localize(datetime.combine(start_date, time(0, 0)))
+    results = []
+    for size in sizes:
+        events = generate_calendar(size, tz_name=tz_name, days=days, start_date=start_date, seed=seed)
+        if recurring:
+            events += generate_recurring_series(recurring, tz_name=tz_name, days=days,
+                                                start_date=start_date, seed=seed)
+        service = FakeCalendarService(events, latency=latency, page_size=page_size, count_bytes=True)
+        end_date = max(start_date + timedelta(days=days),
+                       next_dst_transition(local_tz, start_date) or start_date)
+
+        stages = {
+            'get_busy_times': lambda: get_busy_times(service, 'primary', local_tz, buffer_minutes,
+                                                     start_date=start_date, end_date=end_date),
+        }
+        if recurring:
+            stages['get_busy_times_expand_recurring'] = lambda: get_busy_times(
+                service, 'primary', local_tz, buffer_minutes, start_date=start_date, end_date=end_date,
+                expand_recurring=True)
+        busy_blocks = stages['get_busy_times']()
+        sorted_blocks = sorted(busy_blocks)
+        stages['merge_blocks'] = lambda: merge_blocks(sorted_blocks)
+        stages['find_free_windows'] = lambda: find_free_windows.__wrapped__(
+            busy_blocks, local_tz, work_start, work_end, min_minutes, start_date, end_date, now)
+        stages['find_free_windows_numpy'] = lambda: find_free_windows_numpy.__wrapped__(
+            busy_blocks, local_tz, work_start, work_end, min_minutes, start_date, end_date, now)
+        # A minimum-length slider sweep: rescanning per position vs one gap index
+        stages['min_minutes_sweep'] = lambda: [find_free_windows.__wrapped__(
+            busy_blocks, local_tz, work_start, work_end, minutes, start_date, end_date, now)
+            for minutes in SWEEP_MINUTES]
+        stages['min_minutes_sweep_indexed'] = lambda: _indexed_sweep(busy_blocks, local_tz, work_start, work_end,
+                                                                     start_date, end_date, now)
+
+        for stage, func in stages.items():
+            service.api_calls = 0
+            service.response_bytes = 0
+            timings = _time_stage(func, repeat)
+            api_calls = service.api_calls // repeat
+            response_bytes = service.response_bytes // repeat
+            peak = _peak_memory(func) if measure_memory else None
+            results.append({
+                'stage': stage,
+                'events': size,
+                'busy_blocks': len(busy_blocks),
+                'min_s': min(timings),
+                'median_s': statistics.median(timings),
+                'peak_bytes': peak,
+                'api_calls': api_calls,
+                'response_bytes': response_bytes,
+            })
+    return results
+
+
+def format_results(results):
+    lines = [f"{'stage':<34}{'events':>8}{'blocks':>8}{'min ms':>10}{'median ms':>11}{'peak KiB':>10}"
+             f"{'calls':>7}{'resp KiB':>10}"]
+    for r in results:
+        peak = f"{r['peak_bytes'] / 1024:.0f}" if r['peak_bytes'] is not None else '-'
+        lines.append(f"{r['stage']:<34}{r['events']:>8}{r['busy_blocks']:>8}"
+                     f"{r['min_s'] * 1000:>10.2f}{r['median_s'] * 1000:>11.2f}{peak:>10}{r['api_calls']:>7}"
+                     f"{r['response_bytes'] / 1024:>10.0f}")
+    return "\n".join(lines)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the scheduler against synthetic calendars.")
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--timezone', default='US/Eastern')
+    arg_parser.add_argument('--days', type=int, default=90)
+    arg_parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every API call")
+    arg_parser.add_argument('--page-size', type=int, default=2500)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--start-date', type=date.fromisoformat, default=DEFAULT_START_DATE,
+                            help=f"first day of the synthetic calendars, YYYY-MM-DD (default: {DEFAULT_START_DATE})")
+    arg_parser.add_argument('--recurring', type=int, default=0,
+                            help="add this many recurring series and time local expansion too")
+    arg_parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+    arg_parser.add_argument('--json', help="also write results to this file")
+    arg_parser.add_argument('--metrics', action='store_true',
+                            help="print the scheduler's stage metrics in Prometheus format")
+    args = arg_parser.parse_args()
+
+    results = run_benchmarks(sizes=args.sizes, repeat=args.repeat, tz_name=args.timezone, days=args.days,
+                             latency=args.latency, page_size=args.page_size, seed=args.seed,
+                             measure_memory=not args.no_memory, recurring=args.recurring,
+                             start_date=args.start_date)
+    print(format_results(results))
+    if args.metrics:
+        print(metrics.to_prometheus())
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time as time_module
+
+from CalendarScheduler import BusyBlock
+
+# Default location, next to the per-user token and preference files
+DEFAULT_CACHE_PATH = os.path.join('user_data', 'busy_cache.sqlite3')
+
+
+class BusyCache:
+    """Durable busy-block cache shared by every session and surviving restarts.
+
+    Entries are keyed by user, calendar, time zone, buffer and date range and
+    tagged with the event version (the calendar's sync token) they were built
+    from. Entries older than ``ttl_seconds`` are ignored and pruned, and the
+    least recently used entries are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=300, max_entries=1000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS busy_blocks (
+                    key TEXT PRIMARY KEY,
+                    user_key TEXT,
+                    calendar_id TEXT,
+                    version TEXT,
+                    created_at REAL,
+                    accessed_at REAL,
+                    blocks TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS busy_blocks_accessed ON busy_blocks (accessed_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(user_key, calendar_id, local_tz, buffer_minutes, start_date, end_date):
+        return "|".join(str(part) for part in
+                        (user_key, calendar_id, local_tz, buffer_minutes, start_date, end_date))
+
+    def get(self, user_key, calendar_id, local_tz, buffer_minutes, start_date, end_date, version=None):
+        """Return cached blocks in ``local_tz``, or None on a miss.
+
+        When ``version`` is None (e.g. right after a restart, before the
+        calendar has been synced) any fresh entry is accepted.
+        """
+        key = self.make_key(user_key, calendar_id, local_tz, buffer_minutes, start_date, end_date)
+        now = time_module.time()
+        with self.lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT version, created_at, blocks FROM busy_blocks WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            row_version, created_at, blocks = row
+            if now - created_at > self.ttl_seconds:
+                conn.execute("DELETE FROM busy_blocks WHERE key = ?", (key,))
+                return None
+            if version is not None and row_version != version:
+                return None
+            conn.execute("UPDATE busy_blocks SET accessed_at = ? WHERE key = ?", (now, key))
+        try:
+            return tuple(BusyBlock(int(start), int(end), local_tz) for start, end in json.loads(blocks))
+        except (TypeError, ValueError):
+            # Rows written before blocks were stored as epoch seconds
+            return None
+
+    def put(self, user_key, calendar_id, local_tz, buffer_minutes, start_date, end_date, version, blocks):
+        key = self.make_key(user_key, calendar_id, local_tz, buffer_minutes, start_date, end_date)
+        now = time_module.time()
+        payload = json.dumps([(block.start_ts, block.end_ts) for block in blocks])
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO busy_blocks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, str(user_key), calendar_id, version, now, now, payload)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM busy_blocks WHERE created_at < ?", (now - self.ttl_seconds,))
+        conn.execute("""
+            DELETE FROM busy_blocks WHERE key IN (
+                SELECT key FROM busy_blocks ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def invalidate(self, user_key, calendar_id=None):
+        """Drop every cached entry for a user, optionally for one calendar only."""
+        with self.lock, self._connect() as conn:
+            if calendar_id is None:
+                conn.execute("DELETE FROM busy_blocks WHERE user_key = ?", (str(user_key),))
+            else:
+                conn.execute("DELETE FROM busy_blocks WHERE user_key = ? AND calendar_id = ?",
+                             (str(user_key), calendar_id))
@@ -1,88 +1,50 @@
 import streamlit as st
 from datetime import time as dtime, timedelta, datetime
 import time as time_module
-from CalendarScheduler import get_busy_times, find_free_windows
+from CalendarScheduler import (get_busy_times_multi, is_busy_times_warm, DEFAULT_FETCH_STRATEGY, buffer_blocks,
+                               stream_busy_blocks, iter_free_windows, find_free_windows_indexed, recommend_slots,
+                               forget_event_stores, forget_owner_calendar_ids, get_owner_calendar_ids)
+from busy_cache import BusyCache
+from prefetch import BusyPrefetcher
+from publish import AvailabilityPublisher
+from watch_channels import ChannelManager, start_notification_server
 from dateutil import tz
 import pytz
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-import json
+from service_pool import service_pool, build_service
+from user_store import (USER_DATA_DIR, get_user_id, get_credentials, save_credentials, delete_credentials,
+                        load_user_preferences, save_user_preferences, get_default_preferences,
+                        migrate_legacy_files)
 import os
-from google.auth.transport.requests import Request
-import pickle
-import hashlib
+import logging
 
 # OAuth scopes
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 
-# User data directory
-USER_DATA_DIR = 'user_data'
-os.makedirs(USER_DATA_DIR, exist_ok=True)
-
-def get_user_id(email):
-    """Generate a unique user ID from email."""
-    return hashlib.md5(email.encode()).hexdigest()
-
-def get_user_credentials_path(user_id):
-    """Get the path to store user credentials."""
-    return os.path.join(USER_DATA_DIR, f'{user_id}_token.pickle')
-
-def get_user_preferences_path(user_id):
-    """Get the path to store user preferences."""
-    return os.path.join(USER_DATA_DIR, f'{user_id}_preferences.json')
-
-def get_credentials(user_id):
-    """Gets valid user credentials from storage or initiates OAuth flow."""
-    creds = None
-    token_path = get_user_credentials_path(user_id)
+# Scheduler logging (set CALENDAR_SCHEDULER_LOG_LEVEL=DEBUG for per-event detail)
+logging.basicConfig(level=os.environ.get('CALENDAR_SCHEDULER_LOG_LEVEL', 'INFO'),
+                    format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+def format_free_day(day, blocks):
+    """Format one day's free windows as a bullet line for the email text."""
+    # Format date with weekday and ordinal (e.g., Friday, April 18th)
+    weekday = day.strftime('%A')
+    month = day.strftime('%B')
+    day_num = day.day
+    suffix = 'th' if 11 <= day_num <= 13 else {1: 'st', 2: 'nd', 3: 'rd'}.get(day_num % 10, 'th')
+    date_str = f"{weekday}, {month} {day_num}{suffix}"
     
-    if os.path.exists(token_path):
-        with open(token_path, 'rb') as token:
-            creds = pickle.load(token)
+    # Format time blocks
+    time_blocks = []
+    for start, end in blocks:
+        # Format times in lowercase with 'am/pm'
+        start_str = start.strftime('%-I:%M%p').lower()
+        end_str = end.strftime('%-I:%M%p').lower()
+        time_blocks.append(f"{start_str} to {end_str}")
     
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            return None
-    return creds
-
-def save_credentials(user_id, creds):
-    """Save user credentials to file."""
-    token_path = get_user_credentials_path(user_id)
-    with open(token_path, 'wb') as token:
-        pickle.dump(creds, token)
-
-def delete_credentials(user_id):
-    """Delete user credentials."""
-    token_path = get_user_credentials_path(user_id)
-    if os.path.exists(token_path):
-        os.remove(token_path)
-
-def load_user_preferences(user_id):
-    """Load user preferences from file."""
-    prefs_path = get_user_preferences_path(user_id)
-    if os.path.exists(prefs_path):
-        with open(prefs_path, 'r') as f:
-            return json.load(f)
-    return None
-
-def save_user_preferences(user_id, preferences):
-    """Save user preferences to file."""
-    prefs_path = get_user_preferences_path(user_id)
-    with open(prefs_path, 'w') as f:
-        json.dump(preferences, f)
-
-def get_default_preferences():
-    """Get default user preferences."""
-    return {
-        'timezone': 'US/Eastern',
-        'work_start': '09:00',
-        'work_end': '17:00',
-        'min_minutes': 30,
-        'buffer_minutes': 15
-    }
+    # Join date and times
+    return f"• {date_str}: {', '.join(time_blocks)}"
 
 st.set_page_config(page_title="Calendar Scheduler", layout="centered")
 
@@ -99,23 +61,73 @@ if 'show_tutorial' not in st.session_state:
     st.session_state.show_tutorial = True
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
-if 'service' not in st.session_state:
-    st.session_state.service = None
 if 'trigger_rerun' not in st.session_state:
     st.session_state.trigger_rerun = False
 if 'preferences' not in st.session_state:
     st.session_state.preferences = None
+if 'calendar_list' not in st.session_state:
+    st.session_state.calendar_list = None
+if 'calendar_summary' not in st.session_state:
+    st.session_state.calendar_summary = None
+
+# Import any old per-user files once per server process
+@st.cache_resource
+def migrate_user_data():
+    migrate_legacy_files()
+
+migrate_user_data()
+
+# One busy-block cache per server process, shared by every session
+@st.cache_resource
+def get_busy_cache():
+    return BusyCache(os.path.join(USER_DATA_DIR, 'busy_cache.sqlite3'))
+
+# Push notifications for calendar changes, when a public HTTPS address forwards to the receiver
+@st.cache_resource
+def get_channel_manager():
+    callback_url = os.environ.get('CALENDAR_SCHEDULER_WEBHOOK_URL')
+    if not callback_url:
+        return None
+    channels = ChannelManager(callback_url, get_busy_cache())
+    start_notification_server(channels, os.environ.get('CALENDAR_SCHEDULER_WEBHOOK_HOST', '127.0.0.1'),
+                              int(os.environ.get('CALENDAR_SCHEDULER_WEBHOOK_PORT', '8765')))
+    return channels
+
+# Static shareable snapshots, regenerated from fresh busy blocks and every 15 minutes
+@st.cache_resource
+def get_publisher():
+    publisher = AvailabilityPublisher(busy_cache=get_busy_cache())
+    publisher.start(interval=900)
+    return publisher
+
+# Background refresher keeping every signed-in user's next 90 days warm
+@st.cache_resource
+def get_prefetcher():
+    channels = get_channel_manager()
+    prefetcher = BusyPrefetcher(get_busy_cache(), horizon_days=90, channels=channels)
+    if channels is not None:
+        channels.add_listener(prefetcher.invalidate)
+    prefetcher.add_listener(get_publisher().on_snapshot)
+    return prefetcher
 
 def logout():
     """Clear authentication state and credentials."""
+    if st.session_state.user_id:
+        service_pool.invalidate(st.session_state.user_id)
+        forget_event_stores(st.session_state.user_id)
+        forget_owner_calendar_ids(st.session_state.user_id)
+        get_prefetcher().forget(st.session_state.user_id)
+        if get_channel_manager() is not None:
+            get_channel_manager().forget(st.session_state.user_id)
     st.session_state.authenticated = False
     st.session_state.show_tutorial = True
     st.session_state.creds = None
     st.session_state.calendar_id = None
-    st.session_state.service = None
     st.session_state.user_id = None
     st.session_state.user_email = None
     st.session_state.preferences = None
+    st.session_state.calendar_list = None
+    st.session_state.calendar_summary = None
     st.session_state.trigger_rerun = True
 
 # Check if we need to rerun after logout
@@ -208,16 +220,17 @@ if st.session_state.show_tutorial and not st.session_state.authenticated:
                     flow.fetch_token(code=code)
                     creds = flow.credentials
                     
-                    # Initialize the calendar service first
-                    calendar_service = build('calendar', 'v3', credentials=creds)
+                    # Initialize the calendar service first (from the cached discovery document)
+                    calendar_service = build_service(creds)
                     
                     # Get the primary calendar to verify access
                     calendar = calendar_service.calendars().get(calendarId='primary').execute()
                     user_email = calendar['id']  # The calendar ID is the user's email
                     user_id = get_user_id(user_email)
                     
-                    # Save credentials for this user
+                    # Save credentials for this user, and keep the service for their first fetch
                     save_credentials(user_id, creds)
+                    service_pool.put(user_id, creds, calendar_service)
                     
                     # Update session state
                     st.session_state.user_id = user_id
@@ -225,8 +238,8 @@ if st.session_state.show_tutorial and not st.session_state.authenticated:
                     st.session_state.creds = creds
                     st.session_state.authenticated = True
                     st.session_state.show_tutorial = False
-                    st.session_state.service = calendar_service
                     st.session_state.calendar_id = 'primary'
+                    st.session_state.calendar_summary = calendar.get('summary', user_email)
                     st.success(f"Successfully connected to {user_email}'s calendar!")
                     st.rerun()
                 except Exception as e:
@@ -269,7 +282,6 @@ if not st.session_state.authenticated:
         if creds:
             st.session_state.creds = creds
             st.session_state.authenticated = True
-            st.session_state.service = build('calendar', 'v3', credentials=creds)
             st.session_state.calendar_id = 'primary'
             st.rerun()
         else:
@@ -285,19 +297,40 @@ if not st.session_state.authenticated:
             st.rerun()
         st.stop()
 
-# Ensure service is available
-if not st.session_state.service:
+# Ensure credentials are available
+if not st.session_state.creds:
     st.error("Service not initialized. Please sign in again.")
     st.session_state.authenticated = False
     st.rerun()
 
-# Get user's primary calendar
-try:
-    calendar = st.session_state.service.calendars().get(calendarId='primary').execute()
-    st.write(f"✅ Connected to {st.session_state.user_email}'s calendar: {calendar['summary']}")
-except Exception as e:
-    st.error(f"❌ Could not access your calendar: {str(e)}")
-    st.stop()
+# Services are borrowed from the process-wide pool only when a call is made, not on every rerun
+service_factory = service_pool.factory(st.session_state.user_id, st.session_state.creds)
+
+# Get user's primary calendar (once per session, not on every rerun)
+if st.session_state.calendar_summary is None:
+    try:
+        with service_factory() as service:
+            calendar = service.calendars().get(calendarId='primary').execute()
+        st.session_state.calendar_summary = calendar['summary']
+    except Exception as e:
+        st.error(f"❌ Could not access your calendar: {str(e)}")
+        st.stop()
+st.write(f"✅ Connected to {st.session_state.user_email}'s calendar: {st.session_state.calendar_summary}")
+
+# --- Calendar selection ---
+if st.session_state.calendar_list is None:
+    try:
+        with service_factory() as service:
+            st.session_state.calendar_list = service.calendarList().list().execute().get('items', [])
+    except Exception as e:
+        st.warning(f"Could not list your calendars, using the primary one only: {str(e)}")
+        st.session_state.calendar_list = [{'id': 'primary', 'summary': st.session_state.calendar_summary, 'primary': True}]
+
+calendar_names = {c['id']: c.get('summaryOverride', c.get('summary', c['id'])) for c in st.session_state.calendar_list}
+selected_calendars = st.multiselect("Calendars that block your time:",
+                                    options=list(calendar_names),
+                                    default=[c['id'] for c in st.session_state.calendar_list if c.get('primary')],
+                                    format_func=lambda calendar_id: calendar_names[calendar_id])
 
 # Cache timezone list
 @st.cache_data
@@ -365,6 +398,19 @@ if st.session_state.authenticated and st.session_state.preferences:
         save_user_preferences(st.session_state.user_id, new_preferences)
         st.success("Preferences saved!")
 
+# --- Keep this view's busy blocks warm in the background ---
+# Only the calendar selection is part of the key: zone, buffer and work hours are applied locally
+# A search made before the first snapshot lands waits this long for it rather than fetching again
+PREFETCH_WAIT_SECONDS = float(os.environ.get('CALENDAR_SCHEDULER_PREFETCH_WAIT_SECONDS', '30'))
+owner_calendar_ids = get_owner_calendar_ids(service_factory, st.session_state.user_id, st.session_state.calendar_list)
+prefetch_key = get_prefetcher().register(
+    st.session_state.user_id, service_factory,
+    selected_calendars or [st.session_state.calendar_id], owner_calendar_ids=owner_calendar_ids)
+if get_channel_manager() is not None:
+    # Refetch only when Google says one of these calendars changed
+    get_channel_manager().ensure(service_factory, st.session_state.user_id,
+                                 selected_calendars or [st.session_state.calendar_id])
+
 # --- Date range selection ---
 st.subheader("Select Date Range")
 col1, col2 = st.columns(2)
@@ -382,55 +428,111 @@ with col2:
 # Display selected date range
 st.write(f"Showing availability from **{start_date.strftime('%A, %B %d, %Y')}** to **{end_date.strftime('%A, %B %d, %Y')}**")
 
+# --- Suggested meeting times ---
+SLOT_PREFERENCE_LABELS = {'earliest': "Earliest", 'spread': "Spread across days", 'avoid_lunch': "Avoid lunch hour"}
+slot_preference = st.radio("Suggest meeting times:", options=list(SLOT_PREFERENCE_LABELS),
+                           format_func=SLOT_PREFERENCE_LABELS.get, horizontal=True)
+
 # --- Trigger scheduler ---
 if st.button("Find My Free Time"):
     with st.spinner("Checking your calendar..."):
         try:
             total_start = time_module.time()
             
-            # Get busy times for the selected date range
-            busy_blocks = get_busy_times(st.session_state.service, st.session_state.calendar_id, local_tz, buffer_minutes, 
-                                       start_date=start_date, end_date=end_date)
-            
-            if len(busy_blocks) == 0:
-                st.warning("No busy blocks found. Make sure you have events in your calendar.")
+            # Get busy times for the selected calendars and date range
+            calendar_ids = selected_calendars or [st.session_state.calendar_id]
+            busy_cache = get_busy_cache()
+            # Under free/busy-first only the owner's calendars need a full event listing
+            event_calendar_ids = [calendar_id for calendar_id in calendar_ids
+                                  if DEFAULT_FETCH_STRATEGY == 'events' or calendar_id in owner_calendar_ids]
+            snapshot = get_prefetcher().get(prefetch_key, wait=PREFETCH_WAIT_SECONDS)
+            if snapshot is not None and snapshot.covers(start_date, end_date):
+                # Served from the background snapshot; a stale one is refreshed off the request path
+                st.caption(f"Calendar as of {datetime.fromtimestamp(snapshot.fetched_at, local_tz).strftime('%-I:%M:%S %p')}"
+                           f" ({int(snapshot.age() // 60)} min ago)")
+                busy_blocks = tuple(buffer_blocks(snapshot.busy_blocks, buffer_minutes, local_tz))
+                # Gaps are indexed by length once, so moving the minimum-length slider is a lookup
+                free_windows = find_free_windows_indexed(busy_blocks, local_tz, work_start, work_end, min_minutes,
+                                                         start_date=start_date, end_date=end_date)
+            # Calendars are cached without a buffer (see get_busy_times_multi)
+            elif all(is_busy_times_warm(st.session_state.user_id, calendar_id, local_tz, 0,
+                                      start_date=start_date, end_date=end_date, cache=busy_cache)
+                   for calendar_id in event_calendar_ids):
+                # Warm: fetch concurrently (incremental sync / cache hits)
+                busy_blocks = get_busy_times_multi(service_factory, st.session_state.user_id,
+                                                   calendar_ids, local_tz, buffer_minutes,
+                                                   start_date=start_date, end_date=end_date, cache=busy_cache,
+                                                   owner_calendar_ids=owner_calendar_ids)
+                if len(busy_blocks) == 0:
+                    st.warning("No busy blocks found. Make sure you have events in your calendar.")
+                free_windows = find_free_windows_indexed(busy_blocks, local_tz, work_start, work_end, min_minutes,
+                                                         start_date=start_date, end_date=end_date)
+            else:
+                # Cold: stream pages so the first days show up while later pages load
+                busy_blocks = stream_busy_blocks(service_factory, st.session_state.user_id,
+                                                 calendar_ids, local_tz, buffer_minutes,
+                                                 start_date=start_date, end_date=end_date, cache=busy_cache,
+                                                 owner_calendar_ids=owner_calendar_ids)
+                free_windows = iter_free_windows(busy_blocks, local_tz, work_start, work_end, min_minutes,
+                                                 start_date, end_date)
             
-            # Find free windows
-            free_windows = find_free_windows(busy_blocks, local_tz, work_start, work_end, min_minutes)
-
-            if not free_windows:
+            # Show each day as soon as it's known
+            formatted_output = []
+            found_windows = []
+            progress = st.empty()
+            for day, blocks in free_windows:
+                found_windows.append((day, blocks))
+                formatted_output.append(format_free_day(day, blocks))
+                progress.text("\n".join(formatted_output))
+            progress.empty()
+
+            if not formatted_output:
                 st.warning("No free time blocks found with the selected settings.")
             else:
                 st.success(f"✅ Available times from {start_date.strftime('%A, %B %d')} to {end_date.strftime('%A, %B %d')}:")
-                # Create a text area with formatted output
-                formatted_output = []
-                for day, blocks in free_windows:
-                    # Format date with weekday and ordinal (e.g., Friday, April 18th)
-                    weekday = day.strftime('%A')
-                    month = day.strftime('%B')
-                    day_num = day.day
-                    suffix = 'th' if 11 <= day_num <= 13 else {1: 'st', 2: 'nd', 3: 'rd'}.get(day_num % 10, 'th')
-                    date_str = f"{weekday}, {month} {day_num}{suffix}"
-                    
-                    # Format time blocks
-                    time_blocks = []
-                    for start, end in blocks:
-                        # Format times in lowercase with 'am/pm'
-                        start_str = start.strftime('%-I:%M%p').lower()
-                        end_str = end.strftime('%-I:%M%p').lower()
-                        time_blocks.append(f"{start_str} to {end_str}")
-                    
-                    # Join date and times
-                    formatted_output.append(f"• {date_str}: {', '.join(time_blocks)}")
-                
                 # Join with newlines and display in a text area
                 email_text = "\n".join(formatted_output)
                 st.text_area("Copy and paste these times into your email:", 
                            value=email_text,
                            height=300)
+
+                suggestions = [f"{start.strftime('%A, %B %d')}: {start.strftime('%-I:%M%p').lower()} to {end.strftime('%-I:%M%p').lower()}"
+                               for start, end in recommend_slots(found_windows, min_minutes, k=5, prefer=slot_preference)]
+                if suggestions:
+                    st.markdown("**Suggested meeting times:**\n" + "\n".join(f"- {line}" for line in suggestions))
         except Exception as e:
             st.error(f"An error occurred: {e}")
             if st.button("Show Setup Instructions Again"):
                 st.session_state.show_tutorial = True
                 st.rerun()
 
+# --- Shareable availability links ---
+# Published times are static files served by availability_server.py under /s/
+PUBLIC_URL = os.environ.get('CALENDAR_SCHEDULER_PUBLIC_URL', 'http://localhost:8080').rstrip('/')
+st.subheader("Share Your Availability")
+publisher = get_publisher()
+if st.button("Publish a shareable link"):
+    publication = None
+    try:
+        publication = publisher.publish(st.session_state.user_id, selected_calendars or [st.session_state.calendar_id],
+                                        timezone_label, work_start, work_end, min_minutes, buffer_minutes)
+        params = publication.params()
+        snapshot = get_prefetcher().get(prefetch_key)
+        if snapshot is not None and snapshot.covers(params['start_date'], params['end_date']):
+            publisher.update(publication, snapshot.busy_blocks, params)
+        else:
+            publisher.refresh(publication)
+    except Exception as e:
+        if publication is not None:
+            # Never list a link whose files were not written
+            publisher.unpublish(publication.token)
+        st.error(f"Could not publish your availability: {e}")
+
+for publication in publisher.publications_for(st.session_state.user_id):
+    link = f"{PUBLIC_URL}/s/{publication.token}"
+    st.markdown(f"[Web page]({link}.html) · [Calendar (ICS)]({link}.ics) · [JSON]({link}.json)")
+    st.caption(f"{publication.timezone}, {publication.work_start[:5]}-{publication.work_end[:5]}, "
+               f"at least {publication.min_minutes} minutes, next {publication.days} days")
+    if st.button("Stop sharing", key=f"unpublish-{publication.token}"):
+        publisher.unpublish(publication.token)
+        st.rerun()
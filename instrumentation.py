@@ -0,0 +1,79 @@
+import contextlib
+import json
+import threading
+import time as time_module
+from collections import defaultdict, deque
+
+
+class Instrumentation:
+    """Per-stage timing spans and counters for the scheduling pipeline.
+
+    Spans are aggregated per stage (count, total and max seconds) and the
+    most recent ones are kept for inspection. Everything can be exported as
+    JSON or in the Prometheus text exposition format.
+    """
+
+    def __init__(self, recent_spans=500):
+        self._lock = threading.Lock()
+        self._stages = defaultdict(lambda: {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        self._counters = defaultdict(int)
+        self._recent = deque(maxlen=recent_spans)
+
+    @contextlib.contextmanager
+    def span(self, stage, **attributes):
+        start = time_module.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time_module.perf_counter() - start, **attributes)
+
+    def record(self, stage, seconds, **attributes):
+        with self._lock:
+            stats = self._stages[stage]
+            stats['count'] += 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            self._recent.append(dict(attributes, stage=stage, seconds=seconds, at=time_module.time()))
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'stages': {stage: dict(stats) for stage, stats in self._stages.items()},
+                'counters': dict(self._counters),
+                'recent_spans': list(self._recent),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._recent.clear()
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, prefix='calendar_scheduler'):
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent per pipeline stage.",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, stats in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["total_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines.append(f"# HELP {prefix}_stage_seconds_max Slowest single span per pipeline stage.")
+        lines.append(f"# TYPE {prefix}_stage_seconds_max gauge")
+        for stage, stats in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}_stage_seconds_max{{stage="{stage}"}} {stats["max_seconds"]:.6f}')
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide instance used by CalendarScheduler
+metrics = Instrumentation()
@@ -0,0 +1,215 @@
+import logging
+import threading
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta
+
+import pytz
+
+from CalendarScheduler import get_busy_times_multi
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """Raw busy blocks for one user's calendars over a UTC date range, as of ``fetched_at``.
+
+    Blocks carry no buffer and are in UTC; callers apply both with
+    CalendarScheduler.buffer_blocks.
+    """
+
+    __slots__ = ('busy_blocks', 'start_date', 'end_date', 'fetched_at')
+
+    def __init__(self, busy_blocks, start_date, end_date, fetched_at):
+        self.busy_blocks = busy_blocks
+        self.start_date = start_date
+        self.end_date = end_date
+        self.fetched_at = fetched_at
+
+    def age(self):
+        return time_module.time() - self.fetched_at
+
+    def covers(self, start_date, end_date):
+        # Local dates in any zone fall inside the UTC range once a day is trimmed off each end
+        return self.start_date < start_date and end_date < self.end_date
+
+
+class BusyPrefetcher:
+    """Keeps each active user's next ``horizon_days`` of busy blocks warm in the background.
+
+    Callers register which calendars a user is looking at and read back the
+    last snapshot immediately. Snapshots are raw UTC blocks, so the user's
+    zone, buffer and work hours can change without a refetch. A snapshot older than
+    ``refresh_interval`` seconds is still returned but triggers a refresh
+    off the request path (stale-while-revalidate); concurrent refreshes of
+    the same key share one fetch. A daemon thread re-refreshes registered
+    users on the same interval until they go ``idle_timeout`` seconds
+    without a request.
+
+    With ``channels`` (a watch_channels.ChannelManager), views whose
+    calendars are all watched are refreshed when a change is pushed to
+    ``invalidate``, and only every ``watched_refresh_interval`` seconds
+    otherwise, as a safety net for lost notifications.
+    """
+
+    def __init__(self, busy_cache=None, horizon_days=90, refresh_interval=300, idle_timeout=1800, max_workers=4,
+                 channels=None, watched_refresh_interval=3600):
+        self.busy_cache = busy_cache
+        self.horizon_days = horizon_days
+        self.refresh_interval = refresh_interval
+        self.idle_timeout = idle_timeout
+        self.channels = channels
+        self.watched_refresh_interval = watched_refresh_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._in_flight = {}
+        self._dirty = set()
+        self._active = {}
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def make_key(user_key, calendar_ids):
+        return (user_key, tuple(dict.fromkeys(calendar_ids)))
+
+    def add_listener(self, listener):
+        """Call ``listener(key, snapshot)`` from the worker thread after every successful refresh."""
+        self._listeners.append(listener)
+
+    def _is_stale(self, key, snapshot):
+        if snapshot is None:
+            return True
+        watched = self.channels is not None and self.channels.is_watched(*key)
+        return snapshot.age() > (self.watched_refresh_interval if watched else self.refresh_interval)
+
+    def register(self, user_key, service_factory, calendar_ids, owner_calendar_ids=('primary',)):
+        """Mark a view as active and start fetching it if there's no fresh snapshot. Returns the key."""
+        key = self.make_key(user_key, calendar_ids)
+        with self._lock:
+            self._active[key] = (time_module.time(), service_factory, owner_calendar_ids)
+        self._ensure_thread()
+        if self._is_stale(key, self._snapshots.get(key)):
+            self.refresh(key)
+        return key
+
+    def get(self, key, wait=None):
+        """Last snapshot for ``key`` (possibly stale) or None; a stale one is refreshed in the background.
+
+        With ``wait`` (seconds) and no snapshot yet, wait that long for the
+        fetch already running for ``key`` instead of returning None, so the
+        caller doesn't start a second cold fetch of the same calendars.
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            future = self._in_flight.get(key)
+            if key in self._active:
+                self._active[key] = (time_module.time(),) + self._active[key][1:]
+        if snapshot is None and wait and future is not None:
+            metrics.count('prefetch_waits')
+            try:
+                snapshot = future.result(timeout=wait)
+            except FutureTimeoutError:
+                pass
+        if snapshot is None:
+            metrics.count('prefetch_misses')
+        else:
+            metrics.count('prefetch_hits')
+            if self._is_stale(key, snapshot):
+                self.refresh(key)
+        return snapshot
+
+    def refresh(self, key):
+        """Start a background fetch for ``key`` unless one is already running; returns its future."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                metrics.count('prefetch_coalesced')
+                return future
+            active = self._active.get(key)
+            if active is None:
+                return None
+            future = self._executor.submit(self._fetch, key, *active[1:])
+            self._in_flight[key] = future
+        return future
+
+    def invalidate(self, user_key, calendar_id):
+        """Refresh every active view of a changed calendar (a ChannelManager listener).
+
+        A fetch already running may have read the calendar before the
+        change, so it is run once more when it finishes.
+        """
+        with self._lock:
+            keys = [k for k in self._active if k[0] == user_key and calendar_id in k[1]]
+            for key in keys:
+                if key in self._in_flight:
+                    self._dirty.add(key)
+        for key in keys:
+            self.refresh(key)
+
+    def _fetch(self, key, service_factory, owner_calendar_ids):
+        user_key, calendar_ids = key
+        # Today and the horizon in any zone, with a day to spare at each end (see Snapshot.covers)
+        today = datetime.now(pytz.UTC).date()
+        start_date = today - timedelta(days=2)
+        end_date = today + timedelta(days=self.horizon_days + 2)
+        try:
+            with metrics.span('prefetch', calendars=len(calendar_ids)):
+                busy_blocks = get_busy_times_multi(service_factory, user_key, calendar_ids, pytz.UTC, 0,
+                                                   start_date=start_date, end_date=end_date, cache=self.busy_cache,
+                                                   owner_calendar_ids=owner_calendar_ids)
+            snapshot = Snapshot(busy_blocks, start_date, end_date, time_module.time())
+            with self._lock:
+                if key not in self._active:
+                    # Forgotten (e.g. logged out) while fetching: keep nothing and tell nobody
+                    return None
+                self._snapshots[key] = snapshot
+            for listener in list(self._listeners):
+                try:
+                    listener(key, snapshot)
+                except Exception:
+                    logger.exception("Snapshot listener failed for %s", user_key)
+            return snapshot
+        except Exception:
+            # Keep serving the previous snapshot; the next interval retries
+            metrics.count('prefetch_errors')
+            logger.exception("Background refresh failed for %s", user_key)
+            return None
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                rerun = key in self._dirty
+                self._dirty.discard(key)
+            if rerun:
+                self.refresh(key)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='prefetch-scheduler', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(min(self.refresh_interval, 60)):
+            now = time_module.time()
+            with self._lock:
+                for key in [k for k, active in self._active.items() if now - active[0] > self.idle_timeout]:
+                    del self._active[key]
+                    self._snapshots.pop(key, None)
+                due = [k for k in self._active if self._is_stale(k, self._snapshots.get(k))]
+            for key in due:
+                self.refresh(key)
+
+    def forget(self, user_key):
+        """Stop refreshing and drop every snapshot for a user (e.g. on logout); fetches still running are discarded."""
+        with self._lock:
+            for key in [k for k in self._active if k[0] == user_key]:
+                del self._active[key]
+            for key in [k for k in self._snapshots if k[0] == user_key]:
+                del self._snapshots[key]
+
+    def close(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,310 @@
+import argparse
+import contextlib
+import fcntl
+import html
+import json
+import logging
+import os
+import secrets
+import tempfile
+import threading
+import time as time_module
+from datetime import datetime, timedelta
+
+import pytz
+
+from availability_server import (PUBLISHED_DIR, PUBLISHED_FORMATS, AvailabilityError, resolve_params,
+                                 fetch_busy_blocks, windows_payload)
+from CalendarScheduler import buffer_blocks, find_free_windows
+from busy_cache import BusyCache
+from instrumentation import metrics
+from user_store import USER_DATA_DIR, migrate_legacy_files
+
+logger = logging.getLogger(__name__)
+
+# Who published what; kept outside PUBLISHED_DIR so it is never served
+PUBLICATIONS_PATH = os.path.join(USER_DATA_DIR, 'publications.json')
+
+
+def _write_atomically(path, body):
+    # Each writer gets its own temporary file, renamed over ``path``, so readers and
+    # concurrent writers (other threads or processes) never see half a file
+    f = tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp', delete=False)
+    try:
+        with f:
+            f.write(body)
+        os.replace(f.name, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(f.name)
+        raise
+
+
+class Publication:
+    """A user's published availability: the settings its snapshot files are generated with."""
+
+    __slots__ = ('token', 'user_id', 'calendar_ids', 'timezone', 'work_start', 'work_end', 'min_minutes',
+                 'buffer_minutes', 'days')
+
+    def __init__(self, token, user_id, calendar_ids, timezone, work_start, work_end, min_minutes, buffer_minutes,
+                 days=14):
+        self.token = token
+        self.user_id = user_id
+        self.calendar_ids = tuple(calendar_ids)
+        self.timezone = timezone
+        self.work_start = work_start
+        self.work_end = work_end
+        self.min_minutes = min_minutes
+        self.buffer_minutes = buffer_minutes
+        self.days = days
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def params(self):
+        """Availability parameters (see availability_server.resolve_params) for today onwards."""
+        today = datetime.now(pytz.timezone(self.timezone)).date()
+        return resolve_params(self.user_id, self.timezone, self.work_start, self.work_end, str(self.min_minutes),
+                              str(self.buffer_minutes), today.isoformat(),
+                              (today + timedelta(days=self.days)).isoformat(), ','.join(self.calendar_ids))
+
+
+# --- Renderers: one compact static file per format ---
+def _format_day(day, windows):
+    suffix = 'th' if 11 <= day.day <= 13 else {1: 'st', 2: 'nd', 3: 'rd'}.get(day.day % 10, 'th')
+    times = ', '.join(f"{start.strftime('%-I:%M%p').lower()} to {end.strftime('%-I:%M%p').lower()}"
+                      for start, end in windows)
+    return f"{day.strftime('%A, %B')} {day.day}{suffix}: {times}"
+
+
+def render_json(publication, free_windows, generated_at):
+    return json.dumps({
+        'timezone': publication.timezone,
+        'min_minutes': publication.min_minutes,
+        'generated_at': generated_at.isoformat(),
+        'days': windows_payload(free_windows),
+    }, separators=(',', ':')).encode('utf-8')
+
+
+def render_ics(publication, free_windows, generated_at):
+    stamp = generated_at.astimezone(pytz.UTC).strftime('%Y%m%dT%H%M%SZ')
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//CalendarScheduler//Availability//EN',
+             'X-WR-CALNAME:Available times']
+    for _, windows in free_windows:
+        for start, end in windows:
+            lines += ['BEGIN:VEVENT',
+                      f"UID:{publication.token}-{int(start.timestamp())}@calendar-scheduler",
+                      f"DTSTAMP:{stamp}",
+                      f"DTSTART:{start.astimezone(pytz.UTC).strftime('%Y%m%dT%H%M%SZ')}",
+                      f"DTEND:{end.astimezone(pytz.UTC).strftime('%Y%m%dT%H%M%SZ')}",
+                      'SUMMARY:Available',
+                      'TRANSP:TRANSPARENT',
+                      'END:VEVENT']
+    lines.append('END:VCALENDAR')
+    return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+
+def render_html(publication, free_windows, generated_at):
+    items = '\n'.join(f"<li>{html.escape(_format_day(day, windows))}</li>" for day, windows in free_windows)
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width">
+<title>Available times</title></head>
+<body style="font-family:sans-serif;max-width:40em;margin:2em auto">
+<h1>Available times</h1>
+<p>Times in {html.escape(publication.timezone)}, at least {publication.min_minutes} minutes.
+Updated {html.escape(generated_at.strftime('%A, %B %d at %-I:%M%p').replace('AM', 'am').replace('PM', 'pm'))}.</p>
+<ul>
+{items or f'<li>No free times in the next {publication.days} days.</li>'}
+</ul>
+</body></html>
+""".encode('utf-8')
+
+
+RENDERERS = {'json': render_json, 'ics': render_ics, 'html': render_html}
+
+
+class AvailabilityPublisher:
+    """Publishes users' free windows as static JSON, ICS and HTML files under a shareable token.
+
+    Files live in ``directory`` as ``<token>.<format>`` and are served as-is
+    (see the /s/ route in availability_server), so a recipient's view costs
+    one file read. ``update`` regenerates a user's files from new busy
+    blocks and rewrites them only when the windows actually changed; it is
+    fed by BusyPrefetcher snapshots while the user is active and by
+    ``refresh_all`` (cached, incremental fetches) otherwise.
+    """
+
+    def __init__(self, directory=PUBLISHED_DIR, busy_cache=None, registry_path=PUBLICATIONS_PATH):
+        self.directory = directory
+        self.busy_cache = busy_cache
+        self._lock = threading.Lock()
+        self._last = {}
+        os.makedirs(directory, exist_ok=True)
+        self._registry_path = registry_path
+        self._registry_mtime = None
+        self._publications = {}
+        self._load_registry()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load_registry(self, force=False):
+        # Reloaded when another process (the web app or the refresher) has changed it
+        try:
+            mtime = os.path.getmtime(self._registry_path)
+        except FileNotFoundError:
+            return
+        if mtime == self._registry_mtime and not force:
+            return
+        with open(self._registry_path, 'r') as f:
+            self._publications = {token: Publication(**fields) for token, fields in json.load(f).items()}
+        self._registry_mtime = mtime
+
+    def _save_registry(self):
+        _write_atomically(self._registry_path, json.dumps(
+            {token: p.to_dict() for token, p in self._publications.items()}).encode())
+        self._registry_mtime = os.path.getmtime(self._registry_path)
+
+    @contextlib.contextmanager
+    def _editing_registry(self):
+        """Hold the registry for a read-modify-write, against threads and other processes alike.
+
+        The thread lock is taken first, then an flock on ``<registry>.lock``;
+        the registry is reread under both, since an mtime can miss a write
+        made within the same clock tick.
+        """
+        with self._lock:
+            os.makedirs(os.path.dirname(self._registry_path) or '.', exist_ok=True)
+            with open(self._registry_path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._load_registry(force=True)
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, name, body):
+        _write_atomically(os.path.join(self.directory, name), body)
+
+    # --- Managing publications ---
+    def publish(self, user_id, calendar_ids, timezone, work_start, work_end, min_minutes, buffer_minutes, days=14):
+        """Create a publication and return it; call ``refresh`` or ``update`` to write its files."""
+        publication = Publication(secrets.token_urlsafe(16), user_id, calendar_ids, str(timezone),
+                                  work_start.isoformat(), work_end.isoformat(), min_minutes, buffer_minutes, days)
+        with self._editing_registry():
+            self._publications[publication.token] = publication
+            self._save_registry()
+        return publication
+
+    def unpublish(self, token):
+        with self._editing_registry():
+            if self._publications.pop(token, None) is None:
+                return
+            self._last.pop(token, None)
+            self._save_registry()
+        for fmt in PUBLISHED_FORMATS:
+            try:
+                os.remove(os.path.join(self.directory, f"{token}.{fmt}"))
+            except FileNotFoundError:
+                pass
+
+    def publications_for(self, user_id):
+        with self._lock:
+            self._load_registry()
+            return [p for p in self._publications.values() if p.user_id == user_id]
+
+    # --- Regenerating files ---
+    def update(self, publication, busy_blocks, params=None):
+        """Regenerate a publication from raw busy blocks; returns whether its files changed.
+
+        ``busy_blocks`` must not be buffered yet (as stored by the
+        prefetcher); the publication's own buffer is applied here.
+        """
+        params = params or publication.params()
+        busy_blocks = tuple(buffer_blocks(busy_blocks, params['buffer_minutes'], params['local_tz']))
+        free_windows = find_free_windows(busy_blocks, params['local_tz'], params['work_start'], params['work_end'],
+                                         params['min_minutes'], start_date=params['start_date'],
+                                         end_date=params['end_date'])
+        with self._lock:
+            if publication.token not in self._publications:
+                # Unpublished while this update was running
+                return False
+            if self._last.get(publication.token) == free_windows:
+                metrics.count('publish_unchanged')
+                return False
+            self._last[publication.token] = free_windows
+
+        generated_at = datetime.now(params['local_tz'])
+        for fmt, render in RENDERERS.items():
+            self._write(f"{publication.token}.{fmt}", render(publication, free_windows, generated_at))
+        metrics.count('publish_writes')
+        logger.info("Published %d days of availability for %s", len(free_windows), publication.user_id)
+        return True
+
+    def on_snapshot(self, key, snapshot):
+        """BusyPrefetcher listener: regenerate the user's publications over the same calendars."""
+        user_key, calendar_ids = key
+        for publication in self.publications_for(user_key):
+            if set(publication.calendar_ids) != set(calendar_ids):
+                continue
+            params = publication.params()
+            if snapshot.covers(params['start_date'], params['end_date']):
+                self.update(publication, snapshot.busy_blocks, params)
+
+    def refresh(self, publication):
+        """Fetch (through the busy cache) and regenerate one publication; returns whether it changed."""
+        params = publication.params()
+        # The buffer goes on in update(), so fetch raw blocks
+        busy_blocks = fetch_busy_blocks(dict(params, buffer_minutes=0), self.busy_cache)
+        return self.update(publication, busy_blocks, params)
+
+    def refresh_all(self):
+        with self._lock:
+            self._load_registry()
+            publications = list(self._publications.values())
+        changed = 0
+        for publication in publications:
+            try:
+                changed += self.refresh(publication)
+            except AvailabilityError as e:
+                logger.warning("Could not refresh publication for %s: %s", publication.user_id, e)
+            except Exception:
+                logger.exception("Could not refresh publication for %s", publication.user_id)
+        return changed
+
+    def start(self, interval=900):
+        """Refresh every publication every ``interval`` seconds on a daemon thread."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(interval,), name='publisher', daemon=True)
+                self._thread.start()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self.refresh_all()
+
+    def close(self):
+        self._stop.set()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Keep published availability snapshots up to date.")
+    arg_parser.add_argument('--interval', type=int, default=900, help="seconds between refreshes")
+    arg_parser.add_argument('--once', action='store_true', help="refresh every publication once and exit")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get('CALENDAR_SCHEDULER_LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    migrate_legacy_files()
+    publisher = AvailabilityPublisher(busy_cache=BusyCache())
+    while True:
+        started = time_module.perf_counter()
+        changed = publisher.refresh_all()
+        logger.info("Refreshed publications in %.1fs, %d changed", time_module.perf_counter() - started, changed)
+        if args.once:
+            return
+        time_module.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/calendar/v3/rest'
+DISCOVERY_CACHE_PATH = os.path.join('user_data', 'calendar_v3_discovery.json')
+
+_discovery_document = None
+_discovery_lock = threading.Lock()
+
+
+def get_discovery_document(cache_path=DISCOVERY_CACHE_PATH):
+    """Parsed Calendar v3 discovery document, loaded once per process.
+
+    Prefers the copy bundled with google-api-python-client, then a cached
+    copy on disk, and only fetches it over the network as a last resort.
+    """
+    global _discovery_document
+    with _discovery_lock:
+        if _discovery_document is not None:
+            return _discovery_document
+
+        document = get_static_doc('calendar', 'v3')
+        if document is None and os.path.exists(cache_path):
+            with open(cache_path, 'r') as f:
+                document = f.read()
+        if document is None:
+            logger.info("Fetching Calendar discovery document")
+            response, document = httplib2.Http(timeout=30).request(DISCOVERY_URL)
+            if response.status != 200:
+                raise RuntimeError(f"Could not fetch discovery document: HTTP {response.status}")
+            document = document.decode('utf-8')
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, 'w') as f:
+                f.write(document)
+
+        _discovery_document = json.loads(document)
+        return _discovery_document
+
+
+def build_service(creds, timeout=60):
+    """Build a Calendar service from the cached discovery document.
+
+    Each service gets its own keep-alive httplib2 connection, so it must
+    only be used from one thread at a time.
+    """
+    with metrics.span('build_service'):
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=timeout))
+        return build_from_document(get_discovery_document(), http=http)
+
+
+class ServicePool:
+    """Per-user Calendar services that outlive threads and Streamlit reruns.
+
+    Services are checked out for exclusive use and handed back afterwards,
+    so whichever thread fetches next (a rerun, a short-lived fetch worker,
+    the prefetcher) reuses an idle keep-alive connection instead of
+    building its own. A service is only reused with the credentials object
+    it was built with. At most ``max_idle`` idle services are kept per user
+    and ``max_users`` users overall, least recently used first out.
+    """
+
+    def __init__(self, max_users=64, max_idle=8):
+        self.max_users = max_users
+        self.max_idle = max_idle
+        self._idle = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def checkout(self, user_key, creds):
+        """Yield a service for this user that no other thread uses until the block exits."""
+        with self._lock:
+            generation = self._generations.get(user_key, 0)
+            entry = self._idle.get(user_key)
+            service = None
+            if entry is not None and entry[0] is creds and entry[1] == generation and entry[2]:
+                service = entry[2].pop()
+                self._idle.move_to_end(user_key)
+        if service is None:
+            metrics.count('service_pool_misses')
+            service = build_service(creds)
+        else:
+            metrics.count('service_pool_hits')
+        try:
+            yield service
+        finally:
+            self.put(user_key, creds, service, generation)
+
+    def put(self, user_key, creds, service, generation=None):
+        """Hand a service built for ``creds`` to the pool (e.g. the one made while signing in)."""
+        with self._lock:
+            current = self._generations.get(user_key, 0)
+            if generation is not None and generation != current:
+                # Invalidated while it was checked out
+                return
+            entry = self._idle.get(user_key)
+            if entry is None or entry[0] is not creds or entry[1] != current:
+                entry = self._idle[user_key] = (creds, current, [])
+            if len(entry[2]) < self.max_idle:
+                entry[2].append(service)
+            self._idle.move_to_end(user_key)
+            while len(self._idle) > self.max_users:
+                self._idle.popitem(last=False)
+
+    def factory(self, user_key, creds):
+        """A zero-argument callable returning a ``checkout`` context for this user."""
+        return lambda: self.checkout(user_key, creds)
+
+    def invalidate(self, user_key):
+        """Drop this user's services, including ones checked out right now (e.g. on logout)."""
+        with self._lock:
+            self._generations[user_key] = self._generations.get(user_key, 0) + 1
+            self._idle.pop(user_key, None)
+
+
+def fixed_service(service):
+    """A service factory that always hands out ``service``, for scripts and tests with one client."""
+    return lambda: contextlib.nullcontext(service)
+
+
+# Process-wide pool shared by every Streamlit session
+service_pool = ServicePool()
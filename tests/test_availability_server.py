@@ -0,0 +1,61 @@
+import json
+import os
+import threading
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+import availability_server
+from availability_server import AvailabilityService, PUBLISHED_DIR, make_server
+
+API_KEY = 'test-key-1234'
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = make_server('127.0.0.1', 0, workers=2, api_keys=[API_KEY],
+                         availability=AvailabilityService(busy_cache=availability_server.BusyCache(
+                             str(tmp_path / 'busy_cache.sqlite3'))))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def _get(url, key=None):
+    headers = {'Authorization': f"Bearer {key}"} if key else {}
+    try:
+        with urlopen(Request(url, headers=headers), timeout=5) as response:
+            return response.status, response.read()
+    except HTTPError as e:
+        return e.code, e.read()
+
+
+@pytest.mark.parametrize('path', ['/availability?user=a@example.com',
+                                  '/common-availability?users=a@example.com,b@example.com'])
+def test_availability_requires_an_api_key(server, path):
+    assert _get(server + path)[0] == 401
+    assert _get(server + path, 'wrong-key')[0] == 401
+
+
+def test_valid_key_reaches_the_handler(server):
+    status, body = _get(server + '/availability?user=a@example.com', API_KEY)
+    assert status == 404
+    assert 'No stored credentials' in json.loads(body)['error']
+
+
+@pytest.mark.parametrize('value', ['0', '-15'])
+def test_non_positive_min_minutes_is_rejected(server, value):
+    status, body = _get(server + f"/availability?user=a@example.com&min_minutes={value}", API_KEY)
+    assert status == 400
+    assert 'min_minutes' in json.loads(body)['error']
+
+
+def test_published_snapshots_and_health_stay_public(server):
+    os.makedirs(PUBLISHED_DIR)
+    token = 'A' * 22
+    with open(os.path.join(PUBLISHED_DIR, f"{token}.json"), 'w') as f:
+        f.write('{"days": []}')
+    assert _get(server + f"/s/{token}.json") == (200, b'{"days": []}')
+    assert _get(server + '/healthz')[0] == 200
@@ -0,0 +1,32 @@
+from datetime import datetime, time
+
+import pytz
+
+from benchmark import DEFAULT_START_DATE, FakeCalendarService, generate_calendar, run_benchmarks
+from CalendarScheduler import GapIndex, find_free_windows, find_free_windows_numpy, get_busy_times
+
+TZ = pytz.timezone('US/Eastern')
+
+
+def _counts(results):
+    return [(r['stage'], r['events'], r['busy_blocks'], r['api_calls'], r['response_bytes']) for r in results]
+
+
+def test_runs_are_reproducible():
+    first = run_benchmarks(sizes=[50], repeat=1, measure_memory=False, recurring=2)
+    second = run_benchmarks(sizes=[50], repeat=1, measure_memory=False, recurring=2)
+    assert _counts(first) == _counts(second)
+
+
+def test_frozen_now_gives_the_same_windows_from_every_engine():
+    end_date = DEFAULT_START_DATE.replace(day=31)
+    service = FakeCalendarService(generate_calendar(200, 'US/Eastern', days=25, start_date=DEFAULT_START_DATE))
+    blocks = get_busy_times(service, 'primary', TZ, 15, DEFAULT_START_DATE, end_date)
+    now = TZ.localize(datetime.combine(DEFAULT_START_DATE, time(0, 0)))
+    args = (blocks, TZ, time(9), time(17), 30, DEFAULT_START_DATE, end_date, now)
+
+    windows = find_free_windows.__wrapped__(*args)
+    # The range is long past, so only a frozen "now" yields any windows at all
+    assert windows and windows[0][0] == DEFAULT_START_DATE
+    assert find_free_windows_numpy.__wrapped__(*args) == windows
+    assert GapIndex.from_blocks(blocks, TZ, time(9), time(17), DEFAULT_START_DATE, end_date, now).windows(30) == windows
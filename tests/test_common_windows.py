@@ -0,0 +1,38 @@
+from datetime import date, datetime, time
+
+import pytz
+
+from CalendarScheduler import BusyBlock, Participant, find_common_free_windows
+
+TZ = pytz.timezone('US/Eastern')
+DAY = date(2031, 3, 4)
+
+
+def _block(start, end):
+    return BusyBlock(int(TZ.localize(datetime.combine(DAY, start)).timestamp()),
+                     int(TZ.localize(datetime.combine(DAY, end)).timestamp()), TZ)
+
+
+def _windows(participants, min_minutes, now):
+    return [(start.strftime('%H:%M:%S'), end.strftime('%H:%M:%S'))
+            for _, windows in find_common_free_windows(participants, TZ, min_minutes, DAY, DAY, now=now)
+            for start, end in windows]
+
+
+def test_windows_start_on_five_minute_steps():
+    alice = Participant([_block(time(10, 2, 30), time(10, 31, 10)), _block(time(11, 0), time(17, 0))],
+                        TZ, time(9), time(17))
+    bob = Participant([], TZ, time(9), time(17))
+    now = TZ.localize(datetime.combine(DAY, time(9, 3, 20, 500000)))
+
+    assert _windows([alice, bob], 15, now) == [('09:05:00', '10:00:00'), ('10:35:00', '11:00:00')]
+
+
+def test_windows_too_short_after_rounding_are_dropped():
+    alice = Participant([_block(time(9, 0), time(10, 1)), _block(time(10, 30), time(17, 0))],
+                        TZ, time(9), time(17))
+    now = TZ.localize(datetime.combine(DAY, time(8)))
+
+    # 10:01-10:30 is 29 minutes, but only 10:05-10:30 can be offered
+    assert _windows([alice], 29, now) == []
+    assert _windows([alice], 25, now) == [('10:05:00', '10:30:00')]
@@ -0,0 +1,96 @@
+from datetime import date, datetime
+
+import pytest
+import pytz
+
+import CalendarScheduler
+from benchmark import FakeCalendarService
+from CalendarScheduler import forget_event_stores, get_busy_times_incremental, get_event_store
+
+START = date(2031, 3, 3)
+END = date(2031, 3, 9)
+
+
+def _event(event_id, day, hour, status='confirmed'):
+    start = datetime(2031, 3, day, hour, tzinfo=pytz.UTC)
+    return {'id': event_id, 'status': status,
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': start.replace(hour=hour + 1).isoformat()}}
+
+
+def _starts(blocks):
+    return [datetime.fromtimestamp(block.start_ts, pytz.UTC).strftime('%d %H') for block in blocks]
+
+
+def _busy(service, start_date=START, end_date=END):
+    return get_busy_times_incremental(service, 'alice', 'primary', pytz.UTC, 0,
+                                      start_date=start_date, end_date=end_date)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_stores(monkeypatch):
+    monkeypatch.setattr(CalendarScheduler, '_event_stores', CalendarScheduler.OrderedDict())
+
+
+@pytest.fixture
+def service():
+    return FakeCalendarService([_event('a', 3, 9), _event('b', 4, 10), _event('c', 5, 11)])
+
+
+def test_added_event_arrives_through_sync_token(service):
+    assert _starts(_busy(service)) == ['03 09', '04 10', '05 11']
+    calls = service.api_calls
+
+    service.add_event('primary', _event('d', 6, 14))
+    assert _starts(_busy(service)) == ['03 09', '04 10', '05 11', '06 14']
+    # One syncToken listing, no reseed
+    assert service.api_calls == calls + 1
+
+
+def test_cancelled_event_is_removed(service):
+    _busy(service)
+    service.add_event('primary', {'id': 'b', 'status': 'cancelled'})
+    assert _starts(_busy(service)) == ['03 09', '05 11']
+    assert 'b' not in get_event_store('alice', 'primary').events
+
+
+def test_expired_sync_token_reseeds(service):
+    _busy(service)
+    service.add_event('primary', _event('d', 6, 14))
+    service.expire_sync_tokens('primary')
+
+    assert _starts(_busy(service)) == ['03 09', '04 10', '05 11', '06 14']
+    store = get_event_store('alice', 'primary')
+    assert store.sync_token == service.sync_token('primary')
+
+    # The fresh token works for the next change
+    service.add_event('primary', {'id': 'a', 'status': 'cancelled'})
+    assert _starts(_busy(service)) == ['04 10', '05 11', '06 14']
+
+
+def test_reseed_covers_only_the_requested_range(service):
+    _busy(service, START, date(2031, 3, 4))
+    _busy(service, date(2031, 3, 5), END)
+    store = get_event_store('alice', 'primary')
+    assert store.time_min.date() == date(2031, 3, 5)
+    assert set(store.events) == {'c'}
+
+
+def test_user_key_is_required():
+    with pytest.raises(ValueError):
+        get_event_store(None, 'primary')
+
+
+def test_stores_are_bounded_and_forgotten(monkeypatch):
+    monkeypatch.setattr(CalendarScheduler, 'MAX_EVENT_STORES', 2)
+    first = get_event_store('alice', 'primary')
+    get_event_store('bob', 'primary')
+    get_event_store('carol', 'primary')
+    assert get_event_store('alice', 'primary') is not first
+
+    forget_event_stores('alice')
+    assert ('alice', 'primary') not in CalendarScheduler._event_stores
+
+    monkeypatch.setattr(CalendarScheduler, 'EVENT_STORE_IDLE_SECONDS', -1)
+    get_event_store('dave', 'primary')
+    assert list(CalendarScheduler._event_stores) == [('dave', 'primary')]
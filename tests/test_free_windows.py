@@ -0,0 +1,37 @@
+from datetime import date, datetime, time
+
+import pytz
+
+from CalendarScheduler import BusyBlock, find_free_windows, find_free_windows_numpy
+
+TZ = pytz.timezone('US/Eastern')
+DAY = date(2031, 3, 4)
+
+
+def _block(start, end):
+    return BusyBlock(int(TZ.localize(datetime.combine(DAY, start)).timestamp()),
+                     int(TZ.localize(datetime.combine(DAY, end)).timestamp()), TZ)
+
+
+def _now(moment):
+    return TZ.localize(datetime.combine(DAY, moment))
+
+
+def test_windows_are_whole_five_minute_instants():
+    blocks = (_block(time(10, 2, 30), time(10, 31, 10)), _block(time(11, 0), time(17, 0)))
+    windows = find_free_windows.__wrapped__(blocks, TZ, time(9), time(17), 15, DAY, DAY, _now(time(9, 3, 20, 500000)))
+    assert [(s.strftime('%H:%M:%S.%f'), e.strftime('%H:%M:%S.%f')) for s, e in windows[0][1]] == [
+        ('09:00:00.000000', '10:00:00.000000'), ('10:30:00.000000', '11:00:00.000000')]
+
+
+def test_cache_hit_matches_a_fresh_call_within_the_bucket():
+    blocks = (_block(time(10, 2, 30), time(10, 31, 10)), _block(time(11, 0), time(17, 0)))
+    for find in (find_free_windows, find_free_windows_numpy):
+        find.cache.invalidate()
+        args = (blocks, TZ, time(9), time(17), 15, DAY, DAY)
+        first = find(*args, now=_now(time(9, 0, 1)))
+        hits = find.cache.cache_info()['hits']
+        for moment in (time(9, 1, 7), time(9, 4, 58, 400000), time(9, 4, 59, 400000)):
+            assert find(*args, now=_now(moment)) == find.__wrapped__(*args, now=_now(moment))
+        assert find.cache.cache_info()['hits'] == hits + 2
+        assert find(*args, now=_now(time(9, 2))) == first
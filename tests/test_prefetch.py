@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+import CalendarScheduler
+from benchmark import FakeCalendarService, generate_calendar
+from prefetch import BusyPrefetcher
+from service_pool import fixed_service
+
+
+@pytest.fixture(autouse=True)
+def _fresh_stores(monkeypatch):
+    monkeypatch.setattr(CalendarScheduler, '_event_stores', CalendarScheduler.OrderedDict())
+
+
+@pytest.fixture
+def service():
+    today = datetime.now(pytz.UTC).date()
+    return FakeCalendarService(generate_calendar(20, 'UTC', days=30, start_date=today - timedelta(days=1), seed=1),
+                               latency=0.1)
+
+
+@pytest.fixture
+def prefetcher():
+    prefetcher = BusyPrefetcher(horizon_days=30)
+    yield prefetcher
+    prefetcher.close()
+
+
+def test_request_before_the_first_snapshot_waits_for_it(service, prefetcher):
+    key = prefetcher.register('alice', fixed_service(service), ['primary'])
+    assert prefetcher.get(key) is None
+
+    snapshot = prefetcher.get(key, wait=5)
+    assert snapshot is not None and len(snapshot.busy_blocks) > 0
+    # The waiting request reused the background fetch: one access check and one events listing
+    assert service.api_calls == 2
+
+
+def test_fetch_finishing_after_forget_is_discarded(service, prefetcher):
+    published = []
+    prefetcher.add_listener(lambda key, snapshot: published.append(key))
+    key = prefetcher.register('alice', fixed_service(service), ['primary'])
+    prefetcher.forget('alice')
+
+    assert prefetcher.get(key, wait=5) is None
+    assert prefetcher._snapshots == {}
+    assert published == []
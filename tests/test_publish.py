@@ -0,0 +1,30 @@
+import multiprocessing
+import os
+from datetime import time
+
+from publish import AvailabilityPublisher
+
+PUBLICATIONS = 20
+
+
+def _publish_many(directory, registry_path, user_id):
+    publisher = AvailabilityPublisher(directory=directory, registry_path=registry_path)
+    for _ in range(PUBLICATIONS):
+        publisher.publish(user_id, ['primary'], 'UTC', time(9), time(17), 30, 0)
+
+
+def test_publishers_in_separate_processes_keep_every_publication(tmp_path):
+    directory, registry_path = str(tmp_path / 'published'), str(tmp_path / 'publications.json')
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_publish_many, args=(directory, registry_path, f"user{i}"))
+                 for i in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    publisher = AvailabilityPublisher(directory=directory, registry_path=registry_path)
+    for i in range(3):
+        assert len(publisher.publications_for(f"user{i}")) == PUBLICATIONS
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
@@ -0,0 +1,77 @@
+from datetime import date, datetime, time, timedelta
+
+import pytest
+import pytz
+
+from CalendarScheduler import iter_slots, recommend_slots
+
+TZ = pytz.timezone('US/Eastern')
+MONDAY = date(2031, 3, 3)
+
+
+def _window(day, start, end):
+    return (TZ.localize(datetime.combine(day, start)), TZ.localize(datetime.combine(day, end)))
+
+
+def _day(offset, *windows):
+    day = MONDAY + timedelta(days=offset)
+    return day, tuple(_window(day, start, end) for start, end in windows)
+
+
+def _starts(slots):
+    return [(start.date().day, start.strftime('%H:%M')) for start, _ in slots]
+
+
+def test_earliest_slots_do_not_overlap():
+    free_windows = [_day(0, (time(9), time(11, 10))), _day(1, (time(9), time(10)))]
+    slots = list(recommend_slots(free_windows, 45, k=4))
+    assert _starts(slots) == [(3, '09:00'), (3, '09:45'), (4, '09:00')]
+
+
+def test_avoid_lunch_prefers_lunch_free_slots_without_overlap():
+    free_windows = [_day(0, (time(11), time(14)))]
+    slots = list(recommend_slots(free_windows, 60, k=3, prefer='avoid_lunch'))
+    assert _starts(slots) == [(3, '11:00'), (3, '13:00'), (3, '12:00')]
+
+
+def test_spread_skips_a_day_without_a_slot():
+    free_windows = [_day(0, (time(9), time(17))),
+                    _day(1, (time(9), time(17))),
+                    _day(2, (time(9), time(9, 20))),
+                    _day(3, (time(9), time(17))),
+                    _day(4, (time(9), time(17)))]
+    slots = list(recommend_slots(free_windows, 30, k=3, prefer='spread'))
+    assert [start.date().day for start, _ in slots] == [3, 6, 7]
+
+
+def test_spread_fills_up_from_fewer_days_than_k():
+    free_windows = [_day(0, (time(9), time(10, 30))), _day(1, (time(14), time(15)))]
+    slots = list(recommend_slots(free_windows, 30, k=4, prefer='spread'))
+    assert _starts(slots) == [(3, '09:00'), (3, '09:30'), (3, '10:00'), (4, '14:00')]
+
+
+def _lunch_overlap_reference(free_windows, duration, k):
+    # Every slot touching lunch, fully sorted by overlap then time: what the bounded heap must agree with
+    def overlap(start, end):
+        lunch = (start.replace(hour=12, minute=0), start.replace(hour=13, minute=0))
+        return max(timedelta(0), min(end, lunch[1]) - max(start, lunch[0]))
+
+    slots = [slot for _, windows in free_windows for slot in iter_slots(windows, duration)]
+    chosen = []
+    for start, end in sorted(slots, key=lambda slot: (overlap(*slot), slot[0])):
+        if len(chosen) < k and not any(start < e and s < end for s, e in chosen):
+            chosen.append((start, end))
+    return sorted(chosen)
+
+
+def test_avoid_lunch_keeps_only_enough_candidates_to_pick_from():
+    # Every slot touches lunch, across many days
+    free_windows = [_day(offset, (time(11, 30), time(13, 45))) for offset in range(20)]
+    for duration, k in [(60, 5), (45, 3), (20, 7)]:
+        slots = list(recommend_slots(free_windows, duration, k=k, prefer='avoid_lunch'))
+        assert sorted(slots) == _lunch_overlap_reference(free_windows, duration, k)
+
+
+def test_unknown_preference_raises_on_the_call():
+    with pytest.raises(ValueError):
+        recommend_slots([_day(0, (time(9), time(17)))], 30, prefer='latest')
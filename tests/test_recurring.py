@@ -0,0 +1,77 @@
+from datetime import date, datetime, time
+
+import pytest
+import pytz
+
+import CalendarScheduler
+from benchmark import FakeCalendarService, generate_calendar, generate_recurring_series
+from CalendarScheduler import (_instance_key, get_busy_times, get_busy_times_incremental, get_query_range,
+                               iter_recurrence, stream_busy_blocks)
+from service_pool import fixed_service
+
+TZ = pytz.timezone('US/Eastern')
+START = date(2031, 3, 3)
+END = date(2031, 3, 30)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_stores(monkeypatch):
+    monkeypatch.setattr(CalendarScheduler, '_event_stores', CalendarScheduler.OrderedDict())
+
+
+@pytest.fixture
+def service():
+    # Spans the March DST change, with a cancelled and a moved occurrence in every series
+    events = (generate_calendar(60, 'US/Eastern', days=28, start_date=START, seed=4)
+              + generate_recurring_series(6, 'US/Eastern', days=28, start_date=START, seed=4))
+    return FakeCalendarService(events)
+
+
+def _exceptions_in_range(service, status):
+    start = TZ.localize(datetime.combine(START, time()))
+    return [event for _, _, event in service.events_by_calendar['primary']
+            if event.get('recurringEventId') and event['status'] == status
+            and datetime.fromisoformat(event['originalStartTime']['dateTime']) >= start]
+
+
+def _busy(service, user_key, expand, monkeypatch):
+    monkeypatch.setattr(CalendarScheduler, 'EXPAND_RECURRING', expand)
+    return get_busy_times_incremental(service, user_key, 'primary', TZ, 0, START, END)
+
+
+def test_expanded_fetch_matches_single_events(service):
+    assert _exceptions_in_range(service, 'cancelled') and _exceptions_in_range(service, 'confirmed')
+    expanded = get_busy_times(service, 'primary', TZ, 10, START, END, expand_recurring=True)
+    assert expanded == get_busy_times(service, 'primary', TZ, 10, START, END)
+
+
+def test_expanding_event_store_matches_single_events_through_changes(service, monkeypatch):
+    single = _busy(service, 'single', False, monkeypatch)
+    assert _busy(service, 'expanded', True, monkeypatch) == single
+
+    # Cancel one more occurrence and add a meeting, then sync both stores incrementally
+    _, start_utc, end_utc = get_query_range(TZ, START, END)
+    master = service.masters_by_calendar['primary'][0]
+    occurrence = next(iter_recurrence(master, start_utc, end_utc))
+    key = _instance_key(occurrence['start'])
+    service.add_event('primary', {'id': f"{master['id']}_{key}", 'status': 'cancelled',
+                                  'recurringEventId': master['id'], 'originalStartTime': occurrence['start']})
+    service.add_event('primary', {'id': 'new', 'status': 'confirmed',
+                                  'start': {'dateTime': '2031-03-12T20:00:00+00:00'},
+                                  'end': {'dateTime': '2031-03-12T21:00:00+00:00'}})
+
+    single_after = _busy(service, 'single', False, monkeypatch)
+    assert _busy(service, 'expanded', True, monkeypatch) == single_after
+    starts = [block.start_ts for block in single_after]
+    assert key not in starts
+    assert datetime(2031, 3, 12, 20, tzinfo=pytz.UTC).timestamp() in starts
+    assert len(single_after) == len(single)
+    # The expanding store holds masters and exceptions, not every instance
+    stores = CalendarScheduler._event_stores
+    assert len(stores[('expanded', 'primary')].events) < len(stores[('single', 'primary')].events)
+
+
+def test_expanding_stream_matches_single_events(service, monkeypatch):
+    monkeypatch.setattr(CalendarScheduler, 'EXPAND_RECURRING', True)
+    streamed = list(stream_busy_blocks(fixed_service(service), 'alice', ['primary'], TZ, 0, START, END))
+    assert streamed == list(get_busy_times(service, 'primary', TZ, 0, START, END))
@@ -0,0 +1,68 @@
+from datetime import date
+
+import pytz
+
+import service_pool as service_pool_module
+from benchmark import FakeCalendarService, generate_calendar
+from CalendarScheduler import get_busy_times_multi
+from service_pool import ServicePool
+
+START = date(2031, 3, 3)
+END = date(2031, 3, 17)
+
+
+def _counting_builds(monkeypatch):
+    built = []
+
+    def build_service(creds):
+        service = FakeCalendarService(generate_calendar(50, 'UTC', days=14, start_date=START, seed=1))
+        service.add_calendar('team', generate_calendar(50, 'UTC', days=14, start_date=START, seed=2))
+        built.append(service)
+        return service
+
+    monkeypatch.setattr(service_pool_module, 'build_service', build_service)
+    return built
+
+
+def test_repeated_multi_calendar_fetches_reuse_services(monkeypatch):
+    built = _counting_builds(monkeypatch)
+    pool = ServicePool()
+    creds = object()
+
+    results = [get_busy_times_multi(pool.factory('alice', creds), 'alice', ['primary', 'team'], pytz.UTC, 0,
+                                    start_date=START, end_date=END, max_workers=2)
+               for _ in range(3)]
+
+    # Every call runs on fresh worker threads, yet only the first call's concurrent checkouts build
+    assert len(built) <= 2
+    assert results[0] == results[1] == results[2]
+
+
+def test_checkout_is_exclusive_and_returned():
+    pool = ServicePool()
+    creds = object()
+    first, second = object(), object()
+    pool.put('alice', creds, first)
+    pool.put('alice', creds, second)
+
+    with pool.checkout('alice', creds) as a, pool.checkout('alice', creds) as b:
+        assert {a, b} == {first, second}
+    with pool.checkout('alice', creds) as again:
+        assert again in (first, second)
+
+
+def test_new_credentials_and_invalidate_rebuild(monkeypatch):
+    built = _counting_builds(monkeypatch)
+    pool = ServicePool()
+    creds = object()
+    with pool.checkout('alice', creds):
+        pass
+    with pool.checkout('alice', object()):
+        pass
+    assert len(built) == 2
+
+    with pool.checkout('alice', creds) as service:
+        pool.invalidate('alice')
+    with pool.checkout('alice', creds) as rebuilt:
+        assert rebuilt is not service
+    assert len(built) == 4
@@ -0,0 +1,114 @@
+import os
+import time as time_module
+from datetime import date, datetime, time
+
+import pytest
+import pytz
+
+import CalendarScheduler
+from benchmark import FakeCalendarService, generate_calendar
+from busy_cache import BusyCache
+from CalendarScheduler import (get_busy_times, get_busy_times_multi, get_owner_calendar_ids, iter_free_windows,
+                               stream_busy_blocks)
+from service_pool import fixed_service
+
+START = date(2031, 3, 3)
+END = date(2031, 3, 16)
+LATENCY = 0.05
+NOW = datetime(2031, 3, 3, tzinfo=pytz.UTC)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_stores(monkeypatch):
+    monkeypatch.setattr(CalendarScheduler, '_event_stores', CalendarScheduler.OrderedDict())
+    monkeypatch.setattr(CalendarScheduler, '_owner_calendars', {})
+
+
+def _service():
+    # Calendars needing 1, 2 and 3 pages, each page (and the access check) costing LATENCY
+    service = FakeCalendarService(generate_calendar(5, 'UTC', days=14, start_date=START, seed=1),
+                                  latency=LATENCY, page_size=10)
+    service.add_calendar('team', generate_calendar(15, 'UTC', days=14, start_date=START, seed=2))
+    service.add_calendar('room', generate_calendar(25, 'UTC', days=14, start_date=START, seed=3))
+    return service
+
+
+def test_cold_stream_takes_about_as_long_as_the_slowest_calendar():
+    service = _service()
+    calendar_ids = ['primary', 'team', 'room']
+
+    started = time_module.perf_counter()
+    streamed = list(stream_busy_blocks(fixed_service(service), 'alice', calendar_ids, pytz.UTC, 15,
+                                       start_date=START, end_date=END))
+    elapsed = time_module.perf_counter() - started
+
+    # Read one after another this is 2 + 3 + 4 = 9 round trips; the slowest calendar alone is 4
+    assert elapsed < 6 * LATENCY
+    expected = sorted(block for calendar_id in calendar_ids
+                      for block in get_busy_times(service, calendar_id, pytz.UTC, 15, START, END))
+    assert sorted(streamed) == expected
+    assert [block.start_ts for block in streamed] == sorted(block.start_ts for block in streamed)
+
+
+def _wait_for_cache(cache, calendar_ids, timeout=2.0):
+    deadline = time_module.monotonic() + timeout
+    while time_module.monotonic() < deadline:
+        cached = {calendar_id: cache.get('alice', calendar_id, pytz.UTC, 0, START, END) for calendar_id in calendar_ids}
+        if all(blocks is not None for blocks in cached.values()):
+            return cached
+        time_module.sleep(0.02)
+    return cached
+
+
+def test_stream_ending_on_a_weekend_still_fills_the_cache():
+    service = _service()
+    cache = BusyCache(os.path.join('user_data', 'busy_cache.sqlite3'))
+    calendar_ids = ['primary', 'team', 'room']
+    assert END.weekday() == 6
+
+    stream = stream_busy_blocks(fixed_service(service), 'alice', calendar_ids, pytz.UTC, 0,
+                                start_date=START, end_date=END, cache=cache)
+    list(iter_free_windows(stream, pytz.UTC, time(9), time(17), 30, START, END, now=NOW))
+
+    cached = _wait_for_cache(cache, calendar_ids)
+    for calendar_id in calendar_ids:
+        assert cached[calendar_id] == tuple(get_busy_times(service, calendar_id, pytz.UTC, 0, START, END))
+
+
+def test_closing_early_never_blocks_producers():
+    service = _service()
+    cache = BusyCache(os.path.join('user_data', 'busy_cache.sqlite3'))
+    stream = stream_busy_blocks(fixed_service(service), 'alice', ['primary', 'team', 'room'], pytz.UTC, 0,
+                                start_date=START, end_date=END, cache=cache, queue_size=1)
+    next(stream)
+    stream.close()
+    # Producers stop handing over blocks but still read their calendars to the end and cache them
+    assert all(blocks is not None for blocks in _wait_for_cache(cache, ['primary', 'team', 'room']).values())
+
+
+def test_freebusy_first_stream_lists_only_owner_calendars():
+    service = _service()
+    calendar_ids = ['primary', 'team', 'room']
+    expected = get_busy_times_multi(fixed_service(service), 'alice', calendar_ids, pytz.UTC, 15, START, END,
+                                    strategy='freebusy_first')
+    calls = service.api_calls
+
+    streamed = list(stream_busy_blocks(fixed_service(service), 'alice', calendar_ids, pytz.UTC, 15,
+                                       start_date=START, end_date=END, strategy='freebusy_first'))
+    # One events listing for the owner's calendar and one free/busy query for the others
+    assert service.api_calls - calls == 2 + 1
+    assert sorted(streamed) == sorted(expected)
+
+
+def test_owner_calendars_come_from_calendar_list():
+    # calendarList names the primary calendar by the user's email, not 'primary'
+    service = FakeCalendarService(generate_calendar(5, 'UTC', days=14, start_date=START, seed=1),
+                                  calendar_id='alice@example.com')
+    service.add_calendar('team', generate_calendar(15, 'UTC', days=14, start_date=START, seed=2))
+
+    assert get_owner_calendar_ids(fixed_service(service), 'alice', strategy='events') == ('primary',)
+    assert service.api_calls == 0
+    owner_ids = get_owner_calendar_ids(fixed_service(service), 'alice', strategy='freebusy_first')
+    assert owner_ids == ('primary', 'alice@example.com')
+    assert get_owner_calendar_ids(fixed_service(service), 'alice', strategy='freebusy_first') == owner_ids
+    assert service.api_calls == 1
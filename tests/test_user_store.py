@@ -0,0 +1,52 @@
+import json
+import os
+
+import pytest
+
+import user_store
+from user_store import UserStore
+
+
+@pytest.fixture(autouse=True)
+def _fresh_singleton(monkeypatch):
+    monkeypatch.setattr(user_store, '_user_store', None)
+
+
+def test_import_and_helpers_create_nothing_until_used():
+    assert not os.path.exists(user_store.USER_DATA_DIR)
+    user_store.migrate_legacy_files()
+    assert not os.path.exists(user_store.USER_DATA_DIR)
+
+    assert user_store.load_user_preferences('nobody') is None
+    assert os.path.exists(user_store.DEFAULT_STORE_PATH)
+
+
+def test_sees_writes_from_another_process(tmp_path):
+    path = str(tmp_path / 'users.sqlite3')
+    writer, reader = UserStore(path), UserStore(path)
+
+    writer.save_preferences('alice', {'min_minutes': 30})
+    assert reader.preferences('alice') == {'min_minutes': 30}
+    assert reader.preferences('alice') == {'min_minutes': 30}
+
+    writer.save_preferences('alice', {'min_minutes': 45})
+    assert reader.preferences('alice') == {'min_minutes': 45}
+
+
+def test_own_writes_replace_the_cached_row(tmp_path):
+    store = UserStore(str(tmp_path / 'users.sqlite3'))
+    assert store.preferences('alice') is None
+    store.save_preferences('alice', {'min_minutes': 30})
+    assert store.preferences('alice') == {'min_minutes': 30}
+
+
+def test_legacy_files_are_migrated_on_request(tmp_path):
+    legacy = tmp_path / 'legacy'
+    legacy.mkdir()
+    (legacy / 'alice_preferences.json').write_text(json.dumps({'min_minutes': 15}))
+
+    store = UserStore(str(tmp_path / 'users.sqlite3'))
+    assert store.preferences('alice') is None
+    store.migrate_legacy_files(str(legacy))
+    assert store.preferences('alice') == {'min_minutes': 15}
+    assert not (legacy / 'alice_preferences.json').exists()
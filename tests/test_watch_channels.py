@@ -0,0 +1,131 @@
+import threading
+import time as time_module
+from datetime import date, datetime
+
+import pytest
+import pytz
+
+import CalendarScheduler
+from benchmark import FakeCalendarService
+from CalendarScheduler import get_busy_times_incremental
+from service_pool import fixed_service
+from watch_channels import ChannelManager, send_notification, start_notification_server
+
+START = date(2031, 3, 3)
+END = date(2031, 3, 9)
+
+
+def _event(event_id, day, hour):
+    start = datetime(2031, 3, day, hour, tzinfo=pytz.UTC)
+    return {'id': event_id, 'status': 'confirmed', 'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': start.replace(hour=hour + 1).isoformat()}}
+
+
+@pytest.fixture(autouse=True)
+def _fresh_stores(monkeypatch):
+    monkeypatch.setattr(CalendarScheduler, '_event_stores', CalendarScheduler.OrderedDict())
+
+
+@pytest.fixture
+def service():
+    return FakeCalendarService([_event('a', 3, 9), _event('b', 4, 10)])
+
+
+@pytest.fixture
+def channels():
+    manager = ChannelManager('http://placeholder/')
+    server = start_notification_server(manager, port=0)
+    manager.callback_url = f"http://127.0.0.1:{server.server_port}/"
+    yield manager
+    manager.close()
+    server.shutdown()
+    server.server_close()
+
+
+def _busy(service):
+    return get_busy_times_incremental(service, 'alice', 'primary', pytz.UTC, 0, START, END)
+
+
+def test_notification_runs_one_incremental_sync(service, channels):
+    synced = []
+    channels.add_listener(lambda user_key, calendar_id: synced.append(_busy(service)))
+    _busy(service)
+    channels.watch(fixed_service(service), 'alice', 'primary')
+    assert channels.is_watched('alice', ['primary'])
+
+    service.add_event('primary', _event('c', 5, 11))
+    calls = service.api_calls
+    assert service.notify('primary') == [200]
+
+    assert len(synced) == 1
+    assert service.api_calls == calls + 1
+    assert len(synced[0]) == 3
+
+
+def test_bad_token_and_unknown_channel_are_rejected(service, channels):
+    synced = []
+    channels.add_listener(lambda user_key, calendar_id: synced.append(calendar_id))
+    channel = channels.watch(fixed_service(service), 'alice', 'primary')
+
+    assert send_notification(channels.callback_url, channel.id, 'not-the-token', channel.resource_id) == 403
+    assert send_notification(channels.callback_url, 'no-such-channel', channel.token, channel.resource_id) == 404
+    assert synced == []
+
+
+def test_sync_message_sent_during_watch_is_accepted(service, channels):
+    service.send_sync = True
+    channel = channels.watch(fixed_service(service), 'alice', 'primary')
+    assert service.watch_channels[channel.id]['syncStatus'] == 200
+
+
+def test_channels_are_renewed_before_they_expire(service, channels):
+    channels.ttl_seconds = 1800
+    channels.renew_margin = 3600
+    old = channels.watch(fixed_service(service), 'alice', 'primary')
+
+    assert channels.renew_due() == 1
+    assert old.id not in service.watch_channels
+    assert len(service.watch_channels) == 1
+    assert channels.is_watched('alice', ['primary'])
+    # The replacement has the same short lifetime, but one with plenty left is left alone
+    channels.ttl_seconds = 7200
+    assert channels.renew_due() == 1
+    assert channels.renew_due() == 0
+
+
+def test_failed_watch_backs_off_before_retrying(service, channels):
+    channels.retry_seconds = 0.5
+    for _ in range(5):
+        channels.ensure(fixed_service(service), 'alice', ['primary', 'not-watchable'])
+    # One watch() per calendar: the failing one waits out its backoff instead of retrying every rerun
+    assert service.api_calls == 2
+    assert not channels.is_watched('alice', ['not-watchable'])
+
+    time_module.sleep(0.6)
+    channels.ensure(fixed_service(service), 'alice', ['primary', 'not-watchable'])
+    assert service.api_calls == 3
+
+
+def test_concurrent_ensure_opens_one_channel(service, channels):
+    service.latency = 0.1
+    threads = [threading.Thread(target=channels.ensure, args=(fixed_service(service), 'alice', ['primary']))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(service.watch_channels) == 1
+    assert channels.is_watched('alice', ['primary'])
+
+
+def test_failed_renewal_stops_counting_as_watched(service, channels):
+    channels.ttl_seconds = 1800
+    channels.renew_margin = 3600
+    channels.watch(fixed_service(service), 'alice', 'primary')
+    # The calendar is gone, so watch() fails when the channel is renewed
+    del service.events_by_calendar['primary']
+
+    assert channels.renew_due() == 0
+    assert not channels.is_watched('alice', ['primary'])
+    assert channels.renew_due() == 0
+    assert service.watch_channels == {}
@@ -0,0 +1,257 @@
+import contextlib
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time as time_module
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+# User data directory, created by whichever store or cache first writes to it
+USER_DATA_DIR = 'user_data'
+
+DEFAULT_STORE_PATH = os.path.join(USER_DATA_DIR, 'users.sqlite3')
+
+def get_user_id(email):
+    """Generate a unique user ID from email."""
+    return hashlib.md5(email.encode()).hexdigest()
+
+
+class UserStore:
+    """Every user's credentials and preferences in one SQLite database.
+
+    The database runs in WAL mode so readers never wait on a writer, and
+    each thread keeps its own connection. Rows are cached in memory after
+    the first read (or a bulk ``preload``); the cache is dropped whenever
+    ``PRAGMA data_version`` shows another connection (another thread or
+    process) has committed, and every write is a single transaction that
+    updates the cache only after it commits. Token refreshes take a per-user
+    lock and re-read the row first, so sessions racing to refresh the same
+    user make one call to Google.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._refresh_locks = {}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id TEXT PRIMARY KEY,
+                    credentials TEXT,
+                    preferences TEXT,
+                    updated_at REAL
+                )
+            """)
+        # Only used under self._lock, to notice commits made through any other connection
+        self._watch = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._data_version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # --- Reads ---
+    def _check_data_version(self):
+        # Caller holds self._lock
+        version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._cache.clear()
+
+    def _row(self, user_id, refresh=False):
+        """(credentials, preferences) for a user, from memory unless ``refresh``."""
+        # Read and cache under the lock, so a row read before a write can't be cached after it
+        with self._lock:
+            self._check_data_version()
+            if not refresh and user_id in self._cache:
+                metrics.count('user_store_hits')
+                return self._cache[user_id]
+            metrics.count('user_store_misses')
+            row = self._connection().execute(
+                "SELECT credentials, preferences FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            entry = self._parse(*row) if row else (None, None)
+            self._cache[user_id] = entry
+            return entry
+
+    @staticmethod
+    def _parse(credentials, preferences):
+        # Parsed once per write, so callers get the same Credentials object until it changes
+        return (Credentials.from_authorized_user_info(json.loads(credentials)) if credentials else None,
+                json.loads(preferences) if preferences else None)
+
+    def preload(self, user_ids, chunk_size=500):
+        """Read many users in a few queries, e.g. before a batch run."""
+        user_ids = list(dict.fromkeys(user_ids))
+        conn = self._connection()
+        for i in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[i:i + chunk_size]
+            with self._lock:
+                self._check_data_version()
+                rows = conn.execute(
+                    f"SELECT user_id, credentials, preferences FROM users WHERE user_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                found = {user_id: self._parse(credentials, preferences) for user_id, credentials, preferences in rows}
+                for user_id in chunk:
+                    self._cache[user_id] = found.get(user_id, (None, None))
+
+    def credentials(self, user_id):
+        return self._row(user_id)[0]
+
+    def preferences(self, user_id):
+        return self._row(user_id)[1]
+
+    # --- Writes ---
+    def _write(self, user_id, column, value):
+        with self._transaction() as conn:
+            conn.execute(f"""
+                INSERT INTO users (user_id, {column}, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET {column} = excluded.{column}, updated_at = excluded.updated_at
+            """, (user_id, value, time_module.time()))
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def save_credentials(self, user_id, creds):
+        self._write(user_id, 'credentials', creds.to_json())
+
+    def delete_credentials(self, user_id):
+        self._write(user_id, 'credentials', None)
+
+    def save_preferences(self, user_id, preferences):
+        self._write(user_id, 'preferences', json.dumps(preferences))
+
+    # --- Token refresh ---
+    def _refresh_lock(self, user_id):
+        with self._lock:
+            return self._refresh_locks.setdefault(user_id, threading.Lock())
+
+    def valid_credentials(self, user_id):
+        """Usable credentials for a user, refreshing an expired token at most once at a time."""
+        creds = self.credentials(user_id)
+        if creds is None or creds.valid:
+            return creds
+        if not (creds.expired and creds.refresh_token):
+            return None
+
+        with self._refresh_lock(user_id):
+            # Another session (or process) may have refreshed while we waited
+            creds = self._row(user_id, refresh=True)[0]
+            if creds is None or creds.valid:
+                return creds
+            metrics.count('token_refreshes')
+            creds.refresh(Request())
+            self.save_credentials(user_id, creds)
+            return creds
+
+    # --- One-off import of the old per-user files ---
+    def migrate_legacy_files(self, directory):
+        """Move <user_id>_token.pickle and <user_id>_preferences.json files into the database."""
+        token_paths = glob.glob(os.path.join(directory, '*_token.pickle'))
+        preference_paths = glob.glob(os.path.join(directory, '*_preferences.json'))
+        if not token_paths and not preference_paths:
+            return
+        for path in token_paths:
+            user_id = os.path.basename(path)[:-len('_token.pickle')]
+            try:
+                with open(path, 'rb') as token:
+                    self.save_credentials(user_id, pickle.load(token))
+                os.remove(path)
+            except Exception as e:
+                logger.warning("Could not migrate credentials from %s: %s", path, e)
+        for path in preference_paths:
+            user_id = os.path.basename(path)[:-len('_preferences.json')]
+            try:
+                with open(path, 'r') as f:
+                    self.save_preferences(user_id, json.load(f))
+                os.remove(path)
+            except Exception as e:
+                logger.warning("Could not migrate preferences from %s: %s", path, e)
+        logger.info("Migrated %d token and %d preference files into %s",
+                    len(token_paths), len(preference_paths), self.path)
+
+
+# Process-wide store shared by the web app, the API server and batch jobs, opened on first use
+_user_store = None
+_user_store_lock = threading.Lock()
+
+def get_user_store():
+    global _user_store
+    with _user_store_lock:
+        if _user_store is None:
+            _user_store = UserStore()
+        return _user_store
+
+def _forget_user_store():
+    # SQLite connections must not cross a fork; worker processes open their own store
+    global _user_store, _user_store_lock
+    _user_store = None
+    _user_store_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_forget_user_store)
+
+def migrate_legacy_files(directory=USER_DATA_DIR):
+    """Import old per-user token and preference files; called once by each entry point."""
+    if os.path.isdir(directory):
+        get_user_store().migrate_legacy_files(directory)
+
+def get_credentials(user_id):
+    """Gets valid user credentials from storage, or None if the user must sign in again."""
+    return get_user_store().valid_credentials(user_id)
+
+def save_credentials(user_id, creds):
+    """Save user credentials."""
+    get_user_store().save_credentials(user_id, creds)
+
+def delete_credentials(user_id):
+    """Delete user credentials."""
+    get_user_store().delete_credentials(user_id)
+
+def load_user_preferences(user_id):
+    """Load user preferences, or None if the user has none saved."""
+    return get_user_store().preferences(user_id)
+
+def save_user_preferences(user_id, preferences):
+    """Save user preferences."""
+    get_user_store().save_preferences(user_id, preferences)
+
+def get_default_preferences():
+    """Get default user preferences."""
+    return {
+        'timezone': 'US/Eastern',
+        'work_start': '09:00',
+        'work_end': '17:00',
+        'min_minutes': 30,
+        'buffer_minutes': 15
+    }
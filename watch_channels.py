@@ -0,0 +1,290 @@
+import logging
+import secrets
+import threading
+import time as time_module
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+# Google caps events().watch channels at about a week; ask for that and renew ahead of it
+CHANNEL_TTL_SECONDS = 7 * 24 * 3600
+# After a failed watch() wait this long before trying that calendar again, doubling up to the cap
+WATCH_RETRY_SECONDS = 300
+WATCH_RETRY_MAX_SECONDS = 6 * 3600
+
+
+class Channel:
+    """One events().watch notification channel on a user's calendar."""
+
+    __slots__ = ('id', 'resource_id', 'token', 'expiration', 'user_key', 'calendar_id', 'service_factory')
+
+    def __init__(self, id, resource_id, token, expiration, user_key, calendar_id, service_factory):
+        self.id = id
+        self.resource_id = resource_id
+        self.token = token
+        self.expiration = expiration
+        self.user_key = user_key
+        self.calendar_id = calendar_id
+        self.service_factory = service_factory
+
+    def expires_in(self):
+        return self.expiration - time_module.time()
+
+
+class ChannelManager:
+    """Keeps a watch channel open on every calendar a user is looking at.
+
+    Google POSTs a notification to ``callback_url`` whenever a watched
+    calendar changes. ``handle_notification`` checks the channel's secret
+    token, drops the calendar's entries from ``busy_cache`` and calls every
+    listener with ``(user_key, calendar_id)`` so it can run an incremental
+    refresh. A daemon thread replaces channels ``renew_margin`` seconds
+    before they expire. A calendar whose watch() fails is retried by
+    ``ensure`` only after ``retry_seconds``, doubling on every further
+    failure up to WATCH_RETRY_MAX_SECONDS.
+    """
+
+    def __init__(self, callback_url, busy_cache=None, ttl_seconds=CHANNEL_TTL_SECONDS, renew_margin=3600,
+                 retry_seconds=WATCH_RETRY_SECONDS):
+        self.callback_url = callback_url
+        self.busy_cache = busy_cache
+        self.ttl_seconds = ttl_seconds
+        self.renew_margin = renew_margin
+        self.retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._by_calendar = {}
+        # (user_key, calendar_id) -> (monotonic time to retry at, failures in a row)
+        self._failures = {}
+        # (user_key, calendar_id) pairs ensure() is opening a channel for right now
+        self._opening = set()
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def is_watched(self, user_key, calendar_ids):
+        """Whether every calendar has a live channel, so changes will be pushed."""
+        with self._lock:
+            return all(self._is_live((user_key, calendar_id)) for calendar_id in calendar_ids)
+
+    def _is_live(self, key):
+        # Called with the lock held
+        channel = self._by_calendar.get(key)
+        return channel is not None and channel.expires_in() > 0
+
+    # --- Opening and closing channels ---
+    def watch(self, service_factory, user_key, calendar_id):
+        """Open a channel on one calendar; returns the Channel."""
+        channel = Channel(uuid.uuid4().hex, None, secrets.token_urlsafe(24), time_module.time() + self.ttl_seconds,
+                          user_key, calendar_id, service_factory)
+        body = {
+            'id': channel.id,
+            'type': 'web_hook',
+            'address': self.callback_url,
+            'token': channel.token,
+            'params': {'ttl': str(self.ttl_seconds)},
+        }
+        # Known before the call: Google may deliver the channel's 'sync' message before watch() returns
+        with self._lock:
+            self._channels[channel.id] = channel
+        try:
+            metrics.count('api_calls')
+            with service_factory() as service:
+                response = service.events().watch(calendarId=calendar_id, body=body).execute()
+        except Exception:
+            with self._lock:
+                self._channels.pop(channel.id, None)
+            raise
+        channel.resource_id = response['resourceId']
+        channel.expiration = int(response.get('expiration', 0)) / 1000 or channel.expiration
+        with self._lock:
+            self._by_calendar[(user_key, calendar_id)] = channel
+            self._failures.pop((user_key, calendar_id), None)
+        metrics.count('watch_channels_opened')
+        logger.info("Watching %s for %s until %s", calendar_id, user_key, time_module.ctime(channel.expiration))
+        self._ensure_thread()
+        return channel
+
+    def ensure(self, service_factory, user_key, calendar_ids):
+        """Watch any of ``calendar_ids`` that has no live channel yet; failures are logged, not raised."""
+        for calendar_id in dict.fromkeys(calendar_ids):
+            key = (user_key, calendar_id)
+            with self._lock:
+                # Concurrent reruns share one open instead of each starting their own
+                if self._is_live(key) or key in self._opening:
+                    continue
+                failure = self._failures.get(key)
+                if failure is not None and time_module.monotonic() < failure[0]:
+                    continue
+                self._opening.add(key)
+            try:
+                self.watch(service_factory, user_key, calendar_id)
+            except Exception as e:
+                # Calendars we can't watch (e.g. free/busy only) keep relying on polling
+                delay = self._record_failure(key)
+                logger.warning("Could not watch %s, retrying in %ds: %s", calendar_id, delay, e)
+            finally:
+                with self._lock:
+                    self._opening.discard(key)
+
+    def _record_failure(self, key):
+        """Back off before ``ensure`` tries this calendar again; returns the delay."""
+        with self._lock:
+            failures = self._failures.get(key, (0, 0))[1] + 1
+            delay = min(self.retry_seconds * 2 ** (failures - 1), WATCH_RETRY_MAX_SECONDS)
+            self._failures[key] = (time_module.monotonic() + delay, failures)
+        metrics.count('watch_failures')
+        return delay
+
+    def _drop(self, channel):
+        # Forget the channel locally so is_watched() turns False and ensure() may open a new one
+        with self._lock:
+            self._channels.pop(channel.id, None)
+            if self._by_calendar.get((channel.user_key, channel.calendar_id)) is channel:
+                del self._by_calendar[(channel.user_key, channel.calendar_id)]
+
+    def stop(self, channel):
+        self._drop(channel)
+        try:
+            metrics.count('api_calls')
+            with channel.service_factory() as service:
+                service.channels().stop(body={'id': channel.id, 'resourceId': channel.resource_id}).execute()
+        except Exception as e:
+            # The channel expires on its own; a late notification is rejected as unknown
+            logger.warning("Could not stop channel %s: %s", channel.id, e)
+
+    def forget(self, user_key):
+        """Stop every channel for a user (e.g. on logout)."""
+        with self._lock:
+            channels = [c for c in self._channels.values() if c.user_key == user_key]
+            for key in [key for key in self._failures if key[0] == user_key]:
+                del self._failures[key]
+        for channel in channels:
+            self.stop(channel)
+
+    # --- Incoming notifications ---
+    def handle_notification(self, headers):
+        """Apply one notification's headers; returns the HTTP status to answer with."""
+        channel_id = headers.get('X-Goog-Channel-ID')
+        state = headers.get('X-Goog-Resource-State')
+        with self._lock:
+            channel = self._channels.get(channel_id)
+        if channel is None:
+            metrics.count('watch_notifications_unknown')
+            return 404
+        if not secrets.compare_digest(headers.get('X-Goog-Channel-Token') or '', channel.token):
+            metrics.count('watch_notifications_rejected')
+            return 403
+        if state == 'sync':
+            # Sent once when the channel opens; nothing has changed yet
+            return 200
+
+        metrics.count('watch_notifications')
+        logger.info("Calendar %s changed for %s (%s #%s)", channel.calendar_id, channel.user_key, state,
+                    headers.get('X-Goog-Message-Number'))
+        if self.busy_cache is not None:
+            self.busy_cache.invalidate(channel.user_key, channel.calendar_id)
+        for listener in list(self._listeners):
+            try:
+                listener(channel.user_key, channel.calendar_id)
+            except Exception:
+                logger.exception("Change listener failed for %s", channel.calendar_id)
+        return 200
+
+    # --- Renewal ---
+    def renew_due(self):
+        """Replace every channel expiring within ``renew_margin``; returns how many were renewed."""
+        with self._lock:
+            due = [c for c in self._channels.values() if c.expires_in() < self.renew_margin]
+        renewed = 0
+        for channel in due:
+            try:
+                # Open the replacement first so no change falls between the two channels
+                self.watch(channel.service_factory, channel.user_key, channel.calendar_id)
+            except Exception as e:
+                # Fall back to polling; ensure() retries once the backoff has passed
+                delay = self._record_failure((channel.user_key, channel.calendar_id))
+                logger.warning("Could not renew channel on %s, retrying in %ds: %s", channel.calendar_id, delay, e)
+                if channel.expires_in() > 0:
+                    self.stop(channel)
+                else:
+                    self._drop(channel)
+                continue
+            self.stop(channel)
+            renewed += 1
+        if renewed:
+            metrics.count('watch_channels_renewed', renewed)
+        return renewed
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='watch-renewal', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(min(self.renew_margin / 4, 300)):
+            self.renew_due()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            channels = list(self._channels.values())
+        for channel in channels:
+            self.stop(channel)
+
+
+# --- Webhook receiver ---
+class NotificationHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        # Notifications carry everything in headers; drain any body so keep-alive works
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        status = self.server.channels.handle_notification(self.headers)
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class NotificationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, channels):
+        super().__init__(server_address, NotificationHandler)
+        self.channels = channels
+
+
+def start_notification_server(channels, host='127.0.0.1', port=8765):
+    """Serve notifications for ``channels`` on a daemon thread; returns the server."""
+    server = NotificationServer((host, port), channels)
+    threading.Thread(target=server.serve_forever, name='watch-notifications', daemon=True).start()
+    logger.info("Receiving calendar notifications on http://%s:%d", host, server.server_port)
+    return server
+
+
+# --- Local stand-in for Google's push ---
+def send_notification(address, channel_id, token, resource_id, state='exists', message_number=1, timeout=5):
+    """POST a notification shaped like Google's to ``address``; returns the HTTP status."""
+    request = Request(address, data=b'', method='POST', headers={
+        'X-Goog-Channel-ID': channel_id,
+        'X-Goog-Channel-Token': token,
+        'X-Goog-Resource-ID': resource_id,
+        'X-Goog-Resource-State': state,
+        'X-Goog-Message-Number': str(message_number),
+    })
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            return response.status
+    except OSError as e:
+        # HTTPError carries the status; anything else means the receiver is unreachable
+        return getattr(e, 'code', None)
+